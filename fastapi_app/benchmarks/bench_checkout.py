@@ -0,0 +1,84 @@
+"""
+contention benchmark of the checkout engine: many concurrent checkouts of one hot product
+
+run from the repository root against a database with the schema applied:
+    python -m fastapi_app.benchmarks.bench_checkout --baskets 500 --stock 300 --concurrency 100
+checks that exactly min(stock, baskets) checkouts succeed and the stock never goes negative
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import select, insert, delete
+
+from ..database import init_engine, dispose_engine, async_session_maker
+from ..settings import Settings, ENV_FILE
+from ..lib.checkout import checkout, CheckoutError
+from ..models import User, Shop, Product, ProductInShop, Basket, ProductInBasket
+
+
+async def prepare(baskets: int, stock: int) -> tuple[int, int, int, int, list[int]]:
+    """bench user, shop and hot product with baskets of one unit each"""
+    tag = uuid.uuid4().hex[:8]
+    async with async_session_maker() as session:
+        user_id = (await session.execute(insert(User).values(login=f"bench_{tag}", mail=f"bench_{tag}@example.com", pwd_hash="-").returning(User.id))).scalar_one()
+        shop_id = (await session.execute(insert(Shop).values(owner_id=user_id, name=f"bench_{tag}").returning(Shop.id))).scalar_one()
+        product_id = (await session.execute(insert(Product).values(name=f"bench_{tag}", user_id=user_id).returning(Product.id))).scalar_one()
+        product_in_shop_id = (await session.execute(
+            insert(ProductInShop).values(shop_id=shop_id, product_id=product_id, amount=stock, price=100.0).returning(ProductInShop.id)
+        )).scalar_one()
+        basket_ids = (await session.execute(insert(Basket).values([{"user_id": user_id, "is_paid": False}] * baskets).returning(Basket.id))).scalars().all()
+        await session.execute(insert(ProductInBasket).values([
+            {"basket_id": basket_id, "product_in_shop_id": product_in_shop_id, "amount": 1} for basket_id in basket_ids
+        ]))
+        await session.commit()
+    return user_id, shop_id, product_id, product_in_shop_id, list(basket_ids)
+
+
+async def main(baskets: int, stock: int, concurrency: int) -> None:
+    init_engine(Settings.from_env(ENV_FILE))
+    user_id, shop_id, product_id, product_in_shop_id, basket_ids = await prepare(baskets, stock)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    failures = 0
+
+    async def run(basket_id: int) -> None:
+        nonlocal failures
+        async with semaphore, async_session_maker() as session:
+            started = time.perf_counter()
+            try:
+                await checkout(session, basket_id, user_id)
+            except CheckoutError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[run(basket_id) for basket_id in basket_ids])
+    elapsed = time.perf_counter() - started
+
+    async with async_session_maker() as session:
+        left = (await session.execute(select(ProductInShop.amount).where(ProductInShop.id == product_in_shop_id))).scalar_one()
+        #корзины и чеки удаляются каскадно вместе с пользователем
+        await session.execute(delete(Shop).where(Shop.id == shop_id))
+        await session.execute(delete(Product).where(Product.id == product_id))
+        await session.execute(delete(User).where(User.id == user_id))
+        await session.commit()
+    await dispose_engine()
+
+    latencies.sort()
+    succeeded = baskets - failures
+    print(f"checkouts: {baskets}, concurrency: {concurrency}, elapsed: {elapsed:.2f} s, throughput: {baskets / elapsed:.1f}/s")
+    print(f"p50: {latencies[len(latencies) // 2] * 1000:.1f} ms, p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"succeeded: {succeeded}, rejected: {failures}, stock left: {left}")
+    assert left >= 0, "stock went negative"
+    assert succeeded == min(stock, baskets) and left == stock - succeeded, "oversold or lost checkouts"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baskets", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.baskets, args.stock, args.concurrency))
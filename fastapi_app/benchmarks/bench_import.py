@@ -0,0 +1,77 @@
+"""
+bulk inventory import benchmark: a generated price list is imported twice, as inserts and then as updates
+
+run from the repository root against a database with the schema applied:
+    python -m fastapi_app.benchmarks.bench_import --rows 100000 --format csv
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import orjson
+from sqlalchemy import insert, delete
+
+from ..database import init_engine, dispose_engine, async_session_maker
+from ..settings import Settings, ENV_FILE
+from ..lib.inventory_import import import_inventory, CSV_MEDIA_TYPE
+from ..lib.responses import NDJSON_MEDIA_TYPE
+from ..models import User, Shop, Product
+
+CHUNK_SIZE = 64 * 1024 #размер чанка тела запроса, как у сервера
+
+
+async def prepare(rows: int) -> tuple[int, int, list[int]]:
+    tag = uuid.uuid4().hex[:8]
+    async with async_session_maker() as session:
+        user_id = (await session.execute(insert(User).values(login=f"bench_{tag}", mail=f"bench_{tag}@example.com", pwd_hash="-").returning(User.id))).scalar_one()
+        shop_id = (await session.execute(insert(Shop).values(owner_id=user_id, name=f"bench_{tag}").returning(Shop.id))).scalar_one()
+        product_ids: list[int] = []
+        for start in range(0, rows, 10_000):
+            product_ids += (await session.execute(
+                insert(Product).values([{"name": f"bench_{tag}_{i}", "user_id": user_id} for i in range(start, min(start + 10_000, rows))]).returning(Product.id)
+            )).scalars().all()
+        await session.commit()
+    return user_id, shop_id, product_ids
+
+
+def price_list(product_ids: list[int], media_type: str) -> bytes:
+    if media_type == CSV_MEDIA_TYPE:
+        lines = ["product_id,amount,price"] + [f"{product_id},{random.randint(0, 1000)},{random.randint(100, 100_000) / 100}" for product_id in product_ids]
+        return ("\n".join(lines) + "\n").encode()
+    return b"".join(orjson.dumps({"product_id": product_id, "amount": random.randint(0, 1000), "price": random.randint(100, 100_000) / 100}) + b"\n" for product_id in product_ids)
+
+
+async def chunks(body: bytes):
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+async def main(rows: int, media_type: str) -> None:
+    init_engine(Settings.from_env(ENV_FILE))
+    user_id, shop_id, product_ids = await prepare(rows)
+    try:
+        for run in ("insert", "update"):
+            body = price_list(product_ids, media_type)
+            async with async_session_maker() as session:
+                started = time.perf_counter()
+                report = await import_inventory(session, shop_id, media_type, chunks(body))
+                elapsed = time.perf_counter() - started
+            print(f"{run}: {rows} rows, {len(body) / 1024 / 1024:.1f} MiB in {elapsed:.2f} s ({rows / elapsed:.0f} rows/s), "
+                  f"inserted: {report.inserted}, updated: {report.updated}, rejected: {report.rejected}")
+    finally:
+        async with async_session_maker() as session:
+            await session.execute(delete(Shop).where(Shop.id == shop_id))
+            await session.execute(delete(Product).where(Product.user_id == user_id))
+            await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, CSV_MEDIA_TYPE if args.format == "csv" else NDJSON_MEDIA_TYPE))
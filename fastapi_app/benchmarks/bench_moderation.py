@@ -0,0 +1,78 @@
+"""
+moderation queue benchmark: parallel workers drain a backlog of shop confirmation requests
+
+run from the repository root against a database with the schema applied:
+    python -m fastapi_app.benchmarks.bench_moderation --requests 20000 --workers 16 --batch 100
+checks that every request is decided exactly once
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from sqlalchemy import insert, delete
+
+from ..database import init_engine, dispose_engine, async_session_maker
+from ..settings import Settings, ENV_FILE
+from ..lib.moderation import QUEUES, claim, decide
+from ..models import User, Shop, ShopRequestForConfirmation
+
+
+async def prepare(requests: int, workers: int) -> tuple[int, list[int]]:
+    """one owner with a shop per request and a moderator per worker"""
+    tag = uuid.uuid4().hex[:8]
+    async with async_session_maker() as session:
+        user_ids = (await session.execute(
+            insert(User).values([
+                {"login": f"bench_{tag}_{i}", "mail": f"bench_{tag}_{i}@example.com", "pwd_hash": "-", "is_admin": i > 0} for i in range(workers + 1)
+            ]).returning(User.id)
+        )).scalars().all()
+        owner_id, moderator_ids = user_ids[0], list(user_ids[1:])
+        shop_ids: list[int] = []
+        for start in range(0, requests, 10_000):
+            count = min(10_000, requests - start)
+            shop_ids += (await session.execute(
+                insert(Shop).values([{"owner_id": owner_id, "name": f"bench_{tag}"}] * count).returning(Shop.id)
+            )).scalars().all()
+            await session.execute(insert(ShopRequestForConfirmation).values([{"shop_id": shop_id} for shop_id in shop_ids[start:]]))
+        await session.commit()
+    return owner_id, moderator_ids
+
+
+async def main(requests: int, workers: int, batch: int) -> None:
+    init_engine(Settings.from_env(ENV_FILE))
+    owner_id, moderator_ids = await prepare(requests, workers)
+    queue = QUEUES["shops"]
+    decided_ids: list[int] = []
+
+    async def work(moderator_id: int) -> None:
+        while True:
+            async with async_session_maker() as session:
+                claimed = await claim(session, queue, moderator_id, batch)
+                if not claimed: return
+                decided = await decide(session, queue, moderator_id, [(row.id, random.random() < 0.1) for row in claimed])
+            decided_ids.extend(row.id for row in decided)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*[work(moderator_id) for moderator_id in moderator_ids])
+        elapsed = time.perf_counter() - started
+        print(f"requests: {requests}, workers: {workers}, batch: {batch}, elapsed: {elapsed:.2f} s, throughput: {len(decided_ids) / elapsed:.0f} requests/s")
+        assert len(decided_ids) == len(set(decided_ids)), "a request was decided twice"
+        assert len(decided_ids) >= requests, "requests left in the queue"
+    finally:
+        async with async_session_maker() as session:
+            await session.execute(delete(Shop).where(Shop.owner_id == owner_id))
+            await session.execute(delete(User).where(User.id.in_([owner_id, *moderator_ids])))
+            await session.commit()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.workers, args.batch))
@@ -0,0 +1,71 @@
+"""
+micro-benchmark of the response layer on a 10k-row payload
+
+run from the repository root:
+    python -m fastapi_app.benchmarks.bench_responses
+"""
+import timeit
+from typing import Any, Mapping
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, select, insert, MetaData, Table, Column, Integer, String
+
+from ..lib.responses import JResponse
+
+
+ROWS = 10_000
+REPEAT = 20
+
+
+#JResponse до перехода на orjson, для сравнения
+class LegacyJResponse(JSONResponse):
+    content = {
+        "status" : "ok",
+        "message" : "",
+        "body" : None
+    }
+
+    def __init__(self, message: str = "Success", body: Any | None = None, status_code: int = 200, headers: Mapping[str, str] | None = None) -> None:
+        self.content["message"] = message
+        self.content["body"] = body
+        super().__init__(self.content, status_code, headers)
+
+
+def make_rows():
+    """RowMapping objects shaped like the get_users response, from an in-memory sqlite table"""
+    metadata = MetaData()
+    user = Table(
+        "user", metadata,
+        Column("id", Integer, primary_key=True),
+        *[Column(name, String(255)) for name in ("login", "name", "surname", "patronymic", "mail", "avatar_img")]
+    )
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(user), [
+            {
+                "login": f"user{i}",
+                "name": "Иван",
+                "surname": "Иванов",
+                "patronymic": "Иванович",
+                "mail": f"user{i}@example.com",
+                "avatar_img": "default.png"
+            }
+            for i in range(ROWS)
+        ])
+        return connection.execute(select(user)).mappings().all()
+
+
+def main():
+    rows = make_rows()
+    cases = {
+        "legacy JResponse, dict(row) copies": lambda: LegacyJResponse(body=[dict(row) for row in rows]),
+        "JResponse, RowMapping as is": lambda: JResponse(body=rows),
+    }
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=REPEAT))
+        print(f"{name:40} {best * 1000:8.2f} ms / response")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+startup benchmark: import time, lifespan startup time and the first burst of authenticated requests,
+with a cold pool (DB_POOL_WARMUP=0) and with a pre-warmed one
+
+run from the repository root against a database with the schema applied and at least one user; the app reads
+its configuration from the environment when modules are imported, so the .env file is loaded by the runner:
+    python -m dotenv -f fastapi_app/.env run python -m fastapi_app.benchmarks.bench_startup --login seed_1 --burst 20 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import replace
+
+import httpx
+from sqlalchemy import select
+
+from ..database import init_engine, dispose_engine, async_session_maker
+from ..lib.cache import cache, user_key
+from ..lib.secure import create_jwt
+from ..main import create_app
+from ..models import User
+from ..settings import Settings
+
+IMPORT_CODE = "import time; started = time.perf_counter(); import fastapi_app.main; print(time.perf_counter() - started)"
+
+
+def import_time(rounds: int) -> float:
+    """median import time of fastapi_app.main in a fresh interpreter"""
+    times = [float(subprocess.run([sys.executable, "-c", IMPORT_CODE], capture_output=True, text=True, check=True, env=os.environ).stdout)
+             for _ in range(rounds)]
+    return statistics.median(times)
+
+
+async def issue_token(settings: Settings, login: str) -> tuple[int, str]:
+    init_engine(settings)
+    async with async_session_maker() as session:
+        user: User = (await session.execute(select(User).where(User.login == login))).scalar_one()
+        token = await create_jwt(user, session, is_refresh=False)
+    await dispose_engine()
+    return user.id, token
+
+
+async def first_burst(settings: Settings, user_id: int, token: str, burst: int) -> tuple[float, list[float]]:
+    """lifespan startup time and latencies of burst concurrent requests sent right after it"""
+    app = create_app(settings)
+    await cache.invalidate(user_key(user_id))
+
+    async def timed(client: httpx.AsyncClient) -> float:
+        started = time.perf_counter()
+        response = await client.get(f"/api/v1/users/{user_id}", headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            latencies = await asyncio.gather(*[timed(client) for _ in range(burst)])
+    return startup, sorted(latencies)
+
+
+async def main(login: str, burst: int, rounds: int, warmup: int | None) -> None:
+    settings = Settings.from_env()
+    warm = warmup if warmup is not None else settings.db_pool_warmup
+    print(f"import fastapi_app.main: {import_time(rounds) * 1000:.0f} ms (median of {rounds})")
+    user_id, token = await issue_token(settings, login)
+    for name, connections in (("cold pool", 0), (f"warm pool ({warm})", warm)):
+        startups, firsts, p50s, maxes = [], [], [], []
+        for _ in range(rounds):
+            startup, latencies = await first_burst(replace(settings, db_pool_warmup=connections), user_id, token, burst)
+            startups.append(startup)
+            firsts.append(latencies[0])
+            p50s.append(statistics.median(latencies))
+            maxes.append(latencies[-1])
+        print(f"{name}: startup {statistics.median(startups) * 1000:.1f} ms, first {burst} requests: "
+              f"fastest {statistics.median(firsts) * 1000:.1f} ms, p50 {statistics.median(p50s) * 1000:.1f} ms, "
+              f"max {statistics.median(maxes) * 1000:.1f} ms (medians of {rounds})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--login", default="seed_1", help="existing user the requests are authenticated as")
+    parser.add_argument("--burst", type=int, default=20, help="concurrent requests right after startup")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=None, help="warm connections, DB_POOL_WARMUP by default")
+    args = parser.parse_args()
+    asyncio.run(main(args.login, args.burst, args.rounds, args.warmup))
@@ -0,0 +1,81 @@
+"""
+runs EXPLAIN on the router queries and fails if any of them plans a sequential scan
+
+run from the repository root against a seeded database:
+    python -m fastapi_app.benchmarks.explain_queries
+on a small database the planner prefers seq scans anyway, --no-seqscan checks that an index can serve every query:
+    python -m fastapi_app.benchmarks.explain_queries --no-seqscan
+"""
+import argparse
+import asyncio
+import sys
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, text, Select
+from sqlalchemy.dialects import postgresql
+
+from ..database import init_engine, dispose_engine
+from ..settings import Settings, ENV_FILE
+from ..lib.rollups import sales_report
+from ..models import User, JWT, Shop, ShopImage, Position, ShopAndUser, ProductInShop, Payment, ShopRequestForConfirmation
+
+
+#запросы роутеров с характерными параметрами
+QUERIES: dict[str, Select] = {
+    "auth: user by jwt": select(User).join(JWT, JWT.user == User.id).where(JWT.token_id == "0" * 32, JWT.is_revoked == False),
+    "signin: user by login": select(User).where(User.login == "user1"),
+    "get_shops: page": select(Shop.id, Shop.name).where(Shop.is_deleted == False, Shop.id > 1000).order_by(Shop.id).limit(50),
+    "get_shops: confirmed page": select(Shop.id).where(Shop.is_deleted == False, Shop.is_confirmed == True, Shop.id > 1000).order_by(Shop.id).limit(50),
+    "get_shops: name prefix": select(Shop.id).where(Shop.is_deleted == False, Shop.name.startswith("shop1")).order_by(Shop.id).limit(50),
+    "get_shops: page images": select(ShopImage.shop_id, ShopImage.src).where(ShopImage.shop_id.in_(range(1, 51))).order_by(ShopImage.shop_id, ShopImage.id),
+    "get_shop: shop": select(Shop).where(Shop.id == 1),
+    "get_shop: images": select(ShopImage.src).where(ShopImage.shop_id == 1),
+    "shops of owner": select(Shop.id).where(Shop.owner_id == 1),
+    "get_job_titles: positions of creator": select(Position).where(Position.creator_id == 1),
+    "staff of shop": select(ShopAndUser).where(ShopAndUser.shop_id == 1),
+    "get_shop_staff: page": select(ShopAndUser.id, ShopAndUser.user_id, ShopAndUser.position_id).where(ShopAndUser.shop_id == 1, ShopAndUser.user_id > 100).order_by(ShopAndUser.user_id).limit(50),
+    "holders of position": select(ShopAndUser.user_id, ShopAndUser.shop_id).where(ShopAndUser.position_id == 1),
+    "shops of employee": select(ShopAndUser).where(ShopAndUser.user_id == 1),
+    "products of shop": select(ProductInShop).where(ProductInShop.shop_id == 1),
+    "shops of product": select(ProductInShop).where(ProductInShop.product_id == 1),
+    "payments of shop for period": select(Payment).where(Payment.shop_id == 1, Payment.date_of_creation >= datetime.now() - timedelta(days=7)),
+    "payments for period": select(Payment).where(Payment.date_of_creation >= datetime.now() - timedelta(hours=1)),
+    "moderation: pending shop requests": select(ShopRequestForConfirmation.id).where(ShopRequestForConfirmation.is_processed == False).order_by(ShopRequestForConfirmation.id).limit(50),
+    "shop analytics by day": sales_report(1, date.today() - timedelta(days=30), date.today(), "day"),
+    "shop analytics by product": sales_report(1, date.today() - timedelta(days=30), date.today(), "product"),
+}
+
+
+def find_seq_scans(plan: dict) -> list[str]:
+    """relation names of all Seq Scan nodes of the plan"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan": found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found += find_seq_scans(child)
+    return found
+
+
+async def main(no_seqscan: bool) -> int:
+    engine = init_engine(Settings.from_env(ENV_FILE))
+    failed = 0
+    async with engine.connect() as connection:
+        if no_seqscan: await connection.execute(text("SET enable_seqscan = off"))
+        for name, query in QUERIES.items():
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            result = await connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            plan = result.scalar_one()[0]["Plan"]
+            seq_scans = find_seq_scans(plan)
+            if seq_scans:
+                failed += 1
+                print(f"FAIL {name}: seq scan on {', '.join(seq_scans)}")
+            else:
+                print(f"ok   {name}")
+    await dispose_engine()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-seqscan", action="store_true", help="disable seq scans in the planner to check that indexes exist")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(main(args.no_seqscan)) else 0)
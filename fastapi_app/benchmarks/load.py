@@ -0,0 +1,128 @@
+"""
+async load driver replaying a weighted endpoint mix against a running app
+
+seed the database first (fastapi_app.benchmarks.seed), start the app
+(uvicorn --factory fastapi_app.main:create_app --env-file fastapi_app/.env) and run from the repository root:
+    python -m fastapi_app.benchmarks.load --url http://127.0.0.1:8000 --duration 60 --concurrency 64 --mix shops=4,user=4,users=1,signin=1
+
+scenarios:
+    signin  POST /signin with a random seeded user (bcrypt on every call)
+    shops   GET /shops/ page after a random shop id
+    shop    GET /shops/{id} of a random shop
+    users   GET /users/ page after a random user id
+    user    GET /users/{id} of a random user, mostly the cost of the auth dependency
+
+the driver signs in --sessions users before the run and spreads their tokens over the workers.
+Rate limits apply to the driver's address, for signin runs start the app with raised RATE_LIMIT_SIGNIN_IP and RATE_LIMIT_SIGNIN_LOGIN
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+API_VERSION = "/api/v1"
+SCENARIOS = ("signin", "shops", "shop", "users", "user")
+
+
+class Scenarios:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+
+    def random_login(self) -> str:
+        return f"{self.args.prefix}_{random.randrange(self.args.users)}"
+
+    async def signin(self, client: httpx.AsyncClient, token: str) -> httpx.Response:
+        return await client.post(f"{API_VERSION}/signin", data={"username": self.random_login(), "password": self.args.password})
+
+    async def shops(self, client: httpx.AsyncClient, token: str) -> httpx.Response:
+        return await client.get(f"{API_VERSION}/shops/", params={"after_id": random.randrange(self.args.shops), "limit": 50}, headers=_auth(token))
+
+    async def shop(self, client: httpx.AsyncClient, token: str) -> httpx.Response:
+        return await client.get(f"{API_VERSION}/shops/{random.randrange(1, self.args.shops)}", headers=_auth(token))
+
+    async def users(self, client: httpx.AsyncClient, token: str) -> httpx.Response:
+        return await client.get(f"{API_VERSION}/users/", params={"after_id": random.randrange(self.args.users), "limit": 50}, headers=_auth(token))
+
+    async def user(self, client: httpx.AsyncClient, token: str) -> httpx.Response:
+        return await client.get(f"{API_VERSION}/users/{random.randrange(1, self.args.users)}", headers=_auth(token))
+
+
+def _auth(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {name: int(weight) for name, weight in (item.split("=") for item in mix.split(","))}
+    unknown = [name for name in weights if name not in SCENARIOS]
+    if unknown: raise SystemExit(f"unknown scenarios: {', '.join(unknown)}")
+    return weights
+
+
+def percentile(values: list[float], share: float) -> float:
+    """nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, max(0, round(share * len(values)) - 1))]
+
+
+async def sign_in(client: httpx.AsyncClient, args: argparse.Namespace, count: int) -> list[str]:
+    tokens: list[str] = []
+    for n in range(count):
+        response = await client.post(f"{API_VERSION}/signin", data={"username": f"{args.prefix}_{n + 1}", "password": args.password})
+        if response.status_code != 200: raise SystemExit(f"signin of {args.prefix}_{n + 1} failed: {response.status_code} {response.text}")
+        tokens.append(response.json()["access_token"])
+    return tokens
+
+
+async def main(args: argparse.Namespace) -> None:
+    weights = parse_mix(args.mix)
+    scenarios = Scenarios(args)
+    names, mix_weights = list(weights), list(weights.values())
+    latencies: defaultdict[str, list[float]] = defaultdict(list)
+    statuses: defaultdict[str, Counter[int]] = defaultdict(Counter)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        tokens = await sign_in(client, args, args.sessions)
+        warmup_end = time.perf_counter() + args.warmup
+        deadline = warmup_end + args.duration
+
+        async def worker(token: str) -> None:
+            while (started := time.perf_counter()) < deadline:
+                name = random.choices(names, mix_weights)[0]
+                try:
+                    status = (await getattr(scenarios, name)(client, token)).status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                if started < warmup_end: continue
+                latencies[name].append(time.perf_counter() - started)
+                statuses[name][status] += 1
+
+        await asyncio.gather(*[worker(tokens[n % len(tokens)]) for n in range(args.concurrency)])
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"concurrency: {args.concurrency}, duration: {args.duration} s, requests: {total}, throughput: {total / args.duration:.1f} req/s")
+    print(f"{'scenario':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for name in names:
+        values = sorted(latencies[name])
+        if not values: continue
+        print(f"{name:<10}{len(values):>10}{len(values) / args.duration:>10.1f}"
+              + "".join(f"{percentile(values, share) * 1000:>10.1f}" for share in (0.5, 0.95, 0.99))
+              + f"{values[-1] * 1000:>10.1f}  {dict(statuses[name])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mix", default="shops=4,user=4,users=1,signin=1", help="scenario=weight pairs")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight")
+    parser.add_argument("--sessions", type=int, default=16, help="users signed in before the run")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--users", type=int, default=1_000_000, help="seeded users")
+    parser.add_argument("--shops", type=int, default=200_000, help="seeded shops")
+    parser.add_argument("--prefix", default="seed")
+    parser.add_argument("--password", default="password")
+    asyncio.run(main(parser.parse_args()))
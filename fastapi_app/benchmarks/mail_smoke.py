@@ -0,0 +1,80 @@
+"""
+outbox dispatcher check against an in-process smtp server
+
+needs aiosmtpd (pip install aiosmtpd) and a database with the schema applied, run from the repository root:
+    python -m fastapi_app.benchmarks.mail_smoke --messages 1000
+messages to reject@example.com are refused with 550 and must end up failed, the rest must be delivered once
+"""
+import argparse
+import asyncio
+import time
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import select, delete
+
+from ..database import init_engine, dispose_engine, async_session_maker
+from ..settings import Settings, ENV_FILE
+from ..lib.mail_outbox import SmtpPool, enqueue_mail, dispatch_batch
+from ..models import MailOutbox
+
+REJECTED = "reject@example.com"
+
+
+class Handler:
+    def __init__(self) -> None:
+        self.received: list[str] = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REJECTED: return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += envelope.rcpt_tos
+        return "250 Message accepted for delivery"
+
+
+async def main(messages: int, port: int, pool_size: int, batch_size: int) -> None:
+    settings = Settings.from_env(ENV_FILE)
+    init_engine(settings)
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    pool = SmtpPool("127.0.0.1", port, size=pool_size, user=None, starttls=False, sender=settings.smtp_sender)
+    try:
+        async with async_session_maker() as session:
+            first_id = (await session.execute(select(MailOutbox.id).order_by(MailOutbox.id.desc()).limit(1))).scalar_one_or_none() or 0
+            for i in range(messages):
+                await enqueue_mail(session, f"user{i}@example.com", "smoke", f"message {i}", ttl=600)
+            await enqueue_mail(session, REJECTED, "smoke", "rejected message", ttl=600)
+            await session.commit()
+
+        started = time.perf_counter()
+        while await dispatch_batch(pool, batch_size, settings.mail_lease): pass
+        elapsed = time.perf_counter() - started
+
+        async with async_session_maker() as session:
+            statuses = dict((await session.execute(
+                select(MailOutbox.recipient, MailOutbox.status).where(MailOutbox.id > first_id, MailOutbox.subject == "smoke")
+            )).all())
+        print(f"messages: {messages}, pool: {pool_size}, batch: {batch_size}, elapsed: {elapsed:.2f} s, throughput: {messages / elapsed:.0f} messages/s")
+        assert len(handler.received) == len(set(handler.received)) == messages, f"delivered {len(handler.received)} of {messages}"
+        assert statuses[REJECTED] == "failed", f"rejected message is {statuses[REJECTED]}"
+        assert all(status == "sent" for recipient, status in statuses.items() if recipient != REJECTED)
+    finally:
+        pool.close()
+        controller.stop()
+        async with async_session_maker() as session:
+            await session.execute(delete(MailOutbox).where(MailOutbox.subject == "smoke"))
+            await session.commit()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.port, args.pool_size, args.batch))
@@ -0,0 +1,179 @@
+"""
+synthetic marketplace data for load tests, loaded with COPY
+
+run from the repository root against a local database with the schema applied:
+    python -m fastapi_app.benchmarks.seed --users 1000000 --shops 200000 --products 500000 --payments 2000000
+
+every seeded user has the login {prefix}_{n} and the password --password, fastapi_app.benchmarks.load signs in with them.
+Ids are reserved from the table sequences, so nothing else should write to the database while seeding.
+The prefix has to be new for the database, logins and mails are unique
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..database import init_engine, dispose_engine
+from ..settings import Settings, ENV_FILE
+from ..lib.password_hasher import bcrypt_context
+
+COPY_BATCH_SIZE = 50_000     #строк в одном COPY, генерация идет потоком
+IMAGE_POOL_SIZE = 1_000      #различных изображений, на которые ссылаются магазины
+CATEGORIES = 50
+TAX_RATE = 0.13
+SESSION_USERS = 1_000        #первые пользователи не блокируются, под ними работает нагрузочный драйвер
+
+FIRST_NAMES = ["Alex", "Maria", "Ivan", "Olga", "Dmitry", "Anna", "Sergey", "Elena", "Pavel", "Irina", "Nikita", "Daria"]
+SURNAMES = ["Smirnov", "Ivanova", "Kuznetsov", "Popova", "Sokolov", "Lebedeva", "Kozlov", "Novikova", "Morozov", "Volkova"]
+WORDS = ["green", "market", "fresh", "home", "tech", "style", "urban", "craft", "daily", "prime", "north", "garden", "sport", "kids"]
+GOODS = ["tea", "coffee", "lamp", "chair", "phone case", "backpack", "sneakers", "jacket", "mug", "notebook", "headphones", "blanket"]
+
+
+def batched(records: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    iterator = iter(records)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+async def reserve_ids(connection: AsyncConnection, table: str, count: int) -> int:
+    """moves the id sequence of the table past count ids and returns the first of them"""
+    sequence = f"pg_get_serial_sequence('\"{table}\"', 'id')"
+    first = (await connection.execute(text(f"SELECT nextval({sequence})"))).scalar_one()
+    if count > 1: await connection.execute(text(f"SELECT setval({sequence}, :last)"), {"last": first + count - 1})
+    return first
+
+
+async def copy(connection: AsyncConnection, table: str, columns: list[str], records: Iterable[tuple]) -> None:
+    driver = (await connection.get_raw_connection()).driver_connection
+    started = time.perf_counter()
+    rows = 0
+    for batch in batched(records, COPY_BATCH_SIZE):
+        await driver.copy_records_to_table(table, records=batch, columns=columns)
+        rows += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f"{table}: {rows} rows in {elapsed:.1f} s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+def product_price(product_index: int) -> float:
+    return round(1 + (product_index * 7919) % 100_000 / 100, 2)
+
+
+def past(days: int) -> datetime:
+    return datetime.now() - timedelta(days=random.random() * days)
+
+
+async def seed(args: argparse.Namespace) -> None:
+    engine = init_engine(Settings.from_env(ENV_FILE))
+    random.seed(args.seed)
+    pwd_hash = bcrypt_context.hash(args.password) #один хэш на всех, bcrypt на миллион пользователей занял бы часы
+    products_per_shop = min(args.products_per_shop, args.products)
+    prefix = args.prefix
+
+    async with engine.begin() as connection:
+        user_id = await reserve_ids(connection, "user", args.users)
+        category_id = await reserve_ids(connection, "category", CATEGORIES)
+        shop_id = await reserve_ids(connection, "shop", args.shops)
+        image_id = await reserve_ids(connection, "shop_image", args.shops * args.images_per_shop)
+        position_id = await reserve_ids(connection, "position", args.shops * args.positions_per_shop)
+        staff_id = await reserve_ids(connection, "shop_and_user", args.shops * args.staff_per_shop)
+        product_id = await reserve_ids(connection, "product", args.products)
+        product_in_shop_id = await reserve_ids(connection, "product_in_shop", args.shops * products_per_shop)
+        baskets = max(1, args.payments // 3)
+        basket_id = await reserve_ids(connection, "basket", baskets)
+        payment_id = await reserve_ids(connection, "payment", args.payments)
+
+        def shop_owner(shop: int) -> int:
+            return user_id + shop * 7 % args.users
+
+        #первый пользователь - суперпользователь, для модерации и управления ролями
+        await copy(connection, "user", ["id", "login", "mail", "pwd_hash", "name", "surname", "is_verified", "is_admin", "is_superuser", "is_blocked", "avatar_img"], (
+            (user_id + n, f"{prefix}_{n}", f"{prefix}_{n}@example.com", pwd_hash, random.choice(FIRST_NAMES), random.choice(SURNAMES),
+             random.random() < 0.9, n == 0, n == 0, n >= SESSION_USERS and random.random() < 0.01, "default.png")
+            for n in range(args.users)
+        ))
+        await copy(connection, "category", ["id", "name"], ((category_id + n, f"{prefix} category {n}") for n in range(CATEGORIES)))
+
+        await copy(connection, "shop", ["id", "owner_id", "name", "description", "avatar_img", "is_deleted", "is_confirmed", "confirmation_date", "date_of_creation"], (
+            (shop_id + n, shop_owner(n), f"{random.choice(WORDS)} {random.choice(WORDS)} {n}", f"{prefix} shop {n}", "default.png",
+             random.random() < 0.02, (confirmed := random.random() < 0.7), date.today() if confirmed else None, past(730))
+            for n in range(args.shops)
+        ))
+
+        digests = [hashlib.sha256(f"{prefix}:{n}".encode()).hexdigest() for n in range(IMAGE_POOL_SIZE)]
+        ref_counts = [0] * IMAGE_POOL_SIZE
+        def shop_images() -> Iterator[tuple]:
+            for n in range(args.shops * args.images_per_shop):
+                image = random.randrange(IMAGE_POOL_SIZE)
+                ref_counts[image] += 1
+                yield image_id + n, shop_id + n // args.images_per_shop, digests[image]
+        await copy(connection, "shop_image", ["id", "shop_id", "src"], shop_images())
+        #файлов изображений нет, сами картинки отдаются с 404, списки магазинов от этого не зависят
+        await copy(connection, "image_blob", ["digest", "size", "content_type", "ref_count", "date_of_creation"], (
+            (digest, random.randint(20_000, 400_000), "image/jpeg", ref_count, datetime.now())
+            for digest, ref_count in zip(digests, ref_counts) if ref_count
+        ))
+
+        await copy(connection, "position", ["id", "name", "creator_id", "can_add_staff", "can_change_staff", "can_delete_staff",
+                                            "can_add_product", "can_change_product", "can_delete_product", "date_of_creation"], (
+            (position_id + n, f"position {n % args.positions_per_shop}", shop_owner(n // args.positions_per_shop),
+             *(random.random() < 0.5 for _ in range(6)), past(365))
+            for n in range(args.shops * args.positions_per_shop)
+        ))
+        await copy(connection, "shop_and_user", ["id", "user_id", "shop_id", "position_id"], (
+            (staff_id + shop * args.staff_per_shop + k, user_id + staff, shop_id + shop,
+             position_id + shop * args.positions_per_shop + random.randrange(args.positions_per_shop) if args.positions_per_shop else None)
+            for shop in range(args.shops)
+            for k, staff in enumerate(random.sample(range(args.users), min(args.staff_per_shop, args.users)))
+        ))
+
+        await copy(connection, "product", ["id", "name", "category_id", "user_id"], (
+            (product_id + n, f"{random.choice(WORDS)} {random.choice(GOODS)} {n}", category_id + n % CATEGORIES, shop_owner(n % args.shops))
+            for n in range(args.products)
+        ))
+        #продукты магазина идут подряд по кругу, внутри магазина не повторяются; платежи восстанавливают их по номеру
+        await copy(connection, "product_in_shop", ["id", "shop_id", "product_id", "amount", "price", "date_of_creation"], (
+            (product_in_shop_id + n, shop_id + n // products_per_shop, product_id + n % args.products,
+             random.randint(0, 500), product_price(n % args.products), past(365))
+            for n in range(args.shops * products_per_shop)
+        ))
+
+        await copy(connection, "basket", ["id", "user_id", "is_paid"], (
+            (basket_id + n, user_id + random.randrange(args.users), True) for n in range(baskets)
+        ))
+        def payments() -> Iterator[tuple]:
+            for n in range(args.payments):
+                item = random.randrange(args.shops * products_per_shop)
+                amount = random.randint(1, 5)
+                total = round(product_price(item % args.products) * amount, 2)
+                yield (payment_id + n, product_id + item % args.products, shop_id + item // products_per_shop, basket_id + n % baskets,
+                       amount, total, round(total * TAX_RATE, 2), past(365))
+        await copy(connection, "payment", ["id", "product_id", "shop_id", "basket_id", "amount", "total", "tax", "date_of_creation"], payments())
+
+    async with engine.connect() as connection:
+        for table in ("user", "category", "shop", "shop_image", "image_blob", "position", "shop_and_user", "product", "product_in_shop", "basket", "payment"):
+            await connection.execute(text(f'ANALYZE "{table}"'))
+    await dispose_engine()
+    print(f"users {prefix}_0 .. {prefix}_{args.users - 1} (password: {args.password}), {prefix}_0 is a superuser")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--shops", type=int, default=200_000)
+    parser.add_argument("--images-per-shop", type=int, default=3)
+    parser.add_argument("--positions-per-shop", type=int, default=2)
+    parser.add_argument("--staff-per-shop", type=int, default=3)
+    parser.add_argument("--products", type=int, default=500_000)
+    parser.add_argument("--products-per-shop", type=int, default=20)
+    parser.add_argument("--payments", type=int, default=2_000_000)
+    parser.add_argument("--prefix", default="seed")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed gives the same data")
+    asyncio.run(seed(parser.parse_args()))
@@ -1,10 +1,10 @@
 from configparser import ConfigParser
-from database import SQLALCHEMY_DATABASE_URL
+from settings import Settings, ENV_FILE
 
 
 config = ConfigParser()
 config.read('alembic.ini')
-config.set('alembic', 'sqlalchemy.url', SQLALCHEMY_DATABASE_URL)
+config.set('alembic', 'sqlalchemy.url', Settings.from_env(ENV_FILE).database_url)
 
 with open('alembic.ini', 'w') as configfile:
     config.write(configfile)
\ No newline at end of file
@@ -1,25 +1,142 @@
-import os
+import asyncio
+import time
+from contextlib import AsyncExitStack
 
-from dotenv import load_dotenv
 from typing import AsyncGenerator, Annotated
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import Executable, BigInteger, Text, cast, func
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
+from .settings import Settings
 
-load_dotenv()
 
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD  = os.getenv('POSTGRES_PASSWORD')
-POSTGRES_SERVER  = os.getenv('POSTGRES_SERVER')
-POSTGRES_PORT  = os.getenv('POSTGRES_PORT')
-POSTGRES_DB  = os.getenv('POSTGRES_DB')
+class PoolStats:
+    """counters of waits for a pool connection"""
 
-SQLALCHEMY_DATABASE_URL=f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}'
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, wait_time: float) -> None:
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+pool_stats = PoolStats()
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """queue pool that records how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+
+def _engine_options(settings: Settings) -> dict:
+    options = {"pool_pre_ping": settings.db_pool_pre_ping}
+    if settings.db_pgbouncer:
+        options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    if settings.db_pool_class == "null":
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=MonitoredPool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle
+        )
+    return options
+
+
+#движок создается при старте приложения (create_app -> lifespan), а не при импорте
+_engine: AsyncEngine | None = None
+#фабрика сессий импортируется модулями заранее и привязывается к движку в init_engine
+async_session_maker: sessionmaker[Session] = sessionmaker(class_=AsyncSession, expire_on_commit=False) #объекты остаются доступны после commit без повторной загрузки
+
+
+def init_engine(settings: Settings) -> AsyncEngine:
+    global _engine
+    _engine = create_async_engine(settings.database_url, **_engine_options(settings))
+    async_session_maker.configure(bind=_engine)
+    return _engine
+
+
+def get_engine() -> AsyncEngine:
+    if _engine is None: raise RuntimeError("database engine is not initialized, call init_engine first")
+    return _engine
+
+
+async def dispose_engine() -> None:
+    global _engine
+    if _engine is None: return
+    await _engine.dispose()
+    _engine = None
+
+
+async def warm_pool(engine: AsyncEngine, connections: int, statements: list[Executable]) -> None:
+    """
+    opens connections before traffic arrives and runs the hot statements on each of them
+
+    the connections are held together, so the pool really creates that many; asyncpg keeps the prepared
+    statements per connection, first requests then skip both the connect and the prepare round trips.
+    Only connections the pool keeps are opened: NullPool keeps none, and a queue pool closes overflow
+    connections on return, so the count is capped at its size
+    """
+    pool = engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool): return
+    connections = min(connections, pool.size())
+    if connections <= 0: return
+    async with AsyncExitStack() as stack:
+        opened = await asyncio.gather(*[stack.enter_async_context(engine.connect()) for _ in range(connections)])
+        await asyncio.gather(*[_prepare(connection, statements) for connection in opened])
+
+
+async def _prepare(connection, statements: list[Executable]) -> None:
+    for statement in statements:
+        await connection.execute(statement)
+    await connection.rollback()
+
+
+def snapshot_xid(snapshot_bound):
+    """xid8 from pg_snapshot_xmin / pg_snapshot_xmax of the statement snapshot as a number"""
+    return cast(cast(snapshot_bound(func.pg_current_snapshot()), Text), BigInteger)
+
+
+def pool_metrics() -> dict:
+    """pool saturation snapshot"""
+    pool = get_engine().pool
+    metrics = {
+        "pool_class": type(pool).__name__,
+        "checkouts": pool_stats.checkouts,
+        "timeouts": pool_stats.timeouts,
+        "wait_time_avg": pool_stats.wait_time_total / pool_stats.checkouts if pool_stats.checkouts else 0.0,
+        "wait_time_max": pool_stats.wait_time_max,
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        metrics.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow
+        )
+    return metrics
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL)
 
-async_session_maker: sessionmaker[Session] = sessionmaker(engine, class_=AsyncSession, expire_on_commit=True)
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
\ No newline at end of file
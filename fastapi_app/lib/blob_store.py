@@ -0,0 +1,157 @@
+### sys import
+import os
+
+### std import
+import asyncio
+import glob
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+### web import
+from sqlalchemy import select, delete, literal_column
+from sqlalchemy.engine import Result
+
+### custom import
+from ..database import async_session_maker
+from ..models import ImageBlob
+
+
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', 'media')                                 #корень хранилища изображений
+THUMBNAIL_SIZES = [int(size) for size in os.getenv('THUMBNAIL_SIZES', '256').split(',')]    #размеры превью, px по большей стороне
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))                              #процессы для генерации превью
+
+
+class BlobWriter:
+    """writes a blob to a temporary file, hashing it on the fly"""
+
+    def __init__(self, store: "BlobStore", max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_size: raise ValueError(f"file is larger than {self.max_size} bytes")
+        self._sha256.update(data)
+        self._file.write(data)
+
+    def close(self) -> str:
+        """closes the file and returns the sha256 digest of the content"""
+        self._file.close()
+        return self._sha256.hexdigest()
+
+    def discard(self) -> None:
+        if not self._file.closed: self._file.close()
+        if os.path.exists(self.temp_path): os.remove(self.temp_path)
+
+
+class BlobStore:
+    """
+    content-addressed file storage: a blob lives at <root>/<digest[:2]>/<digest[2:4]>/<digest>
+
+    reference counting is done in the image_blob table, the store only places and removes files
+    """
+
+    def __init__(self, root: str = BLOB_STORE_PATH) -> None:
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def thumbnail_path(self, digest: str, size: int | str) -> str:
+        return os.path.join(self.root, "thumbs", digest[:2], digest[2:4], f"{digest}_{size}.webp")
+
+    def writer(self, max_size: int) -> BlobWriter:
+        os.makedirs(self.temp_dir, exist_ok=True)
+        return BlobWriter(self, max_size)
+
+    def place(self, temp_path: str, digest: str) -> bool:
+        """moves a written blob into place, returns False if the same content is already stored"""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return True
+
+    def discard(self, temp_paths) -> None:
+        """removes temporary files that were not placed"""
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path): os.remove(temp_path)
+
+    def remove(self, digest: str) -> None:
+        for path in [self.path(digest), *glob.glob(self.thumbnail_path(digest, "*"))]:
+            if os.path.exists(path): os.remove(path)
+
+
+def _make_thumbnail(src: str, dst: str, size: int) -> None:
+    #выполняется в процессе пула
+    from PIL import Image
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as image:
+        image.thumbnail((size, size))
+        image.save(dst, "WEBP")
+
+
+_thumbnail_executor: ProcessPoolExecutor | None = None
+
+
+async def make_thumbnails(store: BlobStore, digests: list[str]) -> None:
+    """generates thumbnails in a process pool, meant to run as a background task after the response"""
+    global _thumbnail_executor
+    if _thumbnail_executor is None: _thumbnail_executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    loop = asyncio.get_running_loop()
+    jobs = [
+        loop.run_in_executor(_thumbnail_executor, _make_thumbnail, store.path(digest), store.thumbnail_path(digest, size), size)
+        for digest in digests for size in THUMBNAIL_SIZES
+    ]
+    for result in await asyncio.gather(*jobs, return_exceptions=True):
+        if isinstance(result, Exception): logging.error("thumbnail generation error:\n%s", result)
+
+
+async def sweep_unused_blobs(store: BlobStore, batch_size: int) -> int:
+    """
+    removes blobs without references, returns their number
+
+    files are removed while the rows are locked and the rows are deleted in the same transaction, so an upload of
+    the same content waits and places the file again. If the commit fails, only unreferenced rows are left
+    without files and the next sweep deletes them
+    """
+    async with async_session_maker() as session:
+        unused_r: Result = await session.execute(
+            select(ImageBlob.digest).where(ImageBlob.ref_count <= literal_column("0")).limit(batch_size).with_for_update(skip_locked=True)
+        )
+        unused: list[str] = unused_r.scalars().all()
+        if not unused: return 0
+        for digest in unused: store.remove(digest)
+        await session.execute(delete(ImageBlob).where(ImageBlob.digest.in_(unused)))
+        await session.commit()
+    return len(unused)
+
+
+async def run_blob_sweeper(store: BlobStore, interval: float, batch_size: int) -> None:
+    """background loop removing unreferenced blobs, full batches are removed back to back"""
+    while True:
+        try:
+            removed = await sweep_unused_blobs(store, batch_size)
+            if removed: logging.info("blob sweeper: %s unused blobs removed", removed)
+            if removed == batch_size: continue
+        except Exception as e:
+            logging.error("blob sweeper error:\n%s", e)
+        await asyncio.sleep(interval)
+
+
+def shutdown_thumbnail_executor() -> None:
+    global _thumbnail_executor
+    if _thumbnail_executor is not None:
+        _thumbnail_executor.shutdown(wait=False, cancel_futures=True)
+        _thumbnail_executor = None
+
+
+blob_store = BlobStore()
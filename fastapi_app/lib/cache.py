@@ -0,0 +1,119 @@
+### sys import
+import os
+
+### std import
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+#other imports
+import orjson
+
+### custom import
+from .responses import dumps
+
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')            #memory - LRU в памяти процесса, redis - общий кэш
+CACHE_TTL = float(os.getenv('CACHE_TTL', 60))                   #время жизни записи, сек
+CACHE_MAX_SIZE = int(os.getenv('CACHE_MAX_SIZE', 10_000))       #максимальное количество записей в памяти
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class MemoryBackend:
+    """in-process LRU with per-entry ttl"""
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None: return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """
+    shared cache over any client with the redis.asyncio interface: get(name), set(name, value, px=), delete(*names)
+
+    values are stored as json, a fake client with the same three methods can stand in for redis locally
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.client.get(key)
+        if value is None: return None
+        return orjson.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.client.set(key, dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys: await self.client.delete(*keys)
+
+
+class Cache:
+    """read-through cache with hit and miss counters"""
+
+    def __init__(self, backend, ttl: float = CACHE_TTL) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float | None = None) -> Any | None:
+        """returns the cached value or calls loader, None results are not cached; ttl overrides the cache ttl"""
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await loader()
+        if value is not None: await self.backend.set(key, value, self.ttl if ttl is None else ttl)
+        return value
+
+    async def invalidate(self, *keys: str) -> None:
+        await self.backend.delete(*keys)
+
+    def metrics(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def _create_backend():
+    if CACHE_BACKEND == "redis":
+        import redis.asyncio as redis #необязательная зависимость, нужна только для общего кэша
+        return RedisBackend(redis.from_url(REDIS_URL))
+    return MemoryBackend()
+
+
+#ключи кэша
+def user_key(user_id: int) -> str: return f"user:{user_id}"
+def shop_key(shop_id: int) -> str: return f"shop:{shop_id}"
+def blob_key(digest: str) -> str: return f"blob:{digest}"
+def permission_key(user_id: int, shop_id: int) -> str: return f"permissions:{user_id}:{shop_id}"
+
+
+cache = Cache(_create_backend())
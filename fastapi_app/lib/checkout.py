@@ -0,0 +1,106 @@
+### sys import
+import os
+
+### std import
+from datetime import datetime
+
+### web import
+from sqlalchemy import select, insert, update, values, column, Integer
+from sqlalchemy.engine import Result
+from sqlalchemy.engine.row import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+
+### custom import
+from ..models import Basket, ProductInBasket, ProductInShop, Payment
+
+
+CHECKOUT_TAX_RATE = float(os.getenv('CHECKOUT_TAX_RATE', 0.2))     #доля налога в стоимости
+
+
+class CheckoutError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, product_in_shop_ids: list[int]):
+        self.product_in_shop_ids = product_in_shop_ids
+        super().__init__(f"not enough products in stock: {product_in_shop_ids}")
+
+
+async def checkout(session: AsyncSession, basket_id: int, user_id: int) -> list[RowMapping]:
+    """
+    pays the basket in one transaction: marks it paid, decrements stock and writes payments
+
+    stock rows are locked in id order, so concurrent checkouts cannot deadlock, and a row is
+    decremented only while amount >= requested, so stock never goes negative. Rolls back on any error
+    """
+    try:
+        #корзина помечается оплаченной первой: повторная оплата той же корзины ждет на этой строке и получает отказ
+        basket_r: Result = await session.execute(
+            update(Basket)
+            .values(is_paid=True)
+            .where(Basket.id == basket_id, Basket.user_id == user_id, Basket.is_paid.is_not(True))
+            .returning(Basket.id)
+        )
+        if basket_r.scalar_one_or_none() is None: raise CheckoutError(f"basket [{basket_id}] not found or already paid")
+
+        items_r: Result = await session.execute(
+            select(ProductInBasket.product_in_shop_id, ProductInBasket.amount)
+            .where(ProductInBasket.basket_id == basket_id, ProductInBasket.amount > 0)
+            .order_by(ProductInBasket.product_in_shop_id)
+        )
+        items: list[tuple[int, int]] = [tuple(item) for item in items_r.all()]
+        if not items: raise CheckoutError(f"basket [{basket_id}] is empty")
+
+        #блокировка строк в порядке id и условное списание одним запросом
+        wanted = values(column("id", Integer), column("amount", Integer), name="wanted").data(items)
+        locked = (
+            select(ProductInShop.id)
+            .where(ProductInShop.id.in_([product_in_shop_id for product_in_shop_id, _ in items]))
+            .order_by(ProductInShop.id)
+            .with_for_update()
+            .cte("locked")
+        )
+        stock_r: Result = await session.execute(
+            update(ProductInShop)
+            .values(amount=ProductInShop.amount - wanted.c.amount)
+            .where(
+                ProductInShop.id == locked.c.id,
+                ProductInShop.id == wanted.c.id,
+                ProductInShop.amount >= wanted.c.amount,
+                ProductInShop.price.is_not(None)
+            )
+            .returning(ProductInShop.id, ProductInShop.shop_id, ProductInShop.product_id, ProductInShop.price, wanted.c.amount.label("sold"))
+        )
+        sold: list[RowMapping] = stock_r.mappings().all()
+        if len(sold) != len(items):
+            sold_ids = {row.id for row in sold}
+            raise OutOfStock([product_in_shop_id for product_in_shop_id, _ in items if product_in_shop_id not in sold_ids])
+
+        now = datetime.now()
+        payments_r: Result = await session.execute(
+            insert(Payment)
+            .values([
+                {
+                    "product_id": row.product_id,
+                    "shop_id": row.shop_id,
+                    "basket_id": basket_id,
+                    "amount": row.sold,
+                    "total": row.price * row.sold,
+                    "tax": row.price * row.sold * CHECKOUT_TAX_RATE,
+                    "date_of_creation": now
+                }
+                for row in sold
+            ])
+            .returning(Payment.id, Payment.product_id, Payment.shop_id, Payment.amount, Payment.total, Payment.tax)
+        )
+        payments: list[RowMapping] = payments_r.mappings().all()
+        await session.commit()
+        return payments
+    except Exception:
+        await session.rollback()
+        raise
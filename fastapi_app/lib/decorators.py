@@ -15,17 +15,17 @@ from ..database import get_async_session
 def jwt_confirmed(func: function, access_token: Annotated[str | None, Cookie()] = None, refresh_token: Annotated[str | None, Cookie()] = None, session: Session = Depends(get_async_session)):
     async def inner(access_token = access_token, refresh_token = refresh_token, session = session):
         ## проверка токенов пользователя
-        if await check_jwt(access_token):
+        if await check_jwt(access_token, session):
             return func()
         else:
-            if await check_jwt(refresh_token):
+            if await check_jwt(refresh_token, session):
                 response: Response = Response()
                 user = decode_jwt(refresh_token)
                 user_from_db: Result = await session.execute(select(User).where(User.login == user.login))
                 db_user: User = user_from_db.scalar_one_or_none()
                 if not user: raise HTTPException(status_code=401, detail="Unauthorized")
                 else:
-                    response.set_cookie(await create_jwt(db_user, is_refresh=False))
+                    response.set_cookie(await create_jwt(db_user, session, is_refresh=False))
                 return func(response=response)
             else:
                 raise HTTPException(status_code=401, detail="Unauthorized")
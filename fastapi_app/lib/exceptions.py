@@ -1,32 +1,27 @@
-from typing import Any, Mapping
-from fastapi.responses import JSONResponse
-from starlette.background import BackgroundTask
-
-class ResponseException(JSONResponse):
-    content: dict ={
-        "status" : "fail",
-        "message" : ""
-    }
-    
-    def __init__(self, message: str = "Bad Request", status_code: int = 400, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        self._message(message)
-        super().__init__(self.content, status_code, headers, media_type, background)
-    
-    def _message(self, message: str) -> None:
-        self.content["message"] = message
+from .responses import EnvelopeResponse
+
+
+class ResponseException(EnvelopeResponse):
+    status = "fail"
+    default_message = "Bad Request"
+    default_status_code = 400
 
 
 class Forbidden(ResponseException):
-    def __init__(self, message: str = "forbidden", status_code: int = 403, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        super().__init__(message, status_code, headers, media_type, background)
+    default_message = "forbidden"
+    default_status_code = 403
 
 class NotFound(ResponseException):
-    def __init__(self, message: str = "Not Found", status_code: int = 404, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        super().__init__(message, status_code, headers, media_type, background)
+    default_message = "Not Found"
+    default_status_code = 404
 
 class NotAcceptable(ResponseException):
-    def __init__(self, message: str = "Not Acceptable", status_code: int = 406, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        super().__init__(message, status_code, headers, media_type, background)
+    default_message = "Not Acceptable"
+    default_status_code = 406
+
+class TooManyRequests(ResponseException):
+    default_message = "Too Many Requests"
+    default_status_code = 429
 
 
 #TODO
@@ -0,0 +1,193 @@
+### sys import
+import os
+
+### std import
+import csv
+import math
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+#other imports
+import orjson
+
+### web import
+from sqlalchemy import select, func, text, table, column, literal, literal_column, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession
+
+### custom import
+from .responses import NDJSON_MEDIA_TYPE
+from ..models import Product, ProductInShop
+
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))       #количество строк, отправляемых в COPY за раз
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 1000))       #максимум ошибок в отчете, остальные только считаются
+CSV_MEDIA_TYPE = "text/csv"
+IMPORT_COLUMNS = ("product_id", "amount", "price")
+INT_MAX = 2**31 - 1
+
+#временная таблица живет до конца транзакции импорта
+staging = table("inventory_import", column("line"), column("product_id"), column("amount"), column("price"))
+CREATE_STAGING = text(
+    "CREATE TEMP TABLE inventory_import (line integer, product_id integer, amount integer, price double precision) ON COMMIT DROP"
+)
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    errors: list[dict] = field(default_factory=list)
+
+    def error(self, line: int, message: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS: self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        self.errors.sort(key=lambda error: error["line"])
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "errors": self.errors[:IMPORT_MAX_ERRORS],
+            "errors_truncated": self.rejected > IMPORT_MAX_ERRORS
+        }
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    """numbered lines of the body, only the unfinished line is kept between chunks"""
+    tail = b""
+    number = 0
+    async for chunk in chunks:
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, line.rstrip(b"\r")
+    if tail:
+        yield number + 1, tail.rstrip(b"\r")
+
+
+def _parse_row(raw: dict) -> tuple[int, int, float]:
+    """validated (product_id, amount, price), ValueError describes the problem"""
+    missing = [name for name in IMPORT_COLUMNS if raw.get(name) in (None, "")]
+    if missing: raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        product_id, amount = int(raw["product_id"]), int(raw["amount"])
+        price = float(raw["price"])
+    except (TypeError, ValueError):
+        raise ValueError("product_id and amount must be integers, price must be a number")
+    if not 0 < product_id <= INT_MAX: raise ValueError(f"product_id [{product_id}] is out of range")
+    if not 0 <= amount <= INT_MAX: raise ValueError(f"amount [{amount}] is out of range")
+    if not math.isfinite(price) or price < 0: raise ValueError(f"price [{price}] must be a non-negative number")
+    return product_id, amount, price
+
+
+async def _records(content_type: str, chunks: AsyncIterator[bytes], report: ImportReport) -> AsyncIterator[tuple[int, int, int, float]]:
+    """staging records (line, product_id, amount, price) from a csv with a header or an ndjson body"""
+    header: list[str] | None = None
+    async for number, line in _lines(chunks):
+        if not line.strip(): continue
+        try:
+            decoded = line.decode()
+        except UnicodeDecodeError:
+            report.rows += 1
+            report.error(number, "line is not valid utf-8")
+            continue
+        if content_type == CSV_MEDIA_TYPE and header is None:
+            header = [name.strip() for name in next(csv.reader([decoded]))]
+            missing = [name for name in IMPORT_COLUMNS if name not in header]
+            if missing: raise ImportFormatError(f"csv header has no {', '.join(missing)} columns")
+            continue
+        report.rows += 1
+        try:
+            if content_type == CSV_MEDIA_TYPE:
+                raw = dict(zip(header, next(csv.reader([decoded]))))
+            else:
+                raw = orjson.loads(decoded)
+                if not isinstance(raw, dict): raise ValueError("line must be a json object")
+            yield (number, *_parse_row(raw))
+        except orjson.JSONDecodeError:
+            report.error(number, "line is not valid json")
+        except ValueError as e:
+            report.error(number, str(e))
+
+
+async def import_inventory(session: AsyncSession, shop_id: int, content_type: str, chunks: AsyncIterator[bytes]) -> ImportReport:
+    """
+    loads (product_id, amount, price) rows of a shop from a streamed csv or ndjson body
+
+    valid rows are copied in batches into a temporary table and merged into product_in_shop with
+    one upsert, the last row wins for a repeated product. Invalid rows are reported by line number
+    """
+    content_type = content_type.partition(";")[0].strip()
+    if content_type not in (CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE):
+        raise ImportFormatError(f"{CSV_MEDIA_TYPE} or {NDJSON_MEDIA_TYPE} body expected")
+    report = ImportReport()
+    try:
+        await session.execute(CREATE_STAGING)
+        #COPY идет через соединение asyncpg той же транзакции
+        connection = await session.connection()
+        driver = (await connection.get_raw_connection()).driver_connection
+
+        batch: list[tuple] = []
+        async for record in _records(content_type, chunks, report):
+            batch.append(record)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await driver.copy_records_to_table("inventory_import", records=batch, columns=["line", *IMPORT_COLUMNS])
+                batch.clear()
+        if batch:
+            await driver.copy_records_to_table("inventory_import", records=batch, columns=["line", *IMPORT_COLUMNS])
+
+        #неизвестные продукты и повторы одним запросом
+        last_line = func.max(staging.c.line).over(partition_by=staging.c.product_id).label("last_line")
+        lines = select(staging.c.line, staging.c.product_id, last_line).subquery()
+        known = exists().where(Product.id == lines.c.product_id)
+        rejected_r: Result = await session.execute(
+            select(lines.c.line, lines.c.product_id, lines.c.last_line, known.label("known"), func.count().over().label("total"))
+            .where(~known | (lines.c.line < lines.c.last_line))
+            .order_by(lines.c.line)
+            .limit(IMPORT_MAX_ERRORS)
+        )
+        rejected_rows = rejected_r.mappings().all()
+        for row in rejected_rows:
+            if not row.known: report.error(row.line, f"product with id [{row.product_id}] does not exists")
+            else: report.error(row.line, f"product_id [{row.product_id}] is repeated at line {row.last_line}, the last row is applied")
+        #строки сверх лимита отчета только учитываются
+        if rejected_rows: report.rejected += rejected_rows[0].total - len(rejected_rows)
+
+        rows = (
+            select(literal(shop_id), staging.c.product_id, staging.c.amount, staging.c.price, func.now())
+            .distinct(staging.c.product_id)
+            .where(exists().where(Product.id == staging.c.product_id))
+            .order_by(staging.c.product_id, staging.c.line.desc())
+        )
+        upsert = pg_insert(ProductInShop).from_select(
+            [ProductInShop.shop_id, ProductInShop.product_id, ProductInShop.amount, ProductInShop.price, ProductInShop.date_of_creation],
+            rows
+        )
+        upserted = (
+            upsert.on_conflict_do_update(
+                constraint="uq_product_in_shop_shop_id_product_id",
+                set_={"amount": upsert.excluded.amount, "price": upsert.excluded.price}
+            )
+            .returning((literal_column("xmax") == 0).label("inserted")) #xmax = 0 только у вставленных строк
+            .cte("upserted")
+        )
+        counts_r: Result = await session.execute(
+            select(func.count().filter(upserted.c.inserted), func.count()).select_from(upserted)
+        )
+        inserted, total = counts_r.one()
+        report.inserted, report.updated = inserted, total - inserted
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    return report
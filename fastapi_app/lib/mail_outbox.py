@@ -0,0 +1,215 @@
+### std import
+import asyncio
+import logging
+import smtplib
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+### web import
+from sqlalchemy import select, insert, update, delete, or_
+from sqlalchemy.engine import Result
+from sqlalchemy.engine.row import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+
+### custom import
+from ..database import async_session_maker
+from ..models import MailOutbox, VerifyCode
+from ..settings import Settings, get_settings
+
+
+async def enqueue_mail(session: AsyncSession, recipient: str, subject: str, body: str, ttl: float | None = None) -> None:
+    """adds a message to the outbox, it is sent after the caller commits"""
+    expires_at = datetime.now() + timedelta(seconds=ttl) if ttl is not None else None
+    await session.execute(insert(MailOutbox).values(recipient=recipient, subject=subject, body=body, expires_at=expires_at))
+
+
+def _retry_delay(attempts: int) -> float:
+    settings = get_settings()
+    return min(settings.mail_retry_base * 2 ** (attempts - 1), settings.mail_retry_max)
+
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx replies and refused recipients will not succeed on retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused): return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class SmtpPool:
+    """
+    a few persistent smtp connections reused between batches
+
+    smtplib is blocking, every delivery runs in a worker thread. A connection dropped by the server
+    is reopened once before the message is counted as failed
+    """
+
+    def __init__(self, host: str, port: int = 25, size: int = 4, user: str | None = None, password: str | None = None,
+                 starttls: bool = False, timeout: float = 10, sender: str = "noreply@localhost") -> None:
+        self.host, self.port, self.user, self.password, self.starttls, self.timeout = host, port, user, password, starttls, timeout
+        self.sender = sender
+        self._idle: list[smtplib.SMTP] = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SmtpPool":
+        return cls(settings.smtp_host, settings.smtp_port, settings.smtp_pool_size, settings.smtp_user, settings.smtp_password,
+                   settings.smtp_starttls, settings.smtp_timeout, settings.smtp_sender)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls: smtp.starttls()
+        if self.user: smtp.login(self.user, self.password or "")
+        return smtp
+
+    def _deliver(self, smtp: smtplib.SMTP | None, message: EmailMessage) -> tuple[smtplib.SMTP | None, Exception | None]:
+        """returns the connection to keep (None if it is broken) and the delivery error"""
+        try:
+            if smtp is None: smtp = self._connect()
+            try:
+                smtp.send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                smtp = self._connect()
+                smtp.send_message(message)
+            return smtp, None
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+            return smtp, e #письмо отклонено, соединение исправно
+        except Exception as e:
+            if smtp is not None: smtp.close()
+            return None, e
+
+    async def send(self, message: EmailMessage) -> Exception | None:
+        async with self._semaphore:
+            smtp = self._idle.pop() if self._idle else None
+            smtp, error = await asyncio.to_thread(self._deliver, smtp, message)
+            if smtp is not None: self._idle.append(smtp)
+            return error
+
+    def close(self) -> None:
+        while self._idle:
+            smtp = self._idle.pop()
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                smtp.close()
+
+
+def _message(row: RowMapping, sender: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = row.recipient
+    message["Subject"] = row.subject
+    message.set_content(row.body)
+    return message
+
+
+async def claim_batch(batch_size: int, lease: float) -> list[RowMapping]:
+    """
+    takes due messages in a short transaction, moving their next attempt past the lease
+
+    the rows stay pending, a dispatcher that dies while sending leaves them to be taken again once the lease runs out
+    """
+    async with async_session_maker() as session:
+        now = datetime.now()
+        due = (
+            select(MailOutbox.id)
+            .where(
+                MailOutbox.status == "pending",
+                MailOutbox.next_attempt_at <= now,
+                or_(MailOutbox.expires_at.is_(None), MailOutbox.expires_at > now)
+            )
+            .order_by(MailOutbox.next_attempt_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        claimed_r: Result = await session.execute(
+            update(MailOutbox)
+            .values(next_attempt_at=now + timedelta(seconds=lease))
+            .where(MailOutbox.id.in_(due))
+            .returning(MailOutbox.id, MailOutbox.recipient, MailOutbox.subject, MailOutbox.body, MailOutbox.attempts)
+        )
+        claimed: list[RowMapping] = claimed_r.mappings().all()
+        await session.commit()
+        return claimed
+
+
+async def dispatch_batch(pool: SmtpPool, batch_size: int, lease: float) -> int:
+    """
+    sends one batch of due messages, returns the number of taken messages
+
+    messages are claimed and results are written in two short transactions, no connection is held while smtp works.
+    The lease has to outlast sending a batch, otherwise another dispatcher can send the same message again
+    """
+    due = await claim_batch(batch_size, lease)
+    if not due: return 0
+
+    errors = await asyncio.gather(*[pool.send(_message(row, pool.sender)) for row in due])
+
+    max_attempts = get_settings().mail_max_attempts
+    async with async_session_maker() as session:
+        now = datetime.now()
+        sent = [row.id for row, error in zip(due, errors) if error is None]
+        if sent:
+            await session.execute(
+                update(MailOutbox)
+                .values(status="sent", sent_at=now, attempts=MailOutbox.attempts + 1, last_error=None)
+                .where(MailOutbox.id.in_(sent))
+            )
+        #неудачи редки, обновляются по одной
+        for row, error in zip(due, errors):
+            if error is None: continue
+            attempts = row.attempts + 1
+            failed = _is_permanent(error) or attempts >= max_attempts
+            await session.execute(
+                update(MailOutbox)
+                .values(
+                    status="failed" if failed else "pending",
+                    attempts=attempts,
+                    last_error=str(error),
+                    next_attempt_at=now + timedelta(seconds=_retry_delay(attempts))
+                )
+                .where(MailOutbox.id == row.id)
+            )
+            logging.error("mail dispatcher: message [%s] to %s %s: %s", row.id, row.recipient, "failed" if failed else "will be retried", error)
+        await session.commit()
+    return len(due)
+
+
+async def run_mail_dispatcher(pool: SmtpPool, interval: float, batch_size: int, lease: float) -> None:
+    """background loop sending the outbox, full batches are sent back to back"""
+    while True:
+        try:
+            taken = await dispatch_batch(pool, batch_size, lease)
+            if taken == batch_size: continue
+        except Exception as e:
+            logging.error("mail dispatcher error:\n%s", e)
+        await asyncio.sleep(interval)
+
+
+async def sweep_expired(code_ttl: float, retention: float) -> None:
+    """marks expired verification codes and messages, removes old processed messages"""
+    now = datetime.now()
+    async with async_session_maker() as session:
+        await session.execute(
+            update(VerifyCode)
+            .values(is_expired=True)
+            .where(VerifyCode.is_expired == False, VerifyCode.date_of_creation < now - timedelta(seconds=code_ttl))
+        )
+        await session.execute(
+            update(MailOutbox)
+            .values(status="expired")
+            .where(MailOutbox.status == "pending", MailOutbox.expires_at < now)
+        )
+        await session.execute(
+            delete(MailOutbox)
+            .where(MailOutbox.status != "pending", MailOutbox.date_of_creation < now - timedelta(seconds=retention))
+        )
+        await session.commit()
+
+
+async def run_mail_sweeper(interval: float, code_ttl: float, retention: float) -> None:
+    """background loop expiring verification codes and outbox messages"""
+    while True:
+        try:
+            await sweep_expired(code_ttl, retention)
+        except Exception as e:
+            logging.error("mail sweeper error:\n%s", e)
+        await asyncio.sleep(interval)
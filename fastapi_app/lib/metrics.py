@@ -0,0 +1,161 @@
+### sys import
+import os
+
+### std import
+import bisect
+import logging
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+### web import
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+REQUEST_QUERY_BUDGET = int(os.getenv('REQUEST_QUERY_BUDGET', 0))          #запросы к БД сверх этого числа за один http запрос пишутся в лог (0 - не проверять)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """fixed-bucket histogram, buckets are stored non-cumulative and summed on render"""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #последний - больше всех границ
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """database work done while handling one http request"""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class Metrics:
+    """per-route http and database counters of this process"""
+
+    def __init__(self) -> None:
+        self.latency: defaultdict[tuple[str, str], Histogram] = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries: defaultdict[tuple[str, str], Histogram] = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.db_time: defaultdict[tuple[str, str], Histogram] = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.responses: defaultdict[tuple[str, str, int], int] = defaultdict(int)
+        self.budget_exceeded: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.db_queries_total = 0
+        self.db_time_total = 0.0
+
+    def record_request(self, method: str, route: str, status: int, latency: float, stats: RequestStats) -> None:
+        labels = (method, route)
+        self.latency[labels].observe(latency)
+        self.queries[labels].observe(stats.queries)
+        self.db_time[labels].observe(stats.db_time)
+        self.responses[(method, route, status)] += 1
+
+    def render(self) -> str:
+        """all metrics in the prometheus text exposition format"""
+        lines: list[str] = []
+        _render_histograms(lines, "http_request_duration_seconds", "request latency by route", self.latency)
+        _render_histograms(lines, "http_request_db_queries", "database queries per request by route", self.queries)
+        _render_histograms(lines, "http_request_db_seconds", "database time per request by route", self.db_time)
+        lines += ["# HELP http_responses_total responses by route and status", "# TYPE http_responses_total counter"]
+        for (method, route, status), count in self.responses.items():
+            lines.append(f"http_responses_total{_labels(method=method, route=route, status=status)} {count}")
+        lines += ["# HELP http_request_query_budget_exceeded_total requests over REQUEST_QUERY_BUDGET queries", "# TYPE http_request_query_budget_exceeded_total counter"]
+        for (method, route), count in self.budget_exceeded.items():
+            lines.append(f"http_request_query_budget_exceeded_total{_labels(method=method, route=route)} {count}")
+        lines += [
+            "# HELP db_queries_total database queries including background tasks", "# TYPE db_queries_total counter",
+            f"db_queries_total {self.db_queries_total}",
+            "# HELP db_query_seconds_total database time including background tasks", "# TYPE db_query_seconds_total counter",
+            f"db_query_seconds_total {self.db_time_total}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _render_histograms(lines: list[str], name: str, description: str, histograms: dict[tuple[str, str], Histogram]) -> None:
+    lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for (method, route), histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(method=method, route=route)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+
+
+metrics = Metrics()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """counts queries and their time, per request when one is being handled"""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.db_queries_total += 1
+        metrics.db_time_total += elapsed
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+
+class MetricsMiddleware:
+    """
+    records latency, status and database work of every http request under its route template
+
+    requests that match no route are counted as "unmatched", so scanned urls do not create new series
+    """
+
+    def __init__(self, app: ASGIApp, query_budget: int = REQUEST_QUERY_BUDGET) -> None:
+        self.app = app
+        self.query_budget = query_budget
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope["route"].path if "route" in scope else "unmatched"
+            metrics.record_request(scope["method"], route, status, time.perf_counter() - started, stats)
+            if self.query_budget and stats.queries > self.query_budget:
+                metrics.budget_exceeded[(scope["method"], route)] += 1
+                logging.warning("query budget exceeded: %s queries (%.3f s) on %s %s, budget %s", stats.queries, stats.db_time, scope["method"], route, self.query_budget)
+            _request_stats.reset(token)
@@ -0,0 +1,109 @@
+### sys import
+import os
+
+### std import
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+### web import
+from sqlalchemy import select, update, func, values, column, or_, Integer, Boolean
+from sqlalchemy.engine import Result
+from sqlalchemy.engine.row import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+### custom import
+from ..models import Shop, Brand, ShopRequestForConfirmation, RequestForConfirmation
+
+
+MODERATION_CLAIM_TTL = float(os.getenv('MODERATION_CLAIM_TTL', 300))       #время, на которое запросы закрепляются за модератором, сек
+MODERATION_MAX_BATCH = int(os.getenv('MODERATION_MAX_BATCH', 500))         #максимум запросов, забираемых за раз
+
+
+@dataclass(frozen=True)
+class ModerationQueue:
+    request: type                       #таблица запросов
+    target_id: InstrumentedAttribute    #столбец запроса со ссылкой на подтверждаемую запись
+    target: type                        #подтверждаемая таблица (is_confirmed, confirmation_date)
+
+
+QUEUES = {
+    "shops": ModerationQueue(ShopRequestForConfirmation, ShopRequestForConfirmation.shop_id, Shop),
+    "brands": ModerationQueue(RequestForConfirmation, RequestForConfirmation.brand_id, Brand),
+}
+
+
+async def claim(session: AsyncSession, queue: ModerationQueue, moderator_id: int, limit: int) -> list[RowMapping]:
+    """
+    leases up to limit pending requests to the moderator for MODERATION_CLAIM_TTL seconds
+
+    rows locked by a concurrent claim are skipped, so parallel moderators never get the same request.
+    The moderator's own unexpired claims are returned again with a renewed lease
+    """
+    request = queue.request
+    now = datetime.now()
+    #CTE с FOR UPDATE материализуется один раз, LIMIT и SKIP LOCKED не переоцениваются внутри IN
+    claimable = (
+        select(request.id)
+        .where(
+            request.is_processed == False,
+            or_(request.claim_expires_at.is_(None), request.claim_expires_at < now, request.moderator_id == moderator_id)
+        )
+        .order_by(request.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte("claimable")
+    )
+    claimed_r: Result = await session.execute(
+        update(request)
+        .values(moderator_id=moderator_id, claim_expires_at=now + timedelta(seconds=MODERATION_CLAIM_TTL))
+        .where(request.id.in_(select(claimable.c.id)))
+        .returning(request.id, queue.target_id.label("target_id"), request.date_of_creation, request.claim_expires_at)
+    )
+    claimed: list[RowMapping] = sorted(claimed_r.mappings().all(), key=lambda row: row.id)
+    await session.commit()
+    return claimed
+
+
+async def decide(session: AsyncSession, queue: ModerationQueue, moderator_id: int, decisions: list[tuple[int, bool]]) -> list[RowMapping]:
+    """
+    applies (request id, is_rejected) decisions in bulk and confirms the targets of approved requests
+
+    only pending requests claimed by the moderator are decided, the decided ones are returned
+    """
+    request = queue.request
+    now = datetime.now()
+    wanted = values(column("id", Integer), column("is_rejected", Boolean), name="decisions").data(decisions)
+    decided_r: Result = await session.execute(
+        update(request)
+        .values(is_processed=True, is_rejected=wanted.c.is_rejected, claim_expires_at=None, date_of_change=now)
+        .where(request.id == wanted.c.id, request.moderator_id == moderator_id, request.is_processed == False)
+        .returning(request.id, queue.target_id.label("target_id"), request.is_rejected)
+    )
+    decided: list[RowMapping] = decided_r.mappings().all()
+    approved = sorted({row.target_id for row in decided if not row.is_rejected})
+    if approved:
+        target = queue.target
+        await session.execute(update(target).values(is_confirmed=True, confirmation_date=date.today()).where(target.id.in_(approved)))
+    await session.commit()
+    return decided
+
+
+async def queue_stats(session: AsyncSession, queue: ModerationQueue) -> dict:
+    """pending and claimed request counts and the age of the oldest pending request"""
+    request = queue.request
+    now = datetime.now()
+    stats_r: Result = await session.execute(
+        select(
+            func.count().label("pending"),
+            func.count().filter(request.claim_expires_at >= now).label("claimed"),
+            func.min(request.date_of_creation).label("oldest")
+        )
+        .where(request.is_processed == False)
+    )
+    stats: RowMapping = stats_r.mappings().one()
+    return {
+        "pending": stats.pending,
+        "claimed": stats.claimed,
+        "oldest_age": (now - stats.oldest).total_seconds() if stats.oldest else 0.0
+    }
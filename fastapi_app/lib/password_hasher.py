@@ -0,0 +1,92 @@
+### sys import
+import os
+
+### std import
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+#other imports
+from passlib.context import CryptContext
+
+
+PWD_HASH_EXECUTOR = os.getenv('PWD_HASH_EXECUTOR', 'thread')                            #thread / process - пул, в котором считается bcrypt
+PWD_HASH_WORKERS = int(os.getenv('PWD_HASH_WORKERS', os.cpu_count() or 1))              #количество потоков / процессов пула
+PWD_HASH_MAX_CONCURRENCY = int(os.getenv('PWD_HASH_MAX_CONCURRENCY', 2 * PWD_HASH_WORKERS))    #максимум одновременных задач в очереди пула
+PWD_BCRYPT_ROUNDS = int(os.getenv('PWD_BCRYPT_ROUNDS', 12))                             #стоимость bcrypt, при изменении хэши обновляются при входе
+
+#контекст создается на уровне модуля, чтобы процессы пула собирали его сами при импорте
+bcrypt_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=PWD_BCRYPT_ROUNDS)
+
+
+def _hash(password: str) -> tuple[str, float]:
+    return bcrypt_context.hash(password), time.time()
+
+
+def _verify_and_update(password: str, pwd_hash: str) -> tuple[tuple[bool, str | None], float]:
+    return bcrypt_context.verify_and_update(password, pwd_hash), time.time()
+
+
+class PasswordHasher:
+    """runs bcrypt off the event loop on a bounded pool and tracks how long calls wait for it"""
+
+    def __init__(self, executor: str = PWD_HASH_EXECUTOR, workers: int = PWD_HASH_WORKERS, max_concurrency: int = PWD_HASH_MAX_CONCURRENCY) -> None:
+        self.executor_type = executor
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        #метрики
+        self.calls = 0
+        self.rehashed = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    @property
+    def context(self) -> CryptContext:
+        return bcrypt_context
+
+    def _get_executor(self) -> Executor:
+        #пул создается лениво, чтобы импорт модуля не порождал процессы
+        if self._executor is None:
+            if self.executor_type == "process": self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else: self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwd-hash")
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._executor
+
+    async def _run(self, func, *args):
+        executor = self._get_executor()
+        submitted = time.time()
+        async with self._semaphore:
+            result, started = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        queue_time = max(started - submitted, 0.0)
+        self.calls += 1
+        self.queue_time_total += queue_time
+        self.queue_time_max = max(self.queue_time_max, queue_time)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, pwd_hash: str) -> tuple[bool, str | None]:
+        """checks the password, returns a new hash if the stored one uses outdated settings"""
+        is_valid, new_hash = await self._run(_verify_and_update, password, pwd_hash)
+        if new_hash: self.rehashed += 1
+        return is_valid, new_hash
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rehashed": self.rehashed,
+            "queue_time_avg": self.queue_time_total / self.calls if self.calls else 0.0,
+            "queue_time_max": self.queue_time_max,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._semaphore = None
+
+
+password_hasher = PasswordHasher()
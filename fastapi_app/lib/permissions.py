@@ -0,0 +1,89 @@
+### sys import
+import os
+
+### std import
+import operator
+from enum import IntFlag
+from functools import reduce
+
+### web import
+from sqlalchemy import select, func, case, ColumnElement
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession
+
+### custom import
+from .cache import cache, permission_key, CACHE_BACKEND, CACHE_TTL
+from ..models import Shop, ShopAndUser, Position
+
+
+#в памяти процесса инвалидация не доходит до других воркеров, отозванные права живут в них до истечения записи
+PERMISSION_CACHE_TTL = float(os.getenv('PERMISSION_CACHE_TTL', CACHE_TTL if CACHE_BACKEND == 'redis' else 5))    #время жизни маски прав, сек
+
+
+class Permission(IntFlag):
+    """position flags packed into an integer"""
+    ADD_STAFF = 1
+    CHANGE_STAFF = 2
+    DELETE_STAFF = 4
+    ADD_PRODUCT = 8
+    CHANGE_PRODUCT = 16
+    DELETE_PRODUCT = 32
+
+ALL_PERMISSIONS = reduce(operator.or_, Permission)     #владелец магазина может все
+STAFF_PERMISSIONS = Permission.ADD_STAFF | Permission.CHANGE_STAFF | Permission.DELETE_STAFF
+
+#соответствие битов флагам должности
+POSITION_FLAGS = {
+    Permission.ADD_STAFF: Position.can_add_staff,
+    Permission.CHANGE_STAFF: Position.can_change_staff,
+    Permission.DELETE_STAFF: Position.can_delete_staff,
+    Permission.ADD_PRODUCT: Position.can_add_product,
+    Permission.CHANGE_PRODUCT: Position.can_change_product,
+    Permission.DELETE_PRODUCT: Position.can_delete_product,
+}
+
+
+def position_mask() -> ColumnElement[int]:
+    """sql expression packing the can_* flags of Position into a bitmask"""
+    return reduce(operator.add, [case((flag_column, int(flag)), else_=0) for flag, flag_column in POSITION_FLAGS.items()])
+
+
+def permission_names(mask: int) -> list[str]:
+    return [flag.name.lower() for flag in Permission if flag & mask]
+
+
+async def get_permissions(user_id: int, shop_id: int, session: AsyncSession) -> Permission:
+    """
+    permissions of the user in the shop, no permissions if the shop does not exist or is deleted
+
+    the mask is cached per (user, shop) and invalidated by position and staff changes. With the memory backend
+    other workers only drop it on expiry, so it is kept for PERMISSION_CACHE_TTL (5 s by default) instead of CACHE_TTL
+    """
+    async def load_mask() -> int:
+        #несколько должностей в одном магазине складываются
+        staff_mask = (
+            select(func.bit_or(position_mask()))
+            .select_from(ShopAndUser)
+            .join(Position, Position.id == ShopAndUser.position_id)
+            .where(ShopAndUser.user_id == user_id, ShopAndUser.shop_id == shop_id)
+            .scalar_subquery()
+        )
+        mask_r: Result = await session.execute(
+            select(case((Shop.owner_id == user_id, int(ALL_PERMISSIONS)), else_=func.coalesce(staff_mask, 0)))
+            .where(Shop.id == shop_id, Shop.is_deleted == False)
+        )
+        return mask_r.scalar_one_or_none() or 0
+    return Permission(await cache.get_or_load(permission_key(user_id, shop_id), load_mask, PERMISSION_CACHE_TTL))
+
+
+async def staff_permission_keys(session: AsyncSession, shop_id: int | None = None, position_id: int | None = None) -> list[str]:
+    """
+    cache keys of masks of everyone employed in the shop or holding the position
+
+    collected before the change (a deleted position is unlinked from staff), invalidated after commit
+    """
+    staff_query = select(ShopAndUser.user_id, ShopAndUser.shop_id)
+    if shop_id is not None: staff_query = staff_query.where(ShopAndUser.shop_id == shop_id)
+    if position_id is not None: staff_query = staff_query.where(ShopAndUser.position_id == position_id)
+    staff_r: Result = await session.execute(staff_query)
+    return [permission_key(user_id, staff_shop_id) for user_id, staff_shop_id in staff_r.all()]
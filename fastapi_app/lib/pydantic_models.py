@@ -1,8 +1,4 @@
 
-#sys imort
-import os
-from dotenv import load_dotenv
-
 #std import
 from datetime import datetime, timedelta
 from enum import Enum
@@ -10,18 +6,14 @@ from enum import Enum
 #web import
 from pydantic import BaseModel
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession
 
 #custom import
-from ..database import async_session_maker
 from ..models import User
+from ..settings import get_settings
 
 
-load_dotenv()
-
-JWT_ACCESS_LIFETIME = int(os.getenv('JWT_ACCESS_LIFETIME'))
-JWT_REFRESH_LIFETIME = int(os.getenv('JWT_REFRESH_LIFETIME'))
-
 class roles(Enum):
     user = 0
     admin = 1
@@ -61,11 +53,14 @@ class pd_jwt(BaseModel):
         if creation_date: new_creation_date = creation_date
         else: new_creation_date = datetime.now()
         if expiration_date: new_expiration_date = expiration_date
-        else: new_expiration_date = datetime.now() + timedelta(days=JWT_REFRESH_LIFETIME if is_refresh else JWT_ACCESS_LIFETIME)
+        else:
+            settings = get_settings()
+            new_expiration_date = datetime.now() + timedelta(days=settings.jwt_refresh_lifetime if is_refresh else settings.jwt_access_lifetime)
         super().__init__(login=login, is_refresh=is_refresh, creation_date=str(new_creation_date), expiration_date=str(new_expiration_date))
     
-    async def get_user(self, session: Session = async_session_maker()) -> User:
-        return await session.execute(select(User).where(User.login == self.login))
+    async def get_user(self, session: AsyncSession) -> User | None:
+        user_from_db: Result = await session.execute(select(User).where(User.login == self.login))
+        return user_from_db.scalar_one_or_none()
 
 
 class pd_shop(BaseModel):
@@ -80,6 +75,14 @@ class pd_shop_edit(BaseModel):
     description: str | None
     avatar_img: str | None
 
+class pd_shop_images_delete(BaseModel):
+    shop_id: int
+    image_ids: list[int]
+
+class pd_basket_item(BaseModel):
+    product_in_shop_id: int
+    amount: int
+
 class pd_position(BaseModel):
     name: str
     can_add_staff: bool | None = None
@@ -97,4 +100,20 @@ class pd_position_edit(BaseModel):
     can_delete_staff: bool | None = None
     can_add_product: bool | None = None
     can_change_product: bool | None = None
-    can_delete_product: bool | None = None
\ No newline at end of file
+    can_delete_product: bool | None = None
+
+class pd_staff(BaseModel):
+    shop_id: int
+    user_id: int
+    position_id: int | None = None
+
+class pd_staff_edit(BaseModel):
+    id: int
+    position_id: int | None = None
+
+class pd_moderation_decision(BaseModel):
+    id: int
+    is_rejected: bool
+
+class pd_moderation_decisions(BaseModel):
+    decisions: list[pd_moderation_decision]
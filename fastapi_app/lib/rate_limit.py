@@ -0,0 +1,142 @@
+### sys import
+import os
+
+### std import
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+### web import
+from fastapi import Request
+
+
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')             #memory - счетчики процесса, redis - общие для всех воркеров
+RATE_LIMIT_SHARDS = int(os.getenv('RATE_LIMIT_SHARDS', 16))                 #количество частей хранилища в памяти
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100_000))        #максимум ключей в памяти, старые вытесняются
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    limit: int          #запросов за окно
+    window: float       #длина окна, сек
+
+
+def _rule(name: str, default: str) -> Rule:
+    """rule from RATE_LIMIT_<NAME> written as "count/seconds" """
+    limit, _, window = os.getenv(f'RATE_LIMIT_{name.upper()}', default).partition("/")
+    return Rule(name, int(limit), float(window))
+
+
+SIGNIN_BY_IP = _rule("signin_ip", "20/60")
+SIGNIN_BY_LOGIN = _rule("signin_login", "5/60")
+SIGNUP_BY_IP = _rule("signup_ip", "5/60")
+REFRESH_BY_IP = _rule("refresh_ip", "30/60")
+
+
+def _estimate(previous: int, current: int, elapsed: float) -> float:
+    """sliding window count: the previous fixed window is weighted by its part still inside the window"""
+    return previous * (1 - elapsed) + current
+
+
+class MemoryBackend:
+    """
+    sliding-window counters of this process, spread over shards
+
+    every key keeps two counters (current and previous fixed window), each shard is an LRU
+    of bounded size, so memory stays flat under a flood of distinct keys
+    """
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS) -> None:
+        self._shards: list[OrderedDict[str, list]] = [OrderedDict() for _ in range(shards)]
+        self._shard_size = max(1, max_keys // shards)
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        shard = self._shards[hash(key) % len(self._shards)]
+        position = time.monotonic() / window
+        index, elapsed = int(position), position % 1
+        entry = shard.get(key)
+        if entry is None or entry[0] < index - 1: entry = [index, 0, 0]
+        elif entry[0] == index - 1: entry = [index, 0, entry[1]]
+        shard[key] = entry
+        shard.move_to_end(key)
+        if len(shard) > self._shard_size: shard.popitem(last=False)
+
+        if _estimate(entry[2], entry[1], elapsed) + 1 > limit: return window * (1 - elapsed)
+        entry[1] += 1
+        return 0.0
+
+
+class RedisBackend:
+    """
+    sliding-window counters shared by all workers, over any client with the redis.asyncio interface:
+    mget(*names), incr(name), expire(name, seconds)
+
+    a fake client with these three methods can stand in for redis locally. Reading and incrementing are
+    separate commands, concurrent workers can overshoot the limit by a few requests
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        position = time.time() / window
+        index, elapsed = int(position), position % 1
+        current_key, previous_key = f"rate:{key}:{index}", f"rate:{key}:{index - 1}"
+        current, previous = await self.client.mget(current_key, previous_key)
+        if _estimate(int(previous or 0), int(current or 0), elapsed) + 1 > limit: return window * (1 - elapsed)
+        await self.client.incr(current_key)
+        await self.client.expire(current_key, math.ceil(window * 2))
+        return 0.0
+
+
+class RateLimiter:
+    """checks requests against rules and counts allowed and shed requests per rule"""
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.allowed: Counter[str] = Counter()
+        self.rejected: Counter[str] = Counter()
+
+    async def check(self, *checks: tuple[Rule, str]) -> float:
+        """
+        applies (rule, key) checks in order, returns seconds to wait or 0 if the request is allowed
+
+        a rejected check stops the rest, so it does not use up their budget. Backend errors let the request through
+        """
+        for rule, key in checks:
+            try:
+                retry_after = await self.backend.hit(f"{rule.name}:{key}", rule.limit, rule.window)
+            except Exception as e:
+                logging.error("rate limiter backend error:\n%s", e)
+                return 0.0
+            if retry_after:
+                self.rejected[rule.name] += 1
+                return retry_after
+            self.allowed[rule.name] += 1
+        return 0.0
+
+    def metrics(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+        }
+
+
+def client_ip(request: Request) -> str:
+    """address of the client, behind a proxy uvicorn has to run with --proxy-headers"""
+    return request.client.host if request.client else "unknown"
+
+
+def _create_backend():
+    if RATE_LIMIT_BACKEND == "redis":
+        import redis.asyncio as redis #необязательная зависимость, нужна только для общих счетчиков
+        return RedisBackend(redis.from_url(REDIS_URL))
+    return MemoryBackend()
+
+
+rate_limiter = RateLimiter(_create_backend())
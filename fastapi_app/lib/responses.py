@@ -1,26 +1,102 @@
-from typing import Any, Mapping
-from fastapi.responses import JSONResponse
+import os
+from typing import Any, Callable, Mapping
+
+import anyio
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import Select
+from sqlalchemy.engine.row import RowMapping
 from starlette.background import BackgroundTask
 
-class JResponse(JSONResponse):
-    content = {
-        "status" : "ok",
-        "message" : "",
-        "body" : None
-    }
-    
-    def __init__(self, message: str = "Success", body: Any | None = None, status_code: int = 200, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        self._message(message)
-        self._body(body)
-        super().__init__(self.content, status_code, headers, media_type, background)
-    
-    def _message(self, message: str) -> None:
-        self.content["message"] = message
-    
-    def _body(self, body: Any):
-        self.content["body"] = body
+from ..database import async_session_maker
+
+
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1000))     #количество строк, читаемых из курсора и отправляемых за раз
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _default(obj: Any) -> Any:
+    """orjson fallback for types it does not serialize natively"""
+    if isinstance(obj, Mapping): return dict(obj) #RowMapping
+    if isinstance(obj, BaseModel): return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class EnvelopeResponse(Response):
+    """
+    json response wrapped into {"status", "message", "body"}
+
+    the envelope is built per response and serialized with orjson, RowMapping and datetime values are passed as is
+    """
+    media_type = "application/json"
+    status: str = "ok"
+    default_message: str = "Success"
+    default_status_code: int = 200
+
+    def __init__(self, message: str | None = None, body: Any | None = None, status_code: int | None = None, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
+        content = {
+            "status" : self.status,
+            "message" : self.default_message if message is None else message,
+            "body" : body
+        }
+        super().__init__(content, status_code or self.default_status_code, headers, media_type, background)
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class JResponse(EnvelopeResponse):
+    pass
 
 
 class Created(JResponse):
-    def __init__(self, message: str = "Created", body: Any | None = None, status_code: int = 201, headers: Mapping[str, str] | None = None, media_type: str | None = None, background: BackgroundTask | None = None) -> None:
-        super().__init__(message, status_code, headers, media_type, background)
\ No newline at end of file
+    default_message = "Created"
+    default_status_code = 201
+
+
+def wants_stream(request: Request, stream: bool = False) -> bool:
+    """streaming mode is selected by ?stream=true or by the Accept header"""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_stream(query: Select, transform: Callable[[RowMapping], Any] | None = None, chunk_size: int = STREAM_CHUNK_SIZE) -> StreamingResponse:
+    """
+    streams query rows as newline delimited json through a server-side cursor
+
+    the stream opens its own session: the request session is closed before the body is sent
+    """
+    async def generate():
+        async with async_session_maker() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for rows in result.mappings().partitions(chunk_size):
+                if transform: rows = map(transform, rows)
+                yield b"".join([dumps(row) + b"\n" for row in rows])
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+
+class FileRangeResponse(StreamingResponse):
+    """206 response with one byte range of a file, read in chunks"""
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, file_size: int, headers: Mapping[str, str] | None = None, media_type: str | None = None) -> None:
+        range_headers = {
+            **(headers or {}),
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+            "Content-Length": str(end - start + 1)
+        }
+        super().__init__(self._read(path, start, end), status_code=206, headers=range_headers, media_type=media_type)
+
+    async def _read(self, path: str, start: int, end: int):
+        async with await anyio.open_file(path, "rb") as file:
+            await file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk: break
+                remaining -= len(chunk)
+                yield chunk
@@ -0,0 +1,162 @@
+### std import
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+### web import
+from sqlalchemy import select, update, func, cast, literal, union_all, Date, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Result
+
+### custom import
+from ..database import async_session_maker, snapshot_xid
+from ..models import Payment, RollupState, ShopSalesDaily, ProductSalesDaily
+
+
+SALES_ROLLUP = "sales"
+SALES_GROUPS = ("day", "week", "product")
+SALES_MEASURES = ("units", "revenue", "tax", "payments")
+
+
+def _merge(model, source, keys: list[str]):
+    """upsert adding aggregated source rows to the rollup table"""
+    grouped = select(
+        *[source.c[key] for key in keys],
+        func.sum(source.c.amount),
+        func.sum(source.c.total),
+        func.sum(source.c.tax),
+        func.count()
+    ).group_by(*[source.c[key] for key in keys])
+    merge = pg_insert(model).from_select([*keys, *SALES_MEASURES], grouped)
+    table = model.__table__
+    return merge.on_conflict_do_update(
+        index_elements=[table.c[key] for key in keys],
+        set_={measure: table.c[measure] + merge.excluded[measure] for measure in SALES_MEASURES}
+    )
+
+
+async def rollup_sales(batch_size: int) -> int | None:
+    """
+    adds payments after the high-water mark to the daily rollups, batch by batch
+
+    ids are taken from a sequence and commit out of order, so a visible id does not mean the smaller ones are visible.
+    The mark moves in two steps: first the largest visible id is stored as a fence together with the xmax of the same
+    snapshot, later, once every transaction below that xmax has finished (pg_snapshot_xmin passed it), no payment up to
+    the fence can appear anymore and it is rolled up. Payment ids are assigned by the INSERT itself, not reserved
+    in advance. Returns the new mark, None if there was nothing to roll up
+    """
+    rolled: int | None = None
+    while True:
+        async with async_session_maker() as session:
+            await session.execute(pg_insert(RollupState).values(name=SALES_ROLLUP, last_id=0).on_conflict_do_nothing())
+            #строка состояния блокируется до commit: несколько воркеров не учтут одни чеки дважды
+            state_r: Result = await session.execute(
+                select(RollupState.last_id, RollupState.fence_id, RollupState.fence_xid).where(RollupState.name == SALES_ROLLUP).with_for_update()
+            )
+            state = state_r.one()
+            last_id: int = state.last_id
+
+            if state.fence_id is None or state.fence_id <= last_id:
+                #новая граница: наибольший видимый id и xmax из одного снимка
+                fence_r: Result = await session.execute(select(func.max(Payment.id), snapshot_xid(func.pg_snapshot_xmax)))
+                fence_id, fence_xid = fence_r.one()
+                if fence_id is None or fence_id <= last_id: fence_id = fence_xid = None
+                await session.execute(update(RollupState).values(fence_id=fence_id, fence_xid=fence_xid).where(RollupState.name == SALES_ROLLUP))
+                await session.commit()
+                return rolled
+
+            xmin_r: Result = await session.execute(select(snapshot_xid(func.pg_snapshot_xmin)))
+            if xmin_r.scalar_one() < state.fence_xid:
+                #транзакции, которые могли взять id до границы, еще идут
+                await session.commit()
+                return rolled
+
+            batch = select(Payment.id).where(Payment.id > last_id, Payment.id <= state.fence_id).order_by(Payment.id).limit(batch_size).subquery()
+            upto_r: Result = await session.execute(select(func.count(), func.max(batch.c.id)))
+            count, upto = upto_r.one()
+            #последняя пачка доходит до границы, даже если последние id откатились
+            if count < batch_size: upto = state.fence_id
+
+            source = (
+                select(
+                    Payment.shop_id,
+                    cast(Payment.date_of_creation, Date).label("day"),
+                    func.coalesce(Payment.product_id, 0).label("product_id"),
+                    Payment.amount,
+                    Payment.total,
+                    Payment.tax
+                )
+                .where(Payment.id > last_id, Payment.id <= upto, Payment.shop_id.is_not(None))
+                .subquery()
+            )
+            await session.execute(_merge(ShopSalesDaily, source, ["shop_id", "day"]))
+            await session.execute(_merge(ProductSalesDaily, source, ["shop_id", "day", "product_id"]))
+            await session.execute(update(RollupState).values(last_id=upto, date_of_change=datetime.now()).where(RollupState.name == SALES_ROLLUP))
+            await session.commit()
+        rolled = upto
+        await asyncio.sleep(0) #отдаем управление другим задачам между пачками
+
+
+async def run_sales_rollup(interval: float, batch_size: int) -> None:
+    """background loop keeping the sales rollups up to date"""
+    while True:
+        try:
+            rolled = await rollup_sales(batch_size)
+            if rolled: logging.info("sales rollup: payments up to id %s rolled up", rolled)
+        except Exception as e:
+            logging.error("sales rollup error:\n%s", e)
+        await asyncio.sleep(interval)
+
+
+def sales_report(shop_id: int, date_from: date, date_to: date, group_by: str) -> Select:
+    """
+    shop sales for [date_from, date_to] grouped by day, week or product
+
+    rollup rows are merged with payments after the high-water mark in one statement,
+    both are read from the same snapshot, so the result is exact
+    """
+    mark = func.coalesce(select(RollupState.last_id).where(RollupState.name == SALES_ROLLUP).scalar_subquery(), 0)
+    rollup = ProductSalesDaily if group_by == "product" else ShopSalesDaily
+    payment_day = cast(Payment.date_of_creation, Date)
+    match group_by:
+        case "day": rolled_key, tail_key = rollup.day, payment_day
+        case "week": rolled_key, tail_key = cast(func.date_trunc("week", rollup.day), Date), cast(func.date_trunc("week", Payment.date_of_creation), Date)
+        case "product": rolled_key, tail_key = rollup.product_id, func.coalesce(Payment.product_id, 0)
+
+    rolled = select(
+        rolled_key.label("key"), rollup.units, rollup.revenue, rollup.tax, rollup.payments
+    ).where(rollup.shop_id == shop_id, rollup.day >= date_from, rollup.day <= date_to)
+    #хвост: чеки, которые фоновая задача еще не учла
+    tail = select(
+        tail_key.label("key"), Payment.amount.label("units"), Payment.total.label("revenue"), Payment.tax, literal(1).label("payments")
+    ).where(
+        Payment.shop_id == shop_id,
+        Payment.id > mark,
+        Payment.date_of_creation >= date_from,
+        Payment.date_of_creation < date_to + timedelta(days=1)
+    )
+    merged = union_all(rolled, tail).subquery()
+    key_name = "product_id" if group_by == "product" else group_by
+    return (
+        select(merged.c.key.label(key_name), *[func.sum(merged.c[measure]).label(measure) for measure in SALES_MEASURES])
+        .group_by(merged.c.key)
+        .order_by(merged.c.key)
+    )
+
+
+async def rollup_metrics() -> dict:
+    """how far the sales rollup is behind the payment table"""
+    async with async_session_maker() as session:
+        state_r: Result = await session.execute(
+            select(RollupState.last_id, RollupState.fence_id, RollupState.date_of_change, select(func.max(Payment.id)).scalar_subquery().label("max_id"))
+            .where(RollupState.name == SALES_ROLLUP)
+        )
+        state = state_r.mappings().one_or_none()
+    if state is None: return {"last_id": 0, "fence_id": None, "max_id": None, "pending_ids": None, "date_of_change": None}
+    return {
+        "last_id": state.last_id,
+        "fence_id": state.fence_id,
+        "max_id": state.max_id,
+        "pending_ids": (state.max_id or 0) - state.last_id,
+        "date_of_change": state.date_of_change
+    }
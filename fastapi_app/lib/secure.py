@@ -1,10 +1,9 @@
 ### sys import
 import jwt
 import re
-import os
-from dotenv import load_dotenv
 
 ### std import
+import math
 import random
 import string
 from datetime import datetime, timedelta
@@ -12,30 +11,31 @@ from typing import Annotated
 
 ### web import
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi import HTTPException, Cookie, Depends
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, Cookie, Depends, Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.engine import Result
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, update, func, Select
 
 #other imports
-from passlib.context import CryptContext
 import logging
 
 ### custom import
 from .pydantic_models import pd_jwt, pd_user
-from ..models import JWT, User, VerifyCode
-from ..database import async_session_maker
+from .token_cache import RevocationCache, get_token_id, get_token_expiration
+from .password_hasher import bcrypt_context
+from .mail_outbox import enqueue_mail
+from .rate_limit import rate_limiter, client_ip, REFRESH_BY_IP
+from ..models import JWT, JWT_REVOCATION_SEQ, User, VerifyCode
+from ..database import get_async_session
+from ..settings import get_settings
 
 ### глобальные переменные
-load_dotenv()
-
-JWT_SECRET = os.getenv('JWT_SECRET')
-JWT_ALGORITHM = os.getenv('JWT_ALGORITHM')
 email_regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b' #регулярное выражение проверки почты
 
 
-bcrypt_context = CryptContext(schemes=['bcrypt'])
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/signin") #указание типа аутентификации для FastAPI
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/signin", auto_error=False) #указание типа аутентификации для FastAPI, токен может прийти и в cookie
+revocation_cache = RevocationCache() #размер задается при старте приложения (jwt_revocation_cache_size)
 
 ### функции
 ## работа с почтой пользователя
@@ -44,7 +44,12 @@ def check_email(email: str) -> bool:
     else: return False
 
 
-async def generate_code(user: User, session: Session = async_session_maker()):
+async def generate_code(user_id: int, mail: str, session: AsyncSession) -> str:
+    """
+    creates a verification code and puts the mail with it into the outbox
+
+    nothing is committed: the code and the mail are saved together with the caller's transaction
+    """
     # при использовании в редких случаях стоит обрабатывать sqlalchemy.exc.IntegrityError
     gen_type = random.randint(0,9)
     code = ""
@@ -63,28 +68,31 @@ async def generate_code(user: User, session: Session = async_session_maker()):
             code = a + a[3::-1]
         case _:
             code = ''.join(random.choices(string.digits, k=6))
-    await session.execute(insert(VerifyCode).values(user_id = user.id, code = code, date_of_creation = datetime.nox()))
-    await session.commit()
+    await session.execute(insert(VerifyCode).values(user_id = user_id, code = code, date_of_creation = datetime.now()))
+    await send_mait_to(f"Your verification code: {code}", mail, session, subject="Verification code", ttl=get_settings().verify_code_ttl)
     return code
 
 
-#TODO сделать отправку сообщений на почту, через почтовый микросервис
-async def send_mait_to(message: str, target_email: str):
-    pass
+#письмо уходит через outbox: фоновая задача отправляет его после commit вызывающего
+async def send_mait_to(message: str, target_email: str, session: AsyncSession, subject: str = "Marketplace", ttl: float | None = None):
+    await enqueue_mail(session, target_email, subject, message, ttl)
 
 
 ## работа с токенами доступа пользователя
-async def create_jwt(user: User, is_refresh = False, session: Session = async_session_maker()) -> str:
+async def create_jwt(user: User, session: AsyncSession, is_refresh = False) -> str:
     # при использовании стоит обрабатывать sqlalchemy.exc.NoResultFound (в редких случаях sqlalchemy.exc.IntegrityError)
+    settings = get_settings()
     jwt_dict = dict(pd_jwt(login=user.login, is_refresh=is_refresh))
-    token = jwt.encode(jwt_dict, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    await session.execute(insert(JWT).values(user = user.id, token=token))
+    token = jwt.encode(jwt_dict, settings.jwt_secret, algorithm=settings.jwt_algorithm)
+    expires_at = datetime.strptime(jwt_dict["expiration_date"], "%Y-%m-%d %H:%M:%S.%f")
+    await session.execute(insert(JWT).values(user = user.id, token_id=get_token_id(token), expires_at=expires_at))
     await session.commit()
     return token
 
 
 def decode_jwt(jwt_str: str) -> pd_jwt:
-    jwt_dict = jwt.decode(jwt_str, JWT_SECRET, [JWT_ALGORITHM])
+    settings = get_settings()
+    jwt_dict = jwt.decode(jwt_str, settings.jwt_secret, [settings.jwt_algorithm])
     token = pd_jwt(
         login=jwt_dict["login"],
         is_refresh=jwt_dict["is_refresh"],
@@ -94,39 +102,100 @@ def decode_jwt(jwt_str: str) -> pd_jwt:
     return token
 
 
-async def check_jwt(jwt_str: str, session: Session = async_session_maker()) -> bool:
+def _check_jwt_expiration(jwt_str: str) -> bool:
+    try:
+        token = decode_jwt(jwt_str)
+    except jwt.InvalidTokenError:
+        return False
+    return datetime.strptime(token.expiration_date, "%Y-%m-%d %H:%M:%S.%f") >= datetime.now()
+
+
+async def check_jwt(jwt_str: str, session: AsyncSession) -> bool:
     # при использовании стоит обрабатывать sqlalchemy.exc.NoResultFound
-    token_from_db: Result = await session.execute(select(JWT).where(JWT.token == jwt_str))
+    if not jwt_str: return False
+    if get_settings().jwt_verify_mode == "local" and revocation_cache.is_complete:
+        # подпись и срок действия проверяются в памяти, отзыв - по кэшу отозванных токенов
+        if not _check_jwt_expiration(jwt_str): return False
+        return get_token_id(jwt_str) not in revocation_cache
+    
+    token_from_db: Result = await session.execute(select(JWT).where(JWT.token_id == get_token_id(jwt_str), JWT.is_revoked == False))
     token_exists = bool(token_from_db.scalar_one_or_none())
-    if token_exists:
-        token = decode_jwt(jwt_str)
-        if datetime.strptime(token.expiration_date, "%Y-%m-%d %H:%M:%S.%f") < datetime.now(): return False
-        else: return True
+    if token_exists: return _check_jwt_expiration(jwt_str)
     else: return False
 
-async def get_user_from_jwt(jwt_str, session: Session = async_session_maker()) -> User:
+
+async def revoke_jwt(jwt_str: str, session: AsyncSession) -> None:
+    if not jwt_str: return
+    #время и номер отзыва берутся в БД: часы экземпляров приложения могут расходиться
+    await session.execute(
+        update(JWT)
+        .values(is_revoked=True, revocation_date=func.now(), revocation_seq=JWT_REVOCATION_SEQ.next_value())
+        .where(JWT.token_id == get_token_id(jwt_str))
+    )
+    await session.commit()
+    expiration_date = get_token_expiration(jwt_str)
+    if expiration_date: revocation_cache.add(get_token_id(jwt_str), expiration_date)
+
+
+async def get_user_from_jwt(jwt_str, session: AsyncSession) -> User:
     user_login = decode_jwt(jwt_str).login
     bd_user: Result = await session.execute(select(User).where(User.login == user_login))
     return bd_user.scalar_one()
 
 
-#работа напрямую с аудетнификацией 
-async def get_current_user(token: str = Depends(oauth2_scheme), access_token: Annotated[str | None, Cookie()] = None, refresh_token: Annotated[str | None, Cookie()] = None) -> User:
+def _user_by_login(login: str) -> Select:
+    return select(User).where(User.login == login)
+
+
+def _user_by_token(token_id: str) -> Select:
+    return select(User).join(JWT, JWT.user == User.id).where(JWT.token_id == token_id, JWT.is_revoked == False)
+
+
+def warmup_statements() -> list[Select]:
+    """statements of the auth dependency, it runs on every authenticated request"""
+    return [_user_by_token(""), _user_by_login("")]
+
+
+async def _get_jwt_owner(jwt_str: str | None, session: AsyncSession) -> User | None:
+    """
+    returns the owner of a valid token, None otherwise
+
+    the token row and the user are resolved in one joined query, in local mode the token table is not used at all
+    """
+    if not jwt_str or not _check_jwt_expiration(jwt_str): return None
+    token_id = get_token_id(jwt_str)
+    if get_settings().jwt_verify_mode == "local" and revocation_cache.is_complete:
+        if token_id in revocation_cache: return None
+        query = _user_by_login(decode_jwt(jwt_str).login)
+    else:
+        query = _user_by_token(token_id)
+    user_from_db: Result = await session.execute(query)
+    return user_from_db.scalar_one_or_none()
+
+
+async def get_current_user(
+        request: Request,
+        response: Response,
+        token: str | None = Depends(oauth2_scheme),
+        access_token: Annotated[str | None, Cookie()] = None,
+        refresh_token: Annotated[str | None, Cookie()] = None,
+        session: AsyncSession = Depends(get_async_session)
+    ) -> User:
     exception_401 = HTTPException(status_code=401, detail="Invalid authentication credentials", headers={"WWW-Authenticate": "Bearer"})
     exception_403 = HTTPException(status_code=403)
-    user: User = None
     
-    if not await check_jwt(access_token):
-        if not await check_jwt(refresh_token): raise exception_401
-        else:
-            user = await get_user_from_jwt(refresh_token)
-            if user:
-                if user.is_blocked: raise exception_403
-                await create_jwt(user)
-                return user
-            
-    user = await get_user_from_jwt(token)
-    if not user: raise exception_401
-    if user.is_blocked: raise exception_403
+    # сессия берется из запроса, FastAPI отдает в обработчик ту же сессию
+    user: User | None = await _get_jwt_owner(token or access_token, session)
+    if not user:
+        if refresh_token:
+            # обновление токена ограничивается по IP до поиска refresh токена
+            retry_after = await rate_limiter.check((REFRESH_BY_IP, client_ip(request)))
+            if retry_after: raise HTTPException(status_code=429, headers={"Retry-After": str(math.ceil(retry_after))})
+        user = await _get_jwt_owner(refresh_token, session)
+        if not user: raise exception_401
+        if user.is_blocked: raise exception_403
+        response.set_cookie("access_token", await create_jwt(user, session, is_refresh=False))
+        return user
     
+    if user.is_blocked: raise exception_403
     return user
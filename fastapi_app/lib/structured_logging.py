@@ -0,0 +1,186 @@
+### sys import
+import os
+
+### std import
+import atexit
+import logging
+import queue
+import random
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+### web import
+import orjson
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10_000))                  #записи сверх очереди отбрасываются, а не ждут диск
+LOG_INFO_SAMPLE_RATE = float(os.getenv('LOG_INFO_SAMPLE_RATE', 1))         #доля сохраняемых записей ниже WARNING
+LOG_SLOW_REQUEST = float(os.getenv('LOG_SLOW_REQUEST', 1))                 #запросы дольше этого пишутся как WARNING и не отбрасываются, сек
+REQUEST_ID_HEADER = "x-request-id"
+
+#запрос, который сейчас обрабатывается в этом контексте
+_request_scope: ContextVar[Scope | None] = ContextVar("request_scope", default=None)
+access_logger = logging.getLogger("access")
+#поток записи, запущенный последним setup_logging
+_listener: QueueListener | None = None
+
+
+class ContextFilter(logging.Filter):
+    """adds the request id and route of the current request, runs in the thread that logs"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        scope = _request_scope.get()
+        if scope is not None:
+            route = scope.get("route")
+            record.request_id = scope["state"]["request_id"]
+            record.route = route.path if route is not None else scope["path"]
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """keeps only a share of records below WARNING, warnings and errors always pass"""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per line"""
+    FIELDS = ("request_id", "route", "method", "status", "latency_ms")
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None: entry[field] = value
+        if record.exc_text: entry["exc"] = record.exc_text
+        return orjson.dumps(entry).decode()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    puts records into a bounded queue without waiting
+
+    the message and traceback are rendered here, so the record is safe to hand to another thread.
+    When the writer falls behind (disk stall) new records are dropped and counted
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(path: str | None = None, level: str = "INFO", sample_rate: float = LOG_INFO_SAMPLE_RATE) -> DroppingQueueHandler:
+    """
+    routes the root logger through a queue to a writer thread emitting json lines, to path or to stderr
+
+    the event loop only filters and enqueues records, file writes happen in the listener thread.
+    A repeated call (every create_app) replaces the previous handler and stops its thread
+    """
+    global _listener
+    writer = logging.FileHandler(path) if path else logging.StreamHandler()
+    writer.setFormatter(JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(sample_rate))
+    handler.addFilter(ContextFilter())
+    listener = QueueListener(handler.queue, writer, respect_handler_level=True)
+    listener.start()
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+        old_handler.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+    _stop_listener()
+    _listener = listener
+    return handler
+
+
+def _stop_listener() -> None:
+    """stops the writer thread, stop writes out the records left in the queue"""
+    global _listener
+    if _listener is None: return
+    _listener.stop()
+    for writer in _listener.handlers: writer.close()
+    _listener = None
+
+
+atexit.register(_stop_listener)
+
+
+class RequestLogMiddleware:
+    """
+    gives every http request an id (taken from X-Request-ID or generated) and writes an access record
+
+    the id is returned in the X-Request-ID header and attached to every record logged while the request is handled.
+    Server errors and slow requests are logged as WARNING, so sampling never drops them
+    """
+
+    def __init__(self, app: ASGIApp, slow_request: float = LOG_SLOW_REQUEST) -> None:
+        self.app = app
+        self.slow_request = slow_request
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1") or uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+        token = _request_scope.set(scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            latency = time.perf_counter() - started
+            level = logging.WARNING if status >= 500 or latency > self.slow_request else logging.INFO
+            if access_logger.isEnabledFor(level):
+                access_logger.log(
+                    level, "%s %s %s", scope["method"], scope["path"], status,
+                    extra={"method": scope["method"], "status": status, "latency_ms": round(latency * 1000, 3)}
+                )
+            _request_scope.reset(token)
+
+
+def logging_metrics() -> dict:
+    """records waiting for the writer thread and records dropped because the queue was full"""
+    handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler)]
+    return {
+        "queued": sum(handler.queue.qsize() for handler in handlers),
+        "dropped": sum(handler.dropped for handler in handlers),
+    }
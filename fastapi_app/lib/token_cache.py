@@ -0,0 +1,148 @@
+### std import
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+### web import
+import jwt
+from sqlalchemy import select, delete, func
+from sqlalchemy.engine import Result
+
+### custom import
+from ..models import JWT
+from ..database import async_session_maker, snapshot_xid
+
+
+TOKEN_ID_SIZE = 16 #размер дайджеста в байтах, в hex - 32 символа
+
+
+def get_token_id(jwt_str: str) -> str:
+    """short fixed-width id of the jwt string"""
+    return hashlib.blake2b(jwt_str.encode(), digest_size=TOKEN_ID_SIZE).hexdigest()
+
+
+def get_token_expiration(jwt_str: str) -> datetime | None:
+    """expiration date of the token without signature check, None for broken tokens"""
+    try:
+        jwt_dict = jwt.decode(jwt_str, options={"verify_signature": False})
+        return datetime.strptime(jwt_dict["expiration_date"], "%Y-%m-%d %H:%M:%S.%f")
+    except (jwt.InvalidTokenError, KeyError, ValueError):
+        return None
+
+
+class RevocationCache:
+    """
+    bounded denylist of revoked token ids
+
+    entries live until the token itself expires, after that the expiry check rejects it anyway.
+    if the cache overflows, it is no longer complete and callers must ask the database.
+    """
+
+    def __init__(self, max_size: int = 100_000) -> None:
+        self.max_size = max_size
+        self.is_complete = False                                #кэш содержит все отозванные токены
+        self.last_seq = 0                                       #все отзывы с номером до него включительно загружены
+        self.last_full_reload: float | None = None              #time.monotonic() последней полной загрузки
+        self._fence: tuple[int, int] | None = None              #(наибольший видимый номер, xmax того же снимка)
+        self._entries: OrderedDict[str, float] = OrderedDict()  #token_id -> время истечения токена (time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, token_id: str) -> bool:
+        expires_at = self._entries.get(token_id)
+        if expires_at is None: return False
+        if expires_at < time.time():
+            del self._entries[token_id]
+            return False
+        return True
+
+    def add(self, token_id: str, expiration_date: datetime) -> None:
+        expires_at = expiration_date.timestamp()
+        if expires_at < time.time(): return
+        self._entries[token_id] = expires_at
+        self._entries.move_to_end(token_id)
+        if len(self._entries) > self.max_size:
+            self.evict_expired()
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.is_complete = False
+
+    def evict_expired(self) -> None:
+        now = time.time()
+        for token_id in [token_id for token_id, expires_at in self._entries.items() if expires_at < now]:
+            del self._entries[token_id]
+
+    async def refresh(self, full_reload_interval: float) -> None:
+        """
+        loads tokens revoked since the last refresh, or all of them if the cache is not complete
+        or full_reload_interval seconds have passed since the last full load
+
+        revocations are numbered from a sequence and commit out of order, so progress moves behind a fence as
+        in lib/rollups: the largest visible number is stored with the xmax of its snapshot, and becomes last_seq
+        only after every transaction below that xmax has finished and its rows have been loaded
+        """
+        full_reload = (not self.is_complete or self.last_full_reload is None
+                       or time.monotonic() - self.last_full_reload > full_reload_interval)
+        last_seq, fence = (0, None) if full_reload else (self.last_seq, self._fence)
+        query = select(JWT.token_id, JWT.expires_at).where(JWT.is_revoked == True, JWT.expires_at > datetime.now())
+        if last_seq: query = query.where(JWT.revocation_seq > last_seq)
+        async with async_session_maker() as session:
+            #граница проверяется до загрузки: если пройдена, строки до нее видны запросу ниже
+            if fence is not None:
+                xmin_r: Result = await session.execute(select(snapshot_xid(func.pg_snapshot_xmin)))
+                if xmin_r.scalar_one() < fence[1]: fence = None
+            revoked: Result = await session.execute(query)
+            rows = revoked.all()
+            fence_r: Result = await session.execute(select(func.max(JWT.revocation_seq), snapshot_xid(func.pg_snapshot_xmax)))
+            new_fence = fence_r.one()
+
+        if full_reload:
+            self._entries.clear()
+            self.is_complete = True
+            self.last_full_reload = time.monotonic()
+        for token_id, expires_at in rows:
+            self.add(token_id, expires_at)
+        if fence is not None: last_seq = fence[0]
+        elif not full_reload and self._fence is not None: new_fence = self._fence #старая граница еще не пройдена
+        self.last_seq = last_seq
+        self._fence = new_fence if new_fence[0] is not None and new_fence[0] > last_seq else None
+        self.evict_expired()
+        if not self.is_complete:
+            logging.warning("revocation cache overflow, max_size=%s: falling back to database checks", self.max_size)
+
+    async def run(self, interval: float, full_reload_interval: float) -> None:
+        """background refresh loop"""
+        while True:
+            try:
+                await self.refresh(full_reload_interval)
+            except Exception as e:
+                logging.error("revocation cache refresh error:\n%s", e)
+            await asyncio.sleep(interval)
+
+
+async def purge_expired_tokens(batch_size: int) -> int:
+    """deletes expired tokens in batches of batch_size, returns the number of deleted rows"""
+    deleted = 0
+    while True:
+        expired = select(JWT.id).where(JWT.expires_at < datetime.now()).limit(batch_size).scalar_subquery()
+        async with async_session_maker() as session:
+            result: Result = await session.execute(delete(JWT).where(JWT.id.in_(expired)))
+            await session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size: return deleted
+        await asyncio.sleep(0) #отдаем управление другим задачам между пачками
+
+
+async def run_token_sweeper(interval: float, batch_size: int) -> None:
+    """background loop removing expired tokens from the jwt table"""
+    while True:
+        try:
+            deleted = await purge_expired_tokens(batch_size)
+            if deleted: logging.info("token sweeper: %s expired tokens deleted", deleted)
+        except Exception as e:
+            logging.error("token sweeper error:\n%s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,96 @@
+### sys import
+import os
+
+### std import
+import asyncio
+from dataclasses import dataclass
+
+### web import
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+### custom import
+from .blob_store import BlobStore, BlobWriter
+
+
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', 10 * 1024 * 1024))        #максимальный размер одного изображения, байт
+IMAGE_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+
+
+class UploadError(ValueError):
+    pass
+
+
+@dataclass
+class UploadedBlob:
+    digest: str
+    size: int
+    content_type: str
+    temp_path: str
+
+
+async def stream_images(request: Request, store: BlobStore, max_size: int = IMAGE_MAX_SIZE) -> list[UploadedBlob]:
+    """
+    parses a multipart body chunk by chunk, every file part goes straight to a temporary blob file
+
+    nothing but the current chunk is kept in memory. On error all written files are removed
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("multipart/form-data body expected")
+
+    #события парсера копятся на время разбора одного чанка и обрабатываются после него
+    events: list[tuple[str, bytes | dict]] = []
+    header_field = bytearray()
+    header_value = bytearray()
+    headers: dict[bytes, bytes] = {}
+
+    def on_header_field(data: bytes, start: int, end: int): header_field.extend(data[start:end])
+    def on_header_value(data: bytes, start: int, end: int): header_value.extend(data[start:end])
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+    def on_headers_finished():
+        events.append(("begin", headers.copy()))
+        headers.clear()
+    def on_part_data(data: bytes, start: int, end: int): events.append(("data", data[start:end]))
+    def on_part_end(): events.append(("end", b""))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    uploaded: list[UploadedBlob] = []
+    writer: BlobWriter | None = None
+    part_content_type = ""
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, data in events:
+                match event:
+                    case "begin":
+                        _, disposition = parse_options_header(data.get(b"content-disposition", b""))
+                        if b"filename" not in disposition: continue #обычные поля формы пропускаются
+                        part_content_type = data.get(b"content-type", b"").decode()
+                        if part_content_type not in IMAGE_CONTENT_TYPES:
+                            raise UploadError(f"unsupported content type [{part_content_type}]")
+                        writer = store.writer(max_size)
+                    case "data" if writer:
+                        await asyncio.to_thread(writer.write, data)
+                    case "end" if writer:
+                        digest = writer.close()
+                        uploaded.append(UploadedBlob(digest, writer.size, part_content_type, writer.temp_path))
+                        writer = None
+            events.clear()
+        parser.finalize()
+    except Exception:
+        if writer: writer.discard()
+        store.discard(blob.temp_path for blob in uploaded)
+        raise
+    return uploaded
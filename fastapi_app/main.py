@@ -1,14 +1,26 @@
-import logging
-import os
+import asyncio
+from contextlib import asynccontextmanager
 
-from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 
 from .routers.user_router import user_router, auth_router
 from .routers.shop_router import shop_router
+from .routers.image_router import image_router
+from .routers.product_router import product_router
+from .routers.basket_router import basket_router
+from .routers.moderation_router import moderation_router
+from .routers.internal_router import internal_router, require_internal_access
+from .lib.secure import revocation_cache, warmup_statements
+from .lib.token_cache import run_token_sweeper
+from .lib.password_hasher import password_hasher
+from .lib.blob_store import blob_store, run_blob_sweeper, shutdown_thumbnail_executor
+from .lib.rollups import run_sales_rollup
+from .lib.mail_outbox import SmtpPool, run_mail_dispatcher, run_mail_sweeper
+from .lib.structured_logging import setup_logging, RequestLogMiddleware
+from .lib.metrics import instrument_engine, MetricsMiddleware
+from .database import init_engine, dispose_engine, warm_pool
+from .settings import Settings, configure
 
-load_dotenv()
-LOG_PATH = os.getenv('LOG_PATH')
 tags_metadata = [
     {
         "name": "auth",
@@ -26,27 +38,114 @@ tags_metadata = [
         "name": "shops",
         "description": "actions with shop.",
     },
+    {
+        "name": "products",
+        "description": "product catalog.",
+    },
+    {
+        "name": "baskets",
+        "description": "user baskets and checkout.",
+    },
+    {
+        "name": "images",
+        "description": "images from the blob store.",
+    },
+    {
+        "name": "moderation",
+        "description": "confirmation requests queue for moderators.",
+    },
 ]
 API_VERSION="/api/v1"
 
-app = FastAPI(openapi_tags=tags_metadata)
 
-logging.basicConfig(filename=LOG_PATH, level=logging.INFO)
+def create_app(settings: Settings | None = None) -> FastAPI:
+    """
+    builds the application, nothing connects to the database until the lifespan starts
+
+    run with: uvicorn --factory fastapi_app.main:create_app --env-file fastapi_app/.env
+    """
+    #модули читают настройки при вызове, поэтому переданные сюда действуют и на них
+    settings = configure(settings or Settings.from_env())
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        #пул прогревается до приема запросов, первые запросы не ждут подключения и prepare
+        engine = init_engine(settings)
+        instrument_engine(engine)
+        await warm_pool(engine, settings.db_pool_warmup, [] if settings.db_pgbouncer else warmup_statements())
+        #фоновые задачи приложения
+        tasks: list[asyncio.Task] = [
+            asyncio.create_task(run_token_sweeper(settings.jwt_sweep_interval, settings.jwt_sweep_batch_size)),
+            asyncio.create_task(run_sales_rollup(settings.rollup_interval, settings.rollup_batch_size)),
+            asyncio.create_task(run_mail_sweeper(settings.mail_sweep_interval, settings.verify_code_ttl, settings.mail_retention)),
+            asyncio.create_task(run_blob_sweeper(blob_store, settings.blob_sweep_interval, settings.blob_sweep_batch_size))
+        ]
+        if settings.jwt_verify_mode == "local":
+            revocation_cache.max_size = settings.jwt_revocation_cache_size
+            tasks.append(asyncio.create_task(revocation_cache.run(settings.jwt_revocation_refresh, settings.jwt_revocation_full_reload)))
+        smtp_pool = SmtpPool.from_settings(settings) if settings.smtp_host else None
+        if smtp_pool:
+            tasks.append(asyncio.create_task(run_mail_dispatcher(smtp_pool, settings.mail_interval, settings.mail_batch_size, settings.mail_lease)))
+        yield
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if smtp_pool: smtp_pool.close()
+        password_hasher.shutdown()
+        shutdown_thumbnail_executor()
+        await dispose_engine()
+
+    app = FastAPI(openapi_tags=tags_metadata, lifespan=lifespan)
+
+    #записи уходят в очередь, в файл их пишет отдельный поток
+    setup_logging(settings.log_path, settings.log_level)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(RequestLogMiddleware) #добавленный последним выполняется первым, request id есть и в записях метрик
+
+    app.include_router(
+        router=auth_router,
+        prefix=f"{API_VERSION}",
+        tags=["auth"]
+    )
+
+    app.include_router(
+        router=user_router,
+        prefix=f"{API_VERSION}/users",
+        tags=["users"]
+    )
+
+    app.include_router(
+        router=shop_router,
+        prefix=f"{API_VERSION}/shops",
+        tags=["shops"]
+    )
+
+    app.include_router(
+        router=product_router,
+        prefix=f"{API_VERSION}/products",
+        tags=["products"]
+    )
+
+    app.include_router(
+        router=basket_router,
+        prefix=f"{API_VERSION}/baskets",
+        tags=["baskets"]
+    )
 
-app.include_router(
-    router=auth_router,
-    prefix=f"{API_VERSION}",
-    tags=["auth"]
-)
+    app.include_router(
+        router=image_router,
+        prefix=f"{API_VERSION}/images",
+        tags=["images"]
+    )
 
-app.include_router(
-    router=user_router,
-    prefix=f"{API_VERSION}/users",
-    tags=["users"]
-)
+    app.include_router(
+        router=moderation_router,
+        prefix=f"{API_VERSION}/moderation",
+        tags=["moderation"]
+    )
 
-app.include_router(
-    router=shop_router,
-    prefix=f"{API_VERSION}/shops",
-    tags=["shops"]
-)
+    app.include_router(
+        router=internal_router,
+        prefix="/internal",
+        dependencies=[Depends(require_internal_access)]
+    )
+    return app
@@ -3,13 +3,22 @@ from datetime import date, datetime
 from sqlalchemy import (
     String,
     Integer,
+    BigInteger,
     Boolean,
     Date,
     DateTime,
     ForeignKey,
+    Index,
+    Sequence,
+    UniqueConstraint,
+    Computed,
+    DDL,
     Text,
-    Float
+    Float,
+    event,
+    text
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -22,6 +31,10 @@ class Base(DeclarativeBase):
     pass
 
 
+#расширение для триграммных индексов (в миграции alembic добавляется вручную через op.execute)
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
 #пользовтель
 class User(Base):
     __tablename__ = "user"
@@ -44,28 +57,65 @@ class User(Base):
 #коды верификации, отправленные на почту
 class VerifyCode(Base):
     __tablename__ = "verifi_code"
+    __table_args__ = (
+        Index("ix_verifi_code_active_date_of_creation", "date_of_creation", postgresql_where=text("NOT is_expired")),  #поиск кодов с истекшим сроком
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete='CASCADE'))                                   #пользователь, который должен подтвердить код
+    user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete='CASCADE'), index=True)                       #пользователь, который должен подтвердить код
     code: Mapped[str] = mapped_column(String(10), nullable=False)                                                   #пользователь, который должен подтвердить код
-    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now())    #дата и время создания
+    is_expired: Mapped[bool] = mapped_column(type_=Boolean(), default=False, nullable=False)                        #срок действия кода истек
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)      #дата и время создания
+
+
+#исходящие письма: пишутся в одной транзакции с данными, отправляются фоновой задачей
+class MailOutbox(Base):
+    __tablename__ = "mail_outbox"
+    __table_args__ = (
+        Index("ix_mail_outbox_pending_next_attempt_at", "next_attempt_at", postgresql_where=text("status = 'pending'")),  #очередь отправки
+    )
+    
+    id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
+    recipient: Mapped[str] = mapped_column(String(255), nullable=False)                                             #адрес получателя
+    subject: Mapped[str] = mapped_column(String(255), nullable=False)                                               #тема письма
+    body: Mapped[str] = mapped_column(Text(), nullable=False)                                                       #текст письма
+    status: Mapped[str] = mapped_column(String(16), default="pending", nullable=False)                              #pending / sent / failed / expired
+    attempts: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                     #количество попыток отправки
+    last_error: Mapped[str] = mapped_column(Text(), nullable=True)                                                  #ошибка последней попытки
+    next_attempt_at: Mapped[datetime] = mapped_column(type_=DateTime(), default=datetime.now, nullable=False)       #время следующей попытки
+    expires_at: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=True, index=True)                       #после этого времени письмо не отправляется
+    sent_at: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=True)                                      #дата и время отправки
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), default=datetime.now, nullable=False)      #дата и время создания
     
 
+#номера отзывов токенов, порядок загрузки в кэш отозванных (lib/token_cache.RevocationCache)
+JWT_REVOCATION_SEQ = Sequence("jwt_revocation_seq", metadata=Base.metadata)
+
+
 #JWT токены авторизации
 class JWT(Base):
     __tablename__ = "jwt"
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    user: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete='CASCADE'))                                      #владелец токена
-    token: Mapped[str] = mapped_column(String(4096), nullable=False)                                                                #jwt строка
+    user: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete='CASCADE'), index=True)                          #владелец токена
+    token_id: Mapped[str] = mapped_column(String(32), unique=True, nullable=False)                                  #хэш jwt строки (см. lib/token_cache.get_token_id)
+    expires_at: Mapped[datetime] = mapped_column(type_=DateTime(), index=True, nullable=False)                      #дата и время истечения токена
+    is_revoked: Mapped[bool] = mapped_column(type_=Boolean(), default=False, nullable=False)                        #токен отозван
+    revocation_date: Mapped[datetime] = mapped_column(type_=DateTime(), default=None, nullable=True)                #дата и время отзыва токена (часы БД)
+    revocation_seq: Mapped[int] = mapped_column(BigInteger(), nullable=True, index=True)                             #номер отзыва из JWT_REVOCATION_SEQ, по нему кэш отозванных догружает новые
 
 
 #магазин
 class Shop(Base):
     __tablename__ = "shop"
+    __table_args__ = (
+        Index("ix_shop_active_id", "id", postgresql_where=text("NOT is_deleted")),                                        #список магазинов (get_shops)
+        Index("ix_shop_active_confirmed_id", "is_confirmed", "id", postgresql_where=text("NOT is_deleted")),              #список магазинов с фильтром is_confirmed
+        Index("ix_shop_active_name", "name", postgresql_ops={"name": "text_pattern_ops"}, postgresql_where=text("NOT is_deleted")),   #поиск по префиксу названия
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    owner_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)                  #пользователь создавший магазин
+    owner_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True, index=True)      #пользователь создавший магазин
     name: Mapped[str] = mapped_column(type_=String(255), nullable=False)                                            #название
     description: Mapped[str] = mapped_column(type_=Text(), nullable=True)                                          #описание
     avatar_img: Mapped[str] = mapped_column(type_=String(255), default="default.png", nullable=False)               #ссылка на аватар магазина
@@ -75,13 +125,30 @@ class Shop(Base):
     date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), default=datetime.now(), nullable=False)    #дата и время создания
 
 
+#файлы изображений в хранилище (lib/blob_store.py), общие для одинакового содержимого
+class ImageBlob(Base):
+    __tablename__ = "image_blob"
+    __table_args__ = (
+        Index("ix_image_blob_unused", "digest", postgresql_where=text("ref_count <= 0")),                             #файлы без ссылок для очистки
+    )
+    
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)                                               #sha256 содержимого, ключ файла в хранилище
+    size: Mapped[int] = mapped_column(Integer(), nullable=False)                                                    #размер файла, байт
+    content_type: Mapped[str] = mapped_column(String(255), nullable=False)                                          #mime тип
+    ref_count: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                    #количество ссылок на файл
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)      #дата и время создания
+
+
 #фотографии магазинов
 class ShopImage(Base):
     __tablename__ = "shop_image"
+    __table_args__ = (
+        Index("ix_shop_image_shop_id_id", "shop_id", "id"),                                                         #изображения магазина в порядке загрузки
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
     shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete='CASCADE'))                                   #магазин, для которого сделано фото
-    src: Mapped[str] = mapped_column(type_=String(255), nullable=False)                                             #ссылка на изображение
+    src: Mapped[str] = mapped_column(type_=String(255), nullable=False)                                             #ссылка на изображение (digest в image_blob)
 
 
 #позиция сотрудников магазина и права сотрудников этой позиции
@@ -90,7 +157,7 @@ class Position(Base):
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
     name: Mapped[str] = mapped_column(type_=String(255), nullable=False)                                            #название
-    creator_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)                #пользователь, создавший позицию
+    creator_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True, index=True)    #пользователь, создавший позицию
     can_add_staff: Mapped[bool] = mapped_column(type_=Boolean(), default=False, nullable=False)                     #возможность добавлять сотрудников магазина
     can_change_staff: Mapped[bool] = mapped_column(type_=Boolean(), default=False, nullable=False)                  #возможность изменять сотрудников магазина
     can_delete_staff: Mapped[bool] = mapped_column(type_=Boolean(), default=False, nullable=False)                  #возможность удалять сотрудников магазина
@@ -104,26 +171,37 @@ class Position(Base):
 #сотрудники магазина
 class ShopAndUser(Base):
     __tablename__ = "shop_and_user"
+    __table_args__ = (
+        Index("ix_shop_and_user_shop_id_user_id", "shop_id", "user_id", unique=True, postgresql_include=["position_id", "id"]),  #один найм пользователя в магазин, страница сотрудников только по индексу
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="CASCADE"), nullable=False)                   #сотрудник магазина
+    user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="CASCADE"), nullable=False, index=True)       #сотрудник магазина
     shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"), nullable=False)                   #магазин
-    position_id: Mapped[int] = mapped_column(ForeignKey(Position.id, ondelete="SET NULL"), nullable=True)           #занимаемая сотрудником должность
+    position_id: Mapped[int] = mapped_column(ForeignKey(Position.id, ondelete="SET NULL"), nullable=True, index=True)   #занимаемая сотрудником должность
 
 
 class ShopRequestForConfirmation(Base):
     __tablename__ = "shop_request_for_confirmation"
+    __table_args__ = (
+        Index("ix_shop_request_for_confirmation_pending", "id", postgresql_where=text("NOT is_processed")),    #очередь модерации
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"))                                   #магазин
-    is_processed: Mapped[bool] = mapped_column(Boolean(), default=True)                                             #запрос в обработке / обработан
+    shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"), index=True)                       #магазин
+    is_processed: Mapped[bool] = mapped_column(Boolean(), default=False, nullable=False)                            #запрос обработан / в обработке
     is_rejected: Mapped[bool] = mapped_column(Boolean(), default=None, nullable=True)                               #запрос отклонен / одобрен
-    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now())    #дата и время создания
-    date_of_change: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False)                              #дата и время изменения
+    moderator_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)              #модератор, взявший запрос в работу
+    claim_expires_at: Mapped[datetime] = mapped_column(type_=DateTime(), default=None, nullable=True)               #до какого момента запрос закреплен за модератором
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)      #дата и время создания
+    date_of_change: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)        #дата и время изменения
 
 
 class Brand(Base):
     __tablename__ = "brand"
+    __table_args__ = (
+        Index("ix_brand_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),     #поиск бренда по подстроке
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
     user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)                   #пользователь добавивший бренд
@@ -147,10 +225,15 @@ class Category(Base):
 #продукты магазинов
 class Product(Base):
     __tablename__ = "product"
+    __table_args__ = (
+        Index("ix_product_search_vector", "search_vector", postgresql_using="gin"),                                 #полнотекстовый поиск по названию
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    brand_id: Mapped[int] = mapped_column(ForeignKey(Brand.id, ondelete="SET NULL"), nullable=True)                 #бренд продукта
-    category_id: Mapped[int] = mapped_column(ForeignKey(Category.id, ondelete="SET NULL"), nullable=True)           #категория, к которой относится продукт
+    name: Mapped[str] = mapped_column(String(255), nullable=False, server_default="")                              #название (default для уже существующих строк при миграции)
+    search_vector: Mapped[str] = mapped_column(TSVECTOR(), Computed("to_tsvector('simple', name)", persisted=True)) #поисковый вектор названия
+    brand_id: Mapped[int] = mapped_column(ForeignKey(Brand.id, ondelete="SET NULL"), nullable=True, index=True)     #бренд продукта
+    category_id: Mapped[int] = mapped_column(ForeignKey(Category.id, ondelete="SET NULL"), nullable=True, index=True)   #категория, к которой относится продукт
     user_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)                   #пользователь добавивший продукт
 
 class ProductImage(Base):
@@ -165,22 +248,31 @@ class ProductImage(Base):
 #запросы на подтверждение бренда
 class RequestForConfirmation(Base):
     __tablename__ = "request_for_confirmation"
+    __table_args__ = (
+        Index("ix_request_for_confirmation_pending", "id", postgresql_where=text("NOT is_processed")),    #очередь модерации
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
-    brand_id: Mapped[int] = mapped_column(ForeignKey(Brand.id, ondelete="CASCADE"))                                 #какой бренд оставил запрос на подтверждение
-    is_processed: Mapped[bool] = mapped_column(Boolean(), default=True)                                             #запрос в обработке / обработан
+    brand_id: Mapped[int] = mapped_column(ForeignKey(Brand.id, ondelete="CASCADE"), index=True)                     #какой бренд оставил запрос на подтверждение
+    is_processed: Mapped[bool] = mapped_column(Boolean(), default=False, nullable=False)                            #запрос обработан / в обработке
     is_rejected: Mapped[bool] = mapped_column(Boolean(), default=None, nullable=True)                               #запрос отклонен / одобрен
-    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now())    #дата и время создания
-    date_of_change: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False)                              #дата и время изменения
+    moderator_id: Mapped[int] = mapped_column(ForeignKey(User.id, ondelete="SET NULL"), nullable=True)              #модератор, взявший запрос в работу
+    claim_expires_at: Mapped[datetime] = mapped_column(type_=DateTime(), default=None, nullable=True)               #до какого момента запрос закреплен за модератором
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)      #дата и время создания
+    date_of_change: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now)        #дата и время изменения
 
 
 #наличие продукта в магазине 
 class ProductInShop(Base):
     __tablename__ = "product_in_shop"
+    __table_args__ = (
+        Index("ix_product_in_shop_in_stock", "product_id", "id", postgresql_where=text("amount > 0")),             #поиск только по товарам в наличии
+        UniqueConstraint("shop_id", "product_id", name="uq_product_in_shop_shop_id_product_id"),                    #цель upsert при импорте, покрывает поиск по shop_id
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
     shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"))                                   #магазин, в котором лежит продукт
-    product_id: Mapped[int] = mapped_column(ForeignKey(Product.id, ondelete="SET NULL"), nullable=True)             #продукт, который лежит в магазине
+    product_id: Mapped[int] = mapped_column(ForeignKey(Product.id, ondelete="SET NULL"), nullable=True, index=True) #продукт, который лежит в магазине
     amount: Mapped[int] = mapped_column(Integer(), default=None, nullable=True)                                     #количество продукта
     price: Mapped[float] = mapped_column(Float(), default=None, nullable=True)                                      #цена продукта
     date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now())    #дата и время создания
@@ -204,9 +296,25 @@ class Basket(Base):
     is_paid: Mapped[bool] = mapped_column(type_=Boolean(), default=False)                                           #оплачено / не оплачено
 
 
+#продукты в корзине
+class ProductInBasket(Base):
+    __tablename__ = "product_in_basket"
+    __table_args__ = (
+        UniqueConstraint("basket_id", "product_in_shop_id"),
+    )
+    
+    id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
+    basket_id: Mapped[int] = mapped_column(ForeignKey(Basket.id, ondelete="CASCADE"), nullable=False)               #корзина
+    product_in_shop_id: Mapped[int] = mapped_column(ForeignKey(ProductInShop.id, ondelete="CASCADE"), nullable=False)   #продукт магазина
+    amount: Mapped[int] = mapped_column(Integer(), nullable=False)                                                  #количество продукта
+
+
 #чеки оплаты
 class Payment(Base):
     __tablename__ = "payment"
+    __table_args__ = (
+        Index("ix_payment_shop_id_date_of_creation", "shop_id", "date_of_creation"),                                #продажи магазина за период
+    )
     
     id: Mapped[int] = mapped_column(type_=Integer(), primary_key=True, autoincrement=True)                          #уникальный идентификатор
     product_id: Mapped[int] = mapped_column(ForeignKey(Product.id, ondelete="SET NULL"), nullable=True)             #продукт, который был продан
@@ -215,5 +323,40 @@ class Payment(Base):
     amount: Mapped[int] = mapped_column(Integer(), nullable=False)                                                  #количество товара в чеке
     total: Mapped[float] = mapped_column(type_=Float(), nullable=False)                                             #суммарная стоимость до вычета налогов
     tax: Mapped[float] = mapped_column(type_=Float(), nullable=False)                                               #НДФЛ и другие налоги
-    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now())    #дата и время создания
+    date_of_creation: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=False, default=datetime.now, index=True)      #дата и время создания
+
 
+#состояние инкрементальных агрегатов: до какого чека включительно данные уже учтены
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)                                                 #название агрегата
+    last_id: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                      #последний учтенный id исходной таблицы
+    fence_id: Mapped[int] = mapped_column(Integer(), nullable=True)                                                 #наибольший id, видимый в снимке fence_xid
+    fence_xid: Mapped[int] = mapped_column(BigInteger(), nullable=True)                                             #xmax того снимка: когда все транзакции до него завершены, строки до fence_id видны все
+    date_of_change: Mapped[datetime] = mapped_column(type_=DateTime(), nullable=True)                               #дата и время последнего обновления
+
+
+#продажи магазина за день
+class ShopSalesDaily(Base):
+    __tablename__ = "shop_sales_daily"
+    
+    shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"), primary_key=True)                 #магазин
+    day: Mapped[date] = mapped_column(Date(), primary_key=True)                                                     #день продаж
+    units: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                        #продано единиц товара
+    revenue: Mapped[float] = mapped_column(Float(), default=0, nullable=False)                                      #выручка до вычета налогов
+    tax: Mapped[float] = mapped_column(Float(), default=0, nullable=False)                                          #налоги
+    payments: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                     #количество чеков
+
+
+#продажи продукта в магазине за день
+class ProductSalesDaily(Base):
+    __tablename__ = "product_sales_daily"
+    
+    shop_id: Mapped[int] = mapped_column(ForeignKey(Shop.id, ondelete="CASCADE"), primary_key=True)                 #магазин
+    day: Mapped[date] = mapped_column(Date(), primary_key=True)                                                     #день продаж
+    product_id: Mapped[int] = mapped_column(Integer(), primary_key=True)                                            #продукт, 0 - удаленный продукт (без внешнего ключа, история сохраняется)
+    units: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                        #продано единиц товара
+    revenue: Mapped[float] = mapped_column(Float(), default=0, nullable=False)                                      #выручка до вычета налогов
+    tax: Mapped[float] = mapped_column(Float(), default=0, nullable=False)                                          #налоги
+    payments: Mapped[int] = mapped_column(Integer(), default=0, nullable=False)                                     #количество чеков
@@ -0,0 +1,66 @@
+import logging
+
+from fastapi import (
+    APIRouter,
+    Depends
+)
+from sqlalchemy import select, insert, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Result
+
+from ..lib.pydantic_models import pd_basket_item
+from ..lib.secure import get_current_user
+from ..lib.checkout import checkout, CheckoutError, OutOfStock
+from ..lib.exceptions import NotFound, Forbidden, NotAcceptable, ResponseException
+from ..lib.responses import JResponse, Created
+from ..models import User, Basket, ProductInBasket
+from ..database import get_async_session
+
+basket_router = APIRouter()
+
+
+@basket_router.post("/")
+async def create_basket(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    basket_r: Result = await session.execute(insert(Basket).values(user_id=cur_user.id, is_paid=False).returning(Basket.id))
+    basket_id: int = basket_r.scalar_one()
+    await session.commit()
+    return Created(body={"id" : basket_id})
+
+
+@basket_router.put("/{basket_id}/items")
+async def set_basket_item(basket_id: int, item: pd_basket_item, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """sets the amount of a product in the basket, zero removes it"""
+    #блокировка корзины до commit: оплата (lib/checkout) либо дождется изменения и увидит товар, либо пройдет раньше и is_paid будет прочитан уже True
+    basket_r: Result = await session.execute(select(Basket.user_id, Basket.is_paid).where(Basket.id == basket_id).with_for_update())
+    basket = basket_r.one_or_none()
+    if basket is None: return NotFound(message=f"basket with id [{basket_id}] does not exist")
+    if basket.user_id != cur_user.id: return Forbidden(message="you can only change your basket")
+    if basket.is_paid: return NotAcceptable(message="basket is already paid")
+    
+    if item.amount <= 0:
+        await session.execute(delete(ProductInBasket).where(ProductInBasket.basket_id == basket_id, ProductInBasket.product_in_shop_id == item.product_in_shop_id))
+    else:
+        item_insert = pg_insert(ProductInBasket).values(basket_id=basket_id, **item.model_dump())
+        try:
+            await session.execute(item_insert.on_conflict_do_update(
+                index_elements=[ProductInBasket.basket_id, ProductInBasket.product_in_shop_id],
+                set_={"amount": item_insert.excluded.amount}
+            ))
+        except IntegrityError as e:
+            logging.error("PUT basket item error:\n%s", e._message())
+            return NotFound(message=f"product with id [{item.product_in_shop_id}] does not exist")
+    await session.commit()
+    return JResponse(message="basket updated")
+
+
+@basket_router.post("/{basket_id}/checkout")
+async def checkout_basket(basket_id: int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    try:
+        payments = await checkout(session, basket_id, cur_user.id)
+    except OutOfStock as e:
+        return NotAcceptable(message=e.message, body={"product_in_shop_ids" : e.product_in_shop_ids})
+    except CheckoutError as e:
+        return ResponseException(message=e.message)
+    return JResponse(message="basket paid", body=payments)
@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Request
+)
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Result
+
+from ..lib.exceptions import NotFound
+from ..lib.responses import FileRangeResponse
+from ..lib.blob_store import blob_store, THUMBNAIL_SIZES
+from ..lib.cache import cache, blob_key
+from ..models import ImageBlob
+from ..database import get_async_session
+
+image_router = APIRouter()
+
+DIGEST_REGEX = re.compile(r"[0-9a-f]{64}")
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable" #содержимое по адресу никогда не меняется
+FALLBACK_CACHE_CONTROL = "no-cache"                         #оригинал вместо еще не готового превью, кэш должен перепроверять
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses weak comparison"""
+    if not if_none_match: return False
+    if if_none_match.strip() == "*": return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def parse_range(range_header: str, file_size: int) -> tuple[int, int] | None:
+    """
+    single byte range as (start, end), None if it cannot be satisfied
+
+    multiple ranges and malformed headers are answered with the whole file
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges: return (0, file_size - 1)
+    start_s, _, end_s = ranges.strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = min(int(end_s), file_size - 1) if end_s else file_size - 1
+        else:
+            start = max(file_size - int(end_s), 0) #последние N байт
+            end = file_size - 1
+    except ValueError:
+        return (0, file_size - 1)
+    if start > end or start >= file_size: return None
+    return (start, end)
+
+
+@image_router.get("/{src}")
+async def get_image(src: str, request: Request, size: int | None = None, session: Session = Depends(get_async_session)):
+    """image from the blob store, size selects a thumbnail"""
+    if not DIGEST_REGEX.fullmatch(src): return NotFound(message="image not found")
+    path = blob_store.path(src)
+    etag: str | None = f'"{src}"'
+    media_type = None
+    if size is not None:
+        if size not in THUMBNAIL_SIZES: return NotFound(message=f"thumbnail size [{size}] is not available")
+        thumbnail_path = blob_store.thumbnail_path(src, size)
+        if os.path.exists(thumbnail_path):
+            path, etag, media_type = thumbnail_path, f'"{src}_{size}"', "image/webp"
+        else:
+            #пока превью не готово, отдается оригинал без ETag и без долгого кэширования,
+            #иначе кэши закрепят оригинал за адресом превью
+            etag = None
+    if etag is not None: headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    else: headers = {"Cache-Control": FALLBACK_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    #ETag зависит только от адреса, 304 отдается без обращения к БД и диску
+    if etag is not None and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if media_type is None:
+        async def load_content_type() -> str | None:
+            blob_r: Result = await session.execute(select(ImageBlob.content_type).where(ImageBlob.digest == src))
+            return blob_r.scalar_one_or_none()
+        media_type = await cache.get_or_load(blob_key(src), load_content_type)
+        if media_type is None: return NotFound(message="image not found")
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        logging.error("404 GET image: blob [%s] is registered but missing on disk", src)
+        return NotFound(message="image not found")
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    #If-Range без ETag у ответа проверить нечем, тогда отдается весь файл
+    if range_header and (if_range is None or (etag is not None and if_range == etag)):
+        byte_range = parse_range(range_header, stat.st_size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range != (0, stat.st_size - 1):
+            return FileRangeResponse(path, *byte_range, stat.st_size, headers=headers, media_type=media_type)
+
+    response = FileResponse(path, headers=headers, media_type=media_type, stat_result=stat)
+    #FileResponse сам выставляет ETag по stat оригинала, для подмены превью он не нужен
+    if etag is None: del response.headers["etag"]
+    return response
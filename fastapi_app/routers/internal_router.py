@@ -0,0 +1,79 @@
+import hmac
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+
+from ..lib.cache import cache
+from ..database import pool_metrics, get_async_session
+from ..lib.responses import JResponse
+from ..lib.rollups import rollup_metrics
+from ..lib.moderation import QUEUES, queue_stats
+from ..lib.rate_limit import rate_limiter
+from ..lib.structured_logging import logging_metrics
+from ..lib.metrics import metrics, PROMETHEUS_MEDIA_TYPE
+from ..lib.password_hasher import password_hasher
+from ..settings import get_settings
+
+#служебные эндпоинты, по умолчанию выключены (INTERNAL_ENDPOINTS_ENABLED), подключаются с require_internal_access
+internal_router = APIRouter(include_in_schema=False)
+
+
+async def require_internal_access(x_internal_token: Annotated[str | None, Header()] = None):
+    """allows internal endpoints only when they are enabled and, if a token is set, the request carries it"""
+    settings = get_settings()
+    if not settings.internal_endpoints_enabled: raise HTTPException(status_code=404)
+    if settings.internal_token is not None and not hmac.compare_digest((x_internal_token or "").encode(), settings.internal_token.encode()):
+        raise HTTPException(status_code=403)
+
+
+@internal_router.get("/cache")
+async def get_cache_metrics():
+    """cache hit and miss counters"""
+    return JResponse(body=cache.metrics())
+
+
+@internal_router.get("/password-hasher")
+async def get_password_hasher_metrics():
+    """bcrypt calls, time they waited for the worker pool and hashes upgraded on signin"""
+    return JResponse(body=password_hasher.metrics())
+
+
+@internal_router.get("/pool")
+async def get_pool_metrics():
+    """database connection pool saturation: checked out connections, overflow and checkout wait time"""
+    return JResponse(body=pool_metrics())
+
+
+@internal_router.get("/rollups")
+async def get_rollup_metrics():
+    """sales rollup high-water mark and how many payment ids are not rolled up yet"""
+    return JResponse(body=await rollup_metrics())
+
+
+@internal_router.get("/moderation")
+async def get_moderation_metrics(session: Session = Depends(get_async_session)):
+    """depth and oldest request age of every moderation queue"""
+    return JResponse(body={name: await queue_stats(session, queue) for name, queue in QUEUES.items()})
+
+
+
+@internal_router.get("/rate-limit")
+async def get_rate_limit_metrics():
+    """allowed and rejected request counters of every rate limit rule"""
+    return JResponse(body=rate_limiter.metrics())
+
+
+
+@internal_router.get("/logging")
+async def get_logging_metrics():
+    """log records waiting for the writer thread and records dropped on overflow"""
+    return JResponse(body=logging_metrics())
+
+
+
+@internal_router.get("/metrics")
+async def get_metrics():
+    """per-route latency, status and database query histograms in the prometheus text format"""
+    return Response(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
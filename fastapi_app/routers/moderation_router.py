@@ -0,0 +1,69 @@
+from typing import Annotated, Literal
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Query
+)
+from sqlalchemy.orm import Session
+
+from ..lib.pydantic_models import pd_moderation_decisions
+from ..lib.secure import get_current_user
+from ..lib.exceptions import Forbidden, ResponseException
+from ..lib.responses import JResponse
+from ..lib.cache import cache, shop_key
+from ..lib.moderation import QUEUES, MODERATION_MAX_BATCH, claim, decide, queue_stats
+from ..models import User
+from ..database import get_async_session
+
+moderation_router = APIRouter()
+
+QueueName = Literal["shops", "brands"]
+
+
+def _check_moderator(cur_user: User) -> JResponse | None:
+    if not (cur_user.is_admin or cur_user.is_superuser): return Forbidden(message="only moderators can process requests")
+    return None
+
+
+@moderation_router.get("/{queue}/stats")
+async def get_queue_stats(queue: QueueName, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """queue depth and the age of the oldest pending request, sec"""
+    error = _check_moderator(cur_user)
+    if error: return error
+    return JResponse(body=await queue_stats(session, QUEUES[queue]))
+
+
+@moderation_router.post("/{queue}/claim")
+async def claim_requests(
+        queue: QueueName,
+        limit: Annotated[int, Query(ge=1, le=MODERATION_MAX_BATCH)] = 50,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """takes a batch of pending requests, other moderators do not get them until the claim expires"""
+    error = _check_moderator(cur_user)
+    if error: return error
+    claimed = await claim(session, QUEUES[queue], cur_user.id, limit)
+    return JResponse(body=claimed)
+
+
+@moderation_router.post("/{queue}/decisions")
+async def send_decisions(queue: QueueName, decisions: pd_moderation_decisions, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """approves or rejects claimed requests, approved shops and brands are confirmed"""
+    error = _check_moderator(cur_user)
+    if error: return error
+    if not decisions.decisions: return ResponseException(message="no decisions in request")
+    if len(decisions.decisions) > MODERATION_MAX_BATCH: return ResponseException(message=f"at most {MODERATION_MAX_BATCH} decisions at once")
+    
+    #повторный id - последнее решение
+    wanted = {decision.id: decision.is_rejected for decision in decisions.decisions}
+    decided = await decide(session, QUEUES[queue], cur_user.id, sorted(wanted.items()))
+    if queue == "shops":
+        await cache.invalidate(*[shop_key(row.target_id) for row in decided if not row.is_rejected])
+    decided_ids = {row.id for row in decided}
+    body = {
+        "decided" : decided,
+        "skipped" : [request_id for request_id in wanted if request_id not in decided_ids] #не закреплены за модератором или уже обработаны
+    }
+    return JResponse(message="decisions applied", body=body)
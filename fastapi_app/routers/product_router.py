@@ -0,0 +1,129 @@
+import os
+from typing import Annotated
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Query
+)
+from sqlalchemy import select, func, Select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Result
+from sqlalchemy.engine.row import RowMapping
+
+from ..lib.secure import get_current_user
+from ..lib.responses import JResponse
+from ..models import User, Brand, Product, ProductInShop
+from ..database import get_async_session
+
+CATALOG_FACET_LIMIT = int(os.getenv('CATALOG_FACET_LIMIT', 10_000))     #максимум строк, по которым считаются фасеты
+
+product_router = APIRouter()
+
+
+def _matches(
+        q: str | None,
+        category_id: int | None,
+        brand_id: int | None,
+        shop_id: int | None,
+        price_min: float | None,
+        price_max: float | None,
+        in_stock: bool
+    ) -> Select:
+    """products in shops matching the search filters"""
+    query = (
+        select(
+            ProductInShop.id,
+            ProductInShop.shop_id,
+            ProductInShop.price,
+            ProductInShop.amount,
+            Product.id.label("product_id"),
+            Product.name,
+            Product.category_id,
+            Product.brand_id,
+            Brand.name.label("brand_name")
+        )
+        .join(Product, Product.id == ProductInShop.product_id)
+        .outerjoin(Brand, Brand.id == Product.brand_id)
+    )
+    if q:
+        #слова названия продукта - по tsvector, подстрока названия бренда - по триграммам
+        brands = select(Brand.id).where(Brand.name.icontains(q, autoescape=True))
+        query = query.where(
+            Product.search_vector.bool_op("@@")(func.websearch_to_tsquery("simple", q))
+            | Product.brand_id.in_(brands)
+        )
+    if category_id is not None: query = query.where(Product.category_id == category_id)
+    if brand_id is not None: query = query.where(Product.brand_id == brand_id)
+    if shop_id is not None: query = query.where(ProductInShop.shop_id == shop_id)
+    if price_min is not None: query = query.where(ProductInShop.price >= price_min)
+    if price_max is not None: query = query.where(ProductInShop.price <= price_max)
+    if in_stock: query = query.where(ProductInShop.amount > 0)
+    return query
+
+
+def _facet(sample, column) -> Select:
+    counts = select(column, func.count().label("count")).group_by(column).subquery()
+    return select(
+        func.coalesce(
+            func.json_agg(aggregate_order_by(func.json_build_object(column.key, counts.c[column.key], "count", counts.c.count), counts.c.count.desc())),
+            func.json_build_array()
+        )
+    ).scalar_subquery()
+
+
+@product_router.get("/")
+async def search_products(
+        q: str | None = None,
+        category_id: int | None = None,
+        brand_id: int | None = None,
+        shop_id: int | None = None,
+        price_min: float | None = None,
+        price_max: float | None = None,
+        in_stock: bool = False,
+        after_id: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=100)] = 20,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """
+    catalog search with category and brand facets, computed in one query
+
+    facets are counted over at most CATALOG_FACET_LIMIT matches, facets_exact tells whether all matches were counted
+    """
+    matches = _matches(q, category_id, brand_id, shop_id, price_min, price_max, in_stock)
+
+    #страница и фасеты - независимые подзапросы, каждый план использует свои индексы
+    page_query = matches
+    if after_id is not None: page_query = page_query.where(ProductInShop.id > after_id)
+    page = page_query.order_by(ProductInShop.id).limit(limit).subquery("page")
+    items = select(
+        func.coalesce(
+            func.json_agg(aggregate_order_by(func.json_build_object(*[part for c in page.c for part in (c.key, c)]), page.c.id)),
+            func.json_build_array()
+        )
+    ).scalar_subquery()
+
+    sample = matches.with_only_columns(Product.category_id, Product.brand_id).limit(CATALOG_FACET_LIMIT).cte("sample")
+    sampled = select(func.count()).select_from(sample).scalar_subquery()
+
+    search_r: Result = await session.execute(
+        select(
+            items.label("items"),
+            _facet(sample, sample.c.category_id).label("categories"),
+            _facet(sample, sample.c.brand_id).label("brands"),
+            sampled.label("sampled")
+        )
+    )
+    search: RowMapping = search_r.mappings().one()
+    body = {
+        "items" : search["items"],
+        "next_after_id" : search["items"][-1]["id"] if len(search["items"]) == limit else None,
+        "facets" : {
+            "categories" : search["categories"],
+            "brands" : search["brands"]
+        },
+        "facets_exact" : search["sampled"] < CATALOG_FACET_LIMIT
+    }
+    return JResponse(body=body)
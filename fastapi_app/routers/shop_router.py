@@ -1,74 +1,121 @@
 import logging
-from datetime import datetime
-from typing import Annotated
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Annotated, Literal
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
     Request,
-    Cookie
+    Cookie,
+    Query,
+    BackgroundTasks
 )
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, Response
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy import select, insert, update, delete, func, case, tuple_, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import NoResultFound, IntegrityError
 from sqlalchemy.orm import Session
 from sqlalchemy.engine import Result
 from sqlalchemy.engine.row import RowMapping
 
-from ..lib.pydantic_models import pd_shop, pd_shop_edit, pd_position, pd_position_edit
+from ..lib.pydantic_models import pd_shop, pd_shop_edit, pd_shop_images_delete, pd_position, pd_position_edit, pd_staff, pd_staff_edit
 from ..lib.secure import create_jwt, check_jwt, check_email, get_current_user, bcrypt_context
-from ..lib.exceptions import NotFound, Forbidden, NotAcceptable
-from ..lib.responses import JResponse
-from ..models import User, Shop, ShopImage, ShopAndUser, Position
+from ..lib.exceptions import NotFound, Forbidden, NotAcceptable, ResponseException
+from ..lib.responses import JResponse, Created, ndjson_stream, wants_stream
+from ..lib.cache import cache, shop_key, permission_key
+from ..lib.permissions import Permission, STAFF_PERMISSIONS, get_permissions, staff_permission_keys, position_mask, permission_names
+from ..lib.blob_store import blob_store, make_thumbnails
+from ..lib.uploads import stream_images
+from ..lib.inventory_import import import_inventory
+from ..lib.rollups import sales_report
+from ..models import User, Shop, ShopImage, ImageBlob, ShopAndUser, Position, ShopRequestForConfirmation
 from ..database import get_async_session
 
 shop_router = APIRouter()
 
 
 @shop_router.get("/")
-async def get_shops(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    """get all shops"""
-    shops_result: Result = await session.execute(select(Shop.id, Shop.name, Shop.avatar_img, Shop.description, Shop.is_confirmed).where(Shop.is_deleted == False))
-    shops: list[RowMapping] = shops_result.mappings().all()
+async def get_shops(
+        request: Request,
+        stream: bool = False,
+        after_id: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        is_confirmed: bool | None = None,
+        name: str | None = None,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """get a page of shops ordered by id, the next page starts after next_after_id. In stream mode all shops are returned as ndjson"""
+    shops_query = select(Shop.id, Shop.name, Shop.avatar_img, Shop.description, Shop.is_confirmed).where(Shop.is_deleted == False)
+    if after_id is not None: shops_query = shops_query.where(Shop.id > after_id)
+    if is_confirmed is not None: shops_query = shops_query.where(Shop.is_confirmed == is_confirmed)
+    if name: shops_query = shops_query.where(Shop.name.startswith(name, autoescape=True))
     
-    shops_response = []
-    for shop in shops:
-        shop_images_result: Result = await session.execute(select(ShopImage.src).where(ShopImage.shop_id == shop.id))
-        shop_images: list = shop_images_result.scalars().all()
-        shops_response.append(
-            {
-                "shop" : dict(shop),
-                "images" : shop_images
+    if wants_stream(request, stream):
+        #изображения агрегируются в том же запросе, курсор на соединении один
+        images_query = select(func.array_agg(ShopImage.src)).where(ShopImage.shop_id == Shop.id).scalar_subquery()
+        return ndjson_stream(
+            shops_query.add_columns(images_query.label("images")).order_by(Shop.id),
+            transform=lambda row: {
+                "shop" : {key: value for key, value in row.items() if key != "images"},
+                "images" : row["images"] or []
             }
         )
     
-    return JResponse(body=shops_response)
-
-
-@shop_router.get("/{id}")
-async def get_shop(id:int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    try:
-        shop_result: Result = await session.execute(select(Shop.id, Shop.name, Shop.avatar_img, Shop.description, Shop.is_confirmed, Shop.is_deleted).where(Shop.id == id))
-        shop: RowMapping = shop_result.mappings().one()
-    except NoResultFound as e:
-        logging.error(f"404 GET shop error:\n{e._message()}")
-        return NotFound(message=f"shop with id [{id}] does not exists")
-    if shop.is_deleted == True: return NotAcceptable(message="shop has been deleted")
+    shops_result: Result = await session.execute(shops_query.order_by(Shop.id).limit(limit))
+    shops: list[RowMapping] = shops_result.mappings().all()
     
-    shop_images_result: Result = await session.execute(select(ShopImage.src).where(ShopImage.shop_id == shop.id))
-    shop_images: list = shop_images_result.scalars().all()
+    #изображения всех магазинов страницы одним запросом
+    images: dict[int, list[str]] = {shop.id: [] for shop in shops}
+    if images:
+        shop_images_result: Result = await session.execute(
+            select(ShopImage.shop_id, ShopImage.src)
+            .where(ShopImage.shop_id.in_(images.keys()))
+            .order_by(ShopImage.shop_id, ShopImage.id)
+        )
+        for shop_id, src in shop_images_result.all():
+            images[shop_id].append(src)
     
-    shop_d = dict(shop)
-    shop_d.pop("is_deleted")
+    shops_response = [
+        {
+            "shop" : shop,
+            "images" : images[shop.id]
+        }
+        for shop in shops
+    ]
     body = {
-        "shop" : shop_d,
-        "images" : shop_images
+        "shops" : shops_response,
+        "next_after_id" : shops[-1].id if len(shops) == limit else None
     }
     return JResponse(body=body)
 
 
+@shop_router.get("/analytics")
+async def get_shop_analytics(
+        shop_id: int,
+        group_by: Literal["day", "week", "product"] = "day",
+        date_from: date | None = None,
+        date_to: date | None = None,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """revenue, units, tax and payments count of the shop for a period, by default the last 30 days"""
+    error = await _check_shop_owner(shop_id, cur_user, session)
+    if error: return error
+    
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_from > date_to: return ResponseException(message="date_from must not be later than date_to")
+    
+    report_r: Result = await session.execute(sales_report(shop_id, date_from, date_to, group_by))
+    rows: list[RowMapping] = report_r.mappings().all()
+    totals = {measure: sum(row[measure] for row in rows) for measure in ("units", "revenue", "tax", "payments")}
+    return JResponse(body={"date_from": date_from, "date_to": date_to, "group_by": group_by, "rows": rows, "totals": totals})
+
+
 @shop_router.post("/")
 async def create_shop(shop: pd_shop, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
     shop_d: dict = shop.model_dump(exclude_none=True)
@@ -84,7 +131,7 @@ async def edit_shop(shop: pd_shop_edit, cur_user: User = Depends(get_current_use
         shop_db_r: Result = await session.execute(select(Shop).where(Shop.id == shop.id))
         shop_db: Shop = shop_db_r.scalar_one()
     except NoResultFound as e:
-        logging.error(f"PATCH shop error: {e._message()}")
+        logging.error("PATCH shop error: %s", e._message())
         return NotFound(message=f"shop with id [{shop.id}] does not exists")
     if shop_db.owner_id != cur_user.id: return Forbidden(message="only shop owner can change shop")
     if shop_db.is_deleted == True: return NotAcceptable(message="shop has been deleted")
@@ -93,10 +140,11 @@ async def edit_shop(shop: pd_shop_edit, cur_user: User = Depends(get_current_use
     values: dict = shop.model_dump(exclude_none=True, exclude={"id"})
     await session.execute(update(Shop).values(values).where(Shop.id == shop.id))
     await session.commit()
+    await cache.invalidate(shop_key(shop.id))
     
     #формирование ответа
     new_shop_r: Result = await session.execute(select(Shop.id, Shop.name, Shop.description, Shop.avatar_img, Shop.is_confirmed).where(Shop.id == shop.id))
-    new_shop: dict = dict(new_shop_r.mappings().one())
+    new_shop: RowMapping = new_shop_r.mappings().one()
     return JResponse(message="shop updated", body=new_shop)
 
 
@@ -107,26 +155,128 @@ async def delete_shop(shop_id: int, cur_user: User = Depends(get_current_user),
         shop_db_r: Result = await session.execute(select(Shop).where(Shop.id == shop_id))
         shop_db: Shop = shop_db_r.scalar_one()
     except NoResultFound as e:
-        logging.error(f"DELETE shop error: {e._message()}")
+        logging.error("DELETE shop error: %s", e._message())
         return NotFound(message=f"shop with id [{shop_id}] does not exists")
     if shop_db.owner_id != cur_user.id: return Forbidden(message="only shop owner can delete shop")
     if shop_db.is_deleted == True: return NotAcceptable(message="shop already deleted")
     
-    #удаление магазина
+    #удаление магазина, права сотрудников и владельца пропадают вместе с ним
+    permission_keys = await staff_permission_keys(session, shop_id=shop_id)
     await session.execute(update(Shop).values(is_deleted=True).where(Shop.id == shop_id))
     await session.commit()
+    await cache.invalidate(shop_key(shop_id), permission_key(cur_user.id, shop_id), *permission_keys)
+
+
+async def _check_shop_owner(shop_id: int, cur_user: User, session: Session) -> JResponse | None:
+    """returns an error response if the current user cannot change the shop"""
+    shop_r: Result = await session.execute(select(Shop.owner_id, Shop.is_deleted).where(Shop.id == shop_id))
+    shop: RowMapping | None = shop_r.mappings().one_or_none()
+    if shop is None: return NotFound(message=f"shop with id [{shop_id}] does not exists")
+    if shop.owner_id != cur_user.id: return Forbidden(message="only shop owner can change shop")
+    if shop.is_deleted == True: return NotAcceptable(message="shop has been deleted")
+    return None
+
+
+async def _check_permission(shop_id: int, permission: Permission, cur_user: User, session: Session) -> JResponse | None:
+    """returns an error response if the current user lacks the permission in the shop"""
+    if permission not in await get_permissions(cur_user.id, shop_id, session):
+        return Forbidden(message=f"not enough permissions in shop [{shop_id}]")
+    return None
 
 
 @shop_router.post("/images")
-async def send_images(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    #TODO
-    pass
+async def send_images(shop_id: int, request: Request, background_tasks: BackgroundTasks, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """uploads shop images from a multipart body, files with the same content are stored once"""
+    error = await _check_shop_owner(shop_id, cur_user, session)
+    if error: return error
+    
+    #файлы пишутся во временное хранилище по мере чтения тела запроса
+    try:
+        uploaded = await stream_images(request, blob_store)
+    except ValueError as e:
+        logging.error("POST shop images error: %s", e)
+        return ResponseException(message=str(e))
+    if not uploaded: return ResponseException(message="no images in request")
+    
+    new_digests: list[str] = []
+    try:
+        try:
+            #счетчики ссылок увеличиваются одним запросом, строки image_blob блокируются до commit
+            blobs = {blob.digest: blob for blob in uploaded}
+            ref_counts = Counter(blob.digest for blob in uploaded)
+            blobs_insert = pg_insert(ImageBlob).values([
+                {"digest": digest, "size": blobs[digest].size, "content_type": blobs[digest].content_type, "ref_count": ref_counts[digest]}
+                for digest in sorted(blobs)
+            ])
+            await session.execute(blobs_insert.on_conflict_do_update(
+                index_elements=[ImageBlob.digest],
+                set_={"ref_count": ImageBlob.ref_count + blobs_insert.excluded.ref_count}
+            ))
+            for digest, blob in blobs.items():
+                if blob_store.place(blob.temp_path, digest): new_digests.append(digest)
+            
+            images_r: Result = await session.execute(
+                insert(ShopImage)
+                .values([{"shop_id": shop_id, "src": blob.digest} for blob in uploaded])
+                .returning(ShopImage.id, ShopImage.src)
+            )
+            images: list[RowMapping] = images_r.mappings().all()
+        except BaseException:
+            #новые файлы удаляются до rollback, пока строки image_blob заблокированы и параллельная загрузка не могла на них сослаться
+            for digest in new_digests: blob_store.remove(digest)
+            await session.rollback()
+            raise
+        #при ошибке самого commit файлы остаются: итог транзакции неизвестен, а файл без строки переиспользует следующая загрузка
+        await session.commit()
+    finally:
+        blob_store.discard(blob.temp_path for blob in uploaded)
+    
+    await cache.invalidate(shop_key(shop_id))
+    background_tasks.add_task(make_thumbnails, blob_store, new_digests)
+    return JResponse(message="images uploaded", body=images)
 
 
 @shop_router.delete("/images")
-async def delete_images(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    #TODO
-    pass
+async def delete_images(images: pd_shop_images_delete, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    error = await _check_shop_owner(images.shop_id, cur_user, session)
+    if error: return error
+    
+    deleted_r: Result = await session.execute(
+        delete(ShopImage)
+        .where(ShopImage.shop_id == images.shop_id, ShopImage.id.in_(images.image_ids))
+        .returning(ShopImage.src)
+    )
+    released = Counter(deleted_r.scalars().all())
+    if not released: return NotFound(message="images not found")
+    
+    #уменьшение счетчиков ссылок, файлы без ссылок удаляет фоновая очистка (blob_store.run_blob_sweeper)
+    await session.execute(
+        update(ImageBlob)
+        .values(ref_count=ImageBlob.ref_count - case(released, value=ImageBlob.digest))
+        .where(ImageBlob.digest.in_(released.keys()))
+    )
+    await session.commit()
+    
+    await cache.invalidate(shop_key(images.shop_id))
+    return JResponse(message="images deleted")
+
+
+@shop_router.post("/products/import")
+async def import_products(shop_id: int, request: Request, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """
+    creates or updates products of the shop from a text/csv (with a product_id,amount,price header) or ndjson body
+
+    valid rows are applied, invalid ones are returned in the report with their line numbers
+    """
+    error = await _check_permission(shop_id, Permission.ADD_PRODUCT | Permission.CHANGE_PRODUCT, cur_user, session)
+    if error: return error
+    
+    try:
+        report = await import_inventory(session, shop_id, request.headers.get("content-type", ""), request.stream())
+    except ValueError as e:
+        logging.error("POST shop products import error: %s", e)
+        return ResponseException(message=str(e))
+    return JResponse(message="products imported", body=report.as_dict())
 
 
 @shop_router.get("/positions")
@@ -144,7 +294,7 @@ async def get_job_titles(cur_user: User = Depends(get_current_user), session: Se
         )
         .where(Position.creator_id == cur_user.id)
     )
-    return JResponse(body=[dict(position) for position in positions_r.mappings().all()])
+    return JResponse(body=positions_r.mappings().all())
     
 
 
@@ -165,7 +315,7 @@ async def get_job_titles(id: int, cur_user: User = Depends(get_current_user), se
             .where(Position.id == id)
         )
     except NoResultFound as e:
-        logging.error(f"GET position error: {e._message()}")
+        logging.error("GET position error: %s", e._message())
         return NotFound(message=f"position with id [{id}] does not exists")
     position: dict = position_r.mappings().one()
     if position.creator_id != cur_user.id: return Forbidden(message="you cannot get this position")
@@ -195,14 +345,14 @@ async def edit_job_title(position: pd_position_edit, cur_user: User = Depends(ge
         old_position_r: Result = await session.execute(select(Position).where(Position.id == position.id))
         old_position: Position = old_position_r.scalar_one()
     except NoResultFound as e:
-        logging.error(f"404 edit position error: {e._message()}")
+        logging.error("404 edit position error: %s", e._message())
         return NotFound(message=f"position with id [{position.id}] does not exist")
     if old_position.creator_id != cur_user.id: return Forbidden()
     
-    
-    
+    permission_keys = await staff_permission_keys(session, position_id=position.id)
     await session.execute(update(Position).values(values).where(Position.id == position.id))
     await session.commit()
+    await cache.invalidate(*permission_keys)
     position_r: Result = await session.execute(
         select(
             Position.id,
@@ -216,7 +366,7 @@ async def edit_job_title(position: pd_position_edit, cur_user: User = Depends(ge
         )
         .where(Position.id == position.id)
     )
-    new_position: dict = dict(position_r.mappings().one())
+    new_position: RowMapping = position_r.mappings().one()
     return JResponse(message="position updated", body=new_position)
 
 
@@ -225,90 +375,286 @@ async def delete_job_title(position_id: int, cur_user: User = Depends(get_curren
     try:
         position_r: Result = await session.execute(select(Position).where(Position.id == position_id))
     except NoResultFound as e:
-        logging.error(f"404 DELETE position not found: {e._message()}")
+        logging.error("404 DELETE position not found: %s", e._message())
         return NotFound(message=f"position with id [{position_id}] does not exist")
     position: Position = position_r.scalar_one()
     if position.creator_id != cur_user.id: return Forbidden(message="you can delete position another owner")
     
+    #после удаления сотрудники остаются без должности, ключи собираются заранее
+    permission_keys = await staff_permission_keys(session, position_id=position_id)
     await session.execute(delete(Position).where(Position.id == position_id))
     await session.commit()
+    await cache.invalidate(*permission_keys)
     return JResponse()
 
 
-@shop_router.get("/staff")
-async def get_staff(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    """returns all the user's staff"""
-    staff_r: Result = await session.execute(
+def _staff_list(position_id: int | None) -> Select:
+    """staff records with the employee and position in one join"""
+    staff_query = (
         select(
-            User.id, User.login, User.name, User.surname, User.avatar_img,
-            Position.id, Position.name,
-            Shop.id, Shop.name
+            ShopAndUser.id,
+            ShopAndUser.shop_id,
+            ShopAndUser.user_id,
+            User.login,
+            User.name,
+            User.surname,
+            User.avatar_img,
+            ShopAndUser.position_id,
+            Position.name.label("position_name")
         )
-        .from_statement(ShopAndUser)
         .join(User, User.id == ShopAndUser.user_id)
+        .outerjoin(Position, Position.id == ShopAndUser.position_id)
+    )
+    if position_id is not None: staff_query = staff_query.where(ShopAndUser.position_id == position_id)
+    return staff_query
+
+
+@shop_router.get("/staff")
+async def get_staff(
+        after_shop_id: int | None = None,
+        after_user_id: int | None = None,
+        position_id: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """returns a page of staff of all the user's shops ordered by shop and user, the next page starts after next_after"""
+    staff_query = (
+        _staff_list(position_id)
+        .add_columns(Shop.name.label("shop_name"))
         .join(Shop, Shop.id == ShopAndUser.shop_id)
-        .join(Position, Position.id == ShopAndUser.position_id)
-        .where(Shop.owner_id == cur_user.id)
+        .where(Shop.owner_id == cur_user.id, Shop.is_deleted == False)
     )
-    staff: list[dict] = staff_r.mappings().all()
-    return JResponse(body=staff)
+    if (after_shop_id is None) != (after_user_id is None): return ResponseException(message="after_shop_id and after_user_id are passed together")
+    if after_shop_id is not None:
+        staff_query = staff_query.where(tuple_(ShopAndUser.shop_id, ShopAndUser.user_id) > tuple_(after_shop_id, after_user_id))
+    staff_r: Result = await session.execute(staff_query.order_by(ShopAndUser.shop_id, ShopAndUser.user_id).limit(limit))
+    staff: list[RowMapping] = staff_r.mappings().all()
+    body = {
+        "staff" : staff,
+        "next_after" : {"after_shop_id" : staff[-1].shop_id, "after_user_id" : staff[-1].user_id} if len(staff) == limit else None
+    }
+    return JResponse(body=body)
+
 
 @shop_router.get("/shop-staff")
-async def get_staff(shop_id:int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    """returns all users of the selected shop"""
-    try:
-        shop_r: Result = await session.execute(select(Shop).where(Shop.id == shop_id))
-    except NoResultFound as e:
-        logging.error(f"404 GET shop-staff, shop not found: {e._message()}")
-        return NotFound(message=f"shop with id [{shop_id}] does not exist")
-    shop: Shop = shop_r.scalar_one()
-    if shop.owner_id != cur_user.id: return Forbidden(message="you can't get someone else's store")
-    
+async def get_shop_staff(
+        shop_id: int,
+        after_user_id: int | None = None,
+        position_id: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """returns a page of users of the selected shop ordered by user, the next page starts after next_after_user_id"""
+    if not await get_permissions(cur_user.id, shop_id, session) & STAFF_PERMISSIONS:
+        return Forbidden(message="you cannot get staff of this shop")
     
+    #страница выбирается по индексу (shop_id, user_id, position_id), пользователи и должности - по первичным ключам
+    staff_query = _staff_list(position_id).where(ShopAndUser.shop_id == shop_id)
+    if after_user_id is not None: staff_query = staff_query.where(ShopAndUser.user_id > after_user_id)
+    staff_r: Result = await session.execute(staff_query.order_by(ShopAndUser.user_id).limit(limit))
+    staff: list[RowMapping] = staff_r.mappings().all()
+    body = {
+        "staff" : staff,
+        "next_after_user_id" : staff[-1].user_id if len(staff) == limit else None
+    }
+    return JResponse(body=body)
+
+
+async def _get_staff_record(id: int, session: Session) -> RowMapping | None:
+    """staff record with the employee and position, permissions as a bitmask"""
     staff_r: Result = await session.execute(
         select(
-            User.id, User.login, User.name, User.surname, User.avatar_img,
-            Position.id, Position.name
+            ShopAndUser.id,
+            ShopAndUser.shop_id,
+            ShopAndUser.user_id,
+            ShopAndUser.position_id,
+            User.login,
+            User.name,
+            User.surname,
+            User.avatar_img,
+            Position.name.label("position_name"),
+            position_mask().label("permissions")
         )
-        .from_statement(ShopAndUser)
         .join(User, User.id == ShopAndUser.user_id)
-        .join(Position, Position.id == ShopAndUser.position_id)
-        .where(ShopAndUser.shop_id == shop_id)
+        .outerjoin(Position, Position.id == ShopAndUser.position_id)
+        .where(ShopAndUser.id == id)
+    )
+    return staff_r.mappings().one_or_none()
+
+
+def _staff_body(staff: RowMapping) -> dict:
+    return {**staff, "permissions": permission_names(staff.permissions or 0)}
+
+
+async def _check_position(shop_id: int, position_id: int | None, granted_by: Permission, session: Session) -> JResponse | None:
+    """the position must belong to the shop owner and must not grant more than the granting user has"""
+    if position_id is None: return None
+    owner_id = select(Shop.owner_id).where(Shop.id == shop_id).scalar_subquery()
+    position_r: Result = await session.execute(
+        select(Position.creator_id, owner_id.label("owner_id"), position_mask().label("permissions")).where(Position.id == position_id)
     )
-    staff: list[dict] = staff_r.mappings().all()
-    return JResponse(body=staff)
+    position: RowMapping | None = position_r.mappings().one_or_none()
+    if position is None: return NotFound(message=f"position with id [{position_id}] does not exist")
+    if position.creator_id != position.owner_id: return Forbidden(message="position belongs to another owner")
+    if position.permissions & ~granted_by: return Forbidden(message="you cannot grant permissions you do not have")
+    return None
 
 
 @shop_router.get("/staff/{id}")
 async def get_one_staff(id:int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+    """staff record, available to the employee and to users managing the shop staff"""
+    staff = await _get_staff_record(id, session)
+    if staff is None: return NotFound(message=f"staff with id [{id}] does not exist")
+    if staff.user_id != cur_user.id and not await get_permissions(cur_user.id, staff.shop_id, session) & STAFF_PERMISSIONS:
+        return Forbidden(message="you cannot get staff of this shop")
+    return JResponse(body=_staff_body(staff))
 
 
 @shop_router.post("/staff")
-async def set_staff(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+async def set_staff(staff: pd_staff, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """employs the user in the shop"""
+    permissions = await get_permissions(cur_user.id, staff.shop_id, session)
+    if Permission.ADD_STAFF not in permissions: return Forbidden(message=f"not enough permissions in shop [{staff.shop_id}]")
+    error = await _check_position(staff.shop_id, staff.position_id, permissions, session)
+    if error: return error
+    
+    user_r: Result = await session.execute(select(User.id).where(User.id == staff.user_id))
+    if user_r.scalar_one_or_none() is None: return NotFound(message=f"user with id [{staff.user_id}] does not exist")
+
+    #уникальный индекс (shop_id, user_id) отсекает повторный найм, в том числе параллельный
+    staff_id_r: Result = await session.execute(
+        pg_insert(ShopAndUser).values(staff.model_dump())
+        .on_conflict_do_nothing(index_elements=[ShopAndUser.shop_id, ShopAndUser.user_id])
+        .returning(ShopAndUser.id)
+    )
+    staff_id: int|None = staff_id_r.scalar_one_or_none()
+    if staff_id is None:
+        await session.rollback()
+        return NotAcceptable(message="user is already employed in the shop")
+    await session.commit()
+    await cache.invalidate(permission_key(staff.user_id, staff.shop_id))
+    return Created(body={"id": staff_id})
 
 
 @shop_router.patch("/staff")
-async def edit_staff(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+async def edit_staff(staff: pd_staff_edit, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """changes the position of the employee"""
+    old_staff = await _get_staff_record(staff.id, session)
+    if old_staff is None: return NotFound(message=f"staff with id [{staff.id}] does not exist")
+    permissions = await get_permissions(cur_user.id, old_staff.shop_id, session)
+    if Permission.CHANGE_STAFF not in permissions: return Forbidden(message=f"not enough permissions in shop [{old_staff.shop_id}]")
+    error = await _check_position(old_staff.shop_id, staff.position_id, permissions, session)
+    if error: return error
+    
+    await session.execute(update(ShopAndUser).values(position_id=staff.position_id).where(ShopAndUser.id == staff.id))
+    await session.commit()
+    await cache.invalidate(permission_key(old_staff.user_id, old_staff.shop_id))
+    new_staff = await _get_staff_record(staff.id, session)
+    return JResponse(message="staff updated", body=_staff_body(new_staff))
 
 
 @shop_router.delete("/staff")
-async def delete_staff(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+async def delete_staff(staff_id: int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """dismisses the employee"""
+    staff_r: Result = await session.execute(select(ShopAndUser.shop_id, ShopAndUser.user_id).where(ShopAndUser.id == staff_id))
+    staff: RowMapping | None = staff_r.mappings().one_or_none()
+    if staff is None: return NotFound(message=f"staff with id [{staff_id}] does not exist")
+    error = await _check_permission(staff.shop_id, Permission.DELETE_STAFF, cur_user, session)
+    if error: return error
+    
+    await session.execute(delete(ShopAndUser).where(ShopAndUser.id == staff_id))
+    await session.commit()
+    await cache.invalidate(permission_key(staff.user_id, staff.shop_id))
+    return JResponse(message="staff deleted")
 
 
 @shop_router.get("/requests")
-async def get_requests_for_confirmation(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+async def get_requests_for_confirmation(shop_id: int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """confirmation requests of the shop, newest first"""
+    error = await _check_shop_owner(shop_id, cur_user, session)
+    if error: return error
+    requests_r: Result = await session.execute(
+        select(
+            ShopRequestForConfirmation.id,
+            ShopRequestForConfirmation.is_processed,
+            ShopRequestForConfirmation.is_rejected,
+            ShopRequestForConfirmation.date_of_creation,
+            ShopRequestForConfirmation.date_of_change
+        )
+        .where(ShopRequestForConfirmation.shop_id == shop_id)
+        .order_by(ShopRequestForConfirmation.id.desc())
+    )
+    return JResponse(body=requests_r.mappings().all())
 
 
-@shop_router.get("/requests")
-async def get_request_for_confirmation(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+@shop_router.get("/requests/{id}")
+async def get_request_for_confirmation(id: int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    request_r: Result = await session.execute(
+        select(
+            ShopRequestForConfirmation.id,
+            ShopRequestForConfirmation.shop_id,
+            ShopRequestForConfirmation.is_processed,
+            ShopRequestForConfirmation.is_rejected,
+            ShopRequestForConfirmation.date_of_creation,
+            ShopRequestForConfirmation.date_of_change,
+            Shop.owner_id
+        )
+        .join(Shop, Shop.id == ShopRequestForConfirmation.shop_id)
+        .where(ShopRequestForConfirmation.id == id)
+    )
+    request: RowMapping | None = request_r.mappings().one_or_none()
+    if request is None: return NotFound(message=f"request with id [{id}] does not exist")
+    if request.owner_id != cur_user.id and not (cur_user.is_admin or cur_user.is_superuser):
+        return Forbidden(message="you cannot get this request")
+    return JResponse(body={key: value for key, value in request.items() if key != "owner_id"})
 
 
 @shop_router.post("/requests")
-async def send_request_for_confirmation(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    pass
+async def send_request_for_confirmation(shop_id: int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    """puts the shop into the moderation queue"""
+    shop_r: Result = await session.execute(select(Shop.owner_id, Shop.is_deleted, Shop.is_confirmed).where(Shop.id == shop_id).with_for_update())
+    shop: RowMapping | None = shop_r.mappings().one_or_none()
+    if shop is None: return NotFound(message=f"shop with id [{shop_id}] does not exists")
+    if shop.owner_id != cur_user.id: return Forbidden(message="only shop owner can send request")
+    if shop.is_deleted == True: return NotAcceptable(message="shop has been deleted")
+    if shop.is_confirmed == True: return NotAcceptable(message="shop is already confirmed")
+    
+    #строка магазина заблокирована: два параллельных запроса не создадут две заявки
+    pending_r: Result = await session.execute(
+        select(ShopRequestForConfirmation.id).where(ShopRequestForConfirmation.shop_id == shop_id, ShopRequestForConfirmation.is_processed == False)
+    )
+    if pending_r.first() is not None: return NotAcceptable(message="shop already has a pending request")
+    request_r: Result = await session.execute(insert(ShopRequestForConfirmation).values(shop_id=shop_id).returning(ShopRequestForConfirmation.id))
+    request_id: int = request_r.scalar_one()
+    await session.commit()
+    return Created(body={"id" : request_id})
+
+
+#объявлен последним: иначе "/{id}" перехватывает GET запросы к "/positions", "/staff", "/requests" и другим статическим путям
+@shop_router.get("/{id}")
+async def get_shop(id:int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
+    async def load_shop() -> dict | None:
+        shop_result: Result = await session.execute(select(Shop.id, Shop.name, Shop.avatar_img, Shop.description, Shop.is_confirmed, Shop.is_deleted).where(Shop.id == id))
+        shop: RowMapping | None = shop_result.mappings().one_or_none()
+        if shop is None: return None
+        if shop.is_deleted == True: return {"is_deleted" : True, "body" : None}
+        
+        shop_images_result: Result = await session.execute(select(ShopImage.src).where(ShopImage.shop_id == shop.id))
+        shop_images: list = shop_images_result.scalars().all()
+        
+        shop_d = dict(shop)
+        shop_d.pop("is_deleted")
+        body = {
+            "shop" : shop_d,
+            "images" : list(shop_images)
+        }
+        return {"is_deleted" : False, "body" : body}
+    
+    cached_shop: dict | None = await cache.get_or_load(shop_key(id), load_shop)
+    if cached_shop is None:
+        logging.error("404 GET shop error: shop with id [%s] does not exists", id)
+        return NotFound(message=f"shop with id [{id}] does not exists")
+    if cached_shop["is_deleted"]: return NotAcceptable(message="shop has been deleted")
+    return JResponse(body=cached_shop["body"])
@@ -1,4 +1,5 @@
 import logging
+import math
 from datetime import datetime
 from typing import Annotated
 
@@ -7,7 +8,8 @@ from fastapi import (
     Depends,
     HTTPException,
     Request,
-    Cookie
+    Cookie,
+    Query
 )
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, Response
@@ -16,11 +18,15 @@ from sqlalchemy import select, insert, update, delete
 from sqlalchemy.exc import NoResultFound, IntegrityError
 from sqlalchemy.orm import Session
 from sqlalchemy.engine import Result
+from sqlalchemy.engine.row import RowMapping
 
 from ..lib.pydantic_models import pd_signup_user, pd_user, pd_user_role, roles
-from ..lib.secure import create_jwt, check_jwt, check_email, get_current_user, bcrypt_context
-from ..lib.exceptions import Forbidden, NotFound, ResponseException
-from ..lib.responses import JResponse, Created
+from ..lib.secure import create_jwt, check_jwt, revoke_jwt, check_email, generate_code, get_current_user
+from ..lib.password_hasher import password_hasher
+from ..lib.exceptions import Forbidden, NotFound, ResponseException, TooManyRequests
+from ..lib.responses import JResponse, Created, ndjson_stream, wants_stream
+from ..lib.cache import cache, user_key
+from ..lib.rate_limit import rate_limiter, client_ip, SIGNIN_BY_IP, SIGNIN_BY_LOGIN, SIGNUP_BY_IP
 from ..models import User
 from ..database import get_async_session
 
@@ -28,9 +34,14 @@ user_router = APIRouter()
 auth_router = APIRouter()
 
 
+def _too_many_requests(retry_after: float) -> TooManyRequests:
+    return TooManyRequests(headers={"Retry-After": str(math.ceil(retry_after))})
+
+
 ###authorization
 @auth_router.post("/signin")
 async def signin(
+        request: Request,
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
         session: Session = Depends(get_async_session)
     ):
@@ -38,16 +49,24 @@ async def signin(
     access_token = None
     refresh_token = None
     
+    # ограничение частоты до обращения к БД и bcrypt (сессия подключается только при первом запросе)
+    retry_after = await rate_limiter.check((SIGNIN_BY_IP, client_ip(request)), (SIGNIN_BY_LOGIN, form_data.username))
+    if retry_after: return _too_many_requests(retry_after)
+    
     # проверка данных входа
     user_from_db: Result = await session.execute(select(User).where(User.login == form_data.username))
-    user: User = user_from_db.scalar_one()
+    user: User = user_from_db.scalar_one_or_none()
     exception = ResponseException(message="Incorrect username or password")
     if not user: return exception
-    if not bcrypt_context.verify(form_data.password, user.pwd_hash): return exception
+    is_valid, new_pwd_hash = await password_hasher.verify_and_update(form_data.password, user.pwd_hash)
+    if not is_valid: return exception
+    if new_pwd_hash:
+        # хэш со старой стоимостью bcrypt, сохраняется вместе с токенами
+        await session.execute(update(User).values(pwd_hash=new_pwd_hash).where(User.id == user.id))
     
     # создание новых токенов
-    access_token = await create_jwt(user, is_refresh=False)
-    refresh_token = await create_jwt(user, is_refresh=True)
+    access_token = await create_jwt(user, session, is_refresh=False)
+    refresh_token = await create_jwt(user, session, is_refresh=True)
             
     ## формирование ответа
     response = JSONResponse({
@@ -63,15 +82,34 @@ async def signin(
     return response
 
 
+@auth_router.post("/signout")
+async def signout(
+        access_token: Annotated[str | None, Cookie()] = None,
+        refresh_token: Annotated[str | None, Cookie()] = None,
+        session: Session = Depends(get_async_session)
+    ):
+    await revoke_jwt(access_token, session)
+    await revoke_jwt(refresh_token, session)
+    response = JResponse(message="Tokens revoked")
+    response.delete_cookie("access_token")
+    response.delete_cookie("refresh_token")
+    return response
+
+
 @auth_router.post("/signup")
-async def signup(user: pd_signup_user, session: Session = Depends(get_async_session)):
+async def signup(request: Request, user: pd_signup_user, session: Session = Depends(get_async_session)):
+    retry_after = await rate_limiter.check((SIGNUP_BY_IP, client_ip(request)))
+    if retry_after: return _too_many_requests(retry_after)
     if not check_email(user.mail):
         return ResponseException(message="user already exists")
+    pwd_hash = await password_hasher.hash(user.password)
     try:
-        await session.execute(insert(User).values(login = user.login, mail=user.mail, pwd_hash=bcrypt_context.hash(user.password)))
+        user_r: Result = await session.execute(insert(User).values(login = user.login, mail=user.mail, pwd_hash=pwd_hash).returning(User.id))
+        #код подтверждения и письмо с ним сохраняются вместе с пользователем, отправка - в фоне
+        await generate_code(user_r.scalar_one(), user.mail, session)
         await session.commit()
     except IntegrityError as e:
-        logging.error(f'user registration error:\n{e._message}')
+        logging.error('user registration error:\n%s', e._message)
         return ResponseException(message="user already exists")
     return Created(message="The user has been successfully created.")
 
@@ -89,9 +127,27 @@ async def make_coffe():
 
 ###actions with user
 @user_router.get("/")
-async def get_users(cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    users: Result = await session.execute(select(User.id, User.login, User.name, User.surname, User.patronymic, User.mail, User.avatar_img))
-    return JResponse([dict(user) for user in users.mappings().all()])
+async def get_users(
+        request: Request,
+        stream: bool = False,
+        after_id: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cur_user: User = Depends(get_current_user),
+        session: Session = Depends(get_async_session)
+    ):
+    """get a page of users ordered by id, the next page starts after next_after_id. In stream mode all users are returned as ndjson"""
+    users_query = select(User.id, User.login, User.name, User.surname, User.patronymic, User.mail, User.avatar_img)
+    if wants_stream(request, stream): return ndjson_stream(users_query.order_by(User.id))
+    
+    #страница по первичному ключу дешевая и не кэшируется: общий список устаревал бы в других воркерах
+    if after_id is not None: users_query = users_query.where(User.id > after_id)
+    users_result: Result = await session.execute(users_query.order_by(User.id).limit(limit))
+    users: list[RowMapping] = users_result.mappings().all()
+    body = {
+        "users" : users,
+        "next_after_id" : users[-1].id if len(users) == limit else None
+    }
+    return JResponse(body=body)
 
 
 @user_router.patch("/")
@@ -102,10 +158,11 @@ async def edit_user(user: pd_user, cur_user: User = Depends(get_current_user), s
     try:
         await session.execute(update(User).where(User.id == user.id).values(values))
         await session.commit()
+        await cache.invalidate(user_key(user.id))
         new_user_data: Result = await session.execute(select(User.id, User.login, User.name, User.surname, User.patronymic, User.mail, User.avatar_img).where(User.id == user.id))
-        return JResponse(body=dict(new_user_data.mappings().one()))
+        return JResponse(body=new_user_data.mappings().one())
     except NoResultFound as e:
-        logging.error(f'404 PATCH user not found:\n{e._message}')
+        logging.error('404 PATCH user not found:\n%s', e._message)
         return NotFound(message=f"user with id [{user.id}] not found.")
 
 
@@ -116,20 +173,25 @@ async def delete_user(id:int, cur_user: User = Depends(get_current_user), sessio
     try:
         await session.execute(delete(User).where(User.id == id))
         await session.commit()
+        await cache.invalidate(user_key(id))
         return JResponse()
     except NoResultFound as e:
-        logging.error(f'404 DELETE user not found:\n{e._message}')
+        logging.error('404 DELETE user not found:\n%s', e._message)
         return NotFound(message=f"user with id [{id}] not found.")
 
 
 @user_router.get("/{id}")
 async def get_user(id:int, cur_user: User = Depends(get_current_user), session: Session = Depends(get_async_session)):
-    try:
+    async def load_user() -> dict | None:
         user_from_db: Result = await session.execute(select(User.id, User.login, User.name, User.surname, User.patronymic, User.mail, User.avatar_img).where(User.id == id))
-        return user_from_db.mappings().one()
-    except NoResultFound as e:
-        logging.error(f'404 GET user not found:\n{e._message}')
+        user: RowMapping | None = user_from_db.mappings().one_or_none()
+        return dict(user) if user else None
+    
+    user: dict | None = await cache.get_or_load(user_key(id), load_user)
+    if user is None:
+        logging.error('404 GET user not found: user with id [%s]', id)
         return NotFound(message=f"user with id [{id}] not found.")
+    return user
 
 
 @user_router.post("/set-role")
@@ -153,6 +215,7 @@ async def block(id: int, cur_user: User = Depends(get_current_user), session: Se
         return Forbidden()
     await session.execute(update(User).values(is_blocked=True, blocking_datetime=datetime.now()).where(User.id == id))
     await session.commit()
+    await cache.invalidate(user_key(id))
     return JResponse(message="user is blocked")
 
 @user_router.post("/unblock")
@@ -161,4 +224,5 @@ async def unblock(id: int, cur_user: User = Depends(get_current_user), session:
         return Forbidden()
     await session.execute(update(User).values(is_blocked=False, blocking_datetime=None).where(User.id == id))
     await session.commit()
+    await cache.invalidate(user_key(id))
     return JResponse(message="user is unblocked")
\ No newline at end of file
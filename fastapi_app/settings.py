@@ -0,0 +1,153 @@
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+
+
+def _bool(value: str) -> bool:
+    return value.lower() == "true"
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    configuration read when the application is created, not when modules are imported
+
+    the process environment is used as is, a .env file is loaded only when passed to from_env
+    (or by the runner: uvicorn --env-file fastapi_app/.env). Tuning constants of the other lib modules
+    (cache, rate limits, blob store, password hashing, log queue) are still read from the environment at import
+    """
+    postgres_user: str | None = None
+    postgres_password: str | None = None
+    postgres_server: str | None = None
+    postgres_port: str | None = None
+    postgres_db: str | None = None
+    #настройки пула соединений
+    db_pool_class: str = "queue"            #queue - пул соединений, null - новое соединение на каждую сессию
+    db_pool_size: int = 5                   #постоянные соединения пула
+    db_max_overflow: int = 10               #временные соединения сверх db_pool_size
+    db_pool_timeout: float = 30             #ожидание свободного соединения, сек
+    db_pool_recycle: int = 1800             #пересоздание соединений старше, сек (-1 - не пересоздавать)
+    db_pool_pre_ping: bool = True           #проверка соединения перед выдачей из пула
+    db_pgbouncer: bool = False              #pgbouncer в transaction mode: отключение кэша prepared statements asyncpg
+    db_pool_warmup: int = 5                 #соединения, открываемые до приема запросов (0 - не прогревать, не больше db_pool_size)
+    #логирование
+    log_path: str | None = None             #без пути логи пишутся в stderr
+    log_level: str = "INFO"
+    #токены
+    jwt_secret: str | None = None
+    jwt_algorithm: str | None = None
+    jwt_access_lifetime: int | None = None      #срок жизни access токена, дни
+    jwt_refresh_lifetime: int | None = None     #срок жизни refresh токена, дни
+    jwt_verify_mode: str = "db"                 #db - поиск токена в БД, local - проверка подписи и срока в памяти
+    jwt_revocation_cache_size: int = 100_000    #максимальное количество отозванных токенов в памяти
+    jwt_revocation_refresh: float = 5           #период обновления списка отозванных токенов, сек
+    jwt_revocation_full_reload: float = 300     #период полной перезагрузки списка отозванных токенов, сек
+    jwt_sweep_interval: float = 600             #период удаления истекших токенов, сек
+    jwt_sweep_batch_size: int = 1000            #количество токенов, удаляемых за одну транзакцию
+    #агрегаты продаж
+    rollup_interval: float = 60                 #период обновления агрегатов, сек
+    rollup_batch_size: int = 50_000             #количество чеков, агрегируемых за одну транзакцию
+    #почта
+    smtp_host: str | None = None                #без адреса сервера письма только копятся в outbox
+    smtp_port: int = 25
+    smtp_user: str | None = None
+    smtp_password: str | None = None
+    smtp_starttls: bool = False
+    smtp_sender: str = "noreply@localhost"
+    smtp_timeout: float = 10
+    smtp_pool_size: int = 4                     #количество постоянных соединений с сервером
+    mail_batch_size: int = 100                  #количество писем, забираемых из outbox за раз
+    mail_interval: float = 2                    #пауза, когда очередь пуста, сек
+    mail_lease: float = 300                     #на это время взятые письма скрыты от других диспетчеров, сек
+    mail_max_attempts: int = 5                  #после стольких неудач письмо помечается failed
+    mail_retry_base: float = 30                 #задержка первого повтора, дальше удваивается, сек
+    mail_retry_max: float = 3600                #максимальная задержка повтора, сек
+    mail_retention: float = 7 * 24 * 3600       #сколько хранятся обработанные письма, сек
+    mail_sweep_interval: float = 60             #период очистки, сек
+    verify_code_ttl: float = 15 * 60            #время жизни кода подтверждения, сек
+    #хранилище изображений
+    blob_sweep_interval: float = 300            #период удаления файлов без ссылок, сек
+    blob_sweep_batch_size: int = 1000           #количество файлов, удаляемых за одну транзакцию
+    #служебные эндпоинты /internal
+    internal_endpoints_enabled: bool = False    #без явного включения отвечают 404
+    internal_token: str | None = None           #если задан, запрос должен передать его в заголовке X-Internal-Token
+
+    @property
+    def database_url(self) -> str:
+        return f'postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{self.postgres_server}:{self.postgres_port}/{self.postgres_db}'
+
+    @classmethod
+    def from_env(cls, env_file: str | None = None) -> "Settings":
+        if env_file: load_dotenv(env_file)
+        db_pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        return cls(
+            postgres_user=os.getenv('POSTGRES_USER'),
+            postgres_password=os.getenv('POSTGRES_PASSWORD'),
+            postgres_server=os.getenv('POSTGRES_SERVER'),
+            postgres_port=os.getenv('POSTGRES_PORT'),
+            postgres_db=os.getenv('POSTGRES_DB'),
+            db_pool_class=os.getenv('DB_POOL_CLASS', 'queue'),
+            db_pool_size=db_pool_size,
+            db_max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            db_pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            db_pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            db_pool_pre_ping=_bool(os.getenv('DB_POOL_PRE_PING', 'true')),
+            db_pgbouncer=_bool(os.getenv('DB_PGBOUNCER', 'false')),
+            db_pool_warmup=int(os.getenv('DB_POOL_WARMUP', db_pool_size)),
+            log_path=os.getenv('LOG_PATH'),
+            log_level=os.getenv('LOG_LEVEL', 'INFO'),
+            jwt_secret=os.getenv('JWT_SECRET'),
+            jwt_algorithm=os.getenv('JWT_ALGORITHM'),
+            jwt_access_lifetime=int(os.getenv('JWT_ACCESS_LIFETIME')),
+            jwt_refresh_lifetime=int(os.getenv('JWT_REFRESH_LIFETIME')),
+            jwt_verify_mode=os.getenv('JWT_VERIFY_MODE', 'db'),
+            jwt_revocation_cache_size=int(os.getenv('JWT_REVOCATION_CACHE_SIZE', 100_000)),
+            jwt_revocation_refresh=float(os.getenv('JWT_REVOCATION_REFRESH', 5)),
+            jwt_revocation_full_reload=float(os.getenv('JWT_REVOCATION_FULL_RELOAD', 300)),
+            jwt_sweep_interval=float(os.getenv('JWT_SWEEP_INTERVAL', 600)),
+            jwt_sweep_batch_size=int(os.getenv('JWT_SWEEP_BATCH_SIZE', 1000)),
+            rollup_interval=float(os.getenv('ROLLUP_INTERVAL', 60)),
+            rollup_batch_size=int(os.getenv('ROLLUP_BATCH_SIZE', 50_000)),
+            smtp_host=os.getenv('SMTP_HOST'),
+            smtp_port=int(os.getenv('SMTP_PORT', 25)),
+            smtp_user=os.getenv('SMTP_USER'),
+            smtp_password=os.getenv('SMTP_PASSWORD'),
+            smtp_starttls=_bool(os.getenv('SMTP_STARTTLS', 'false')),
+            smtp_sender=os.getenv('SMTP_SENDER', 'noreply@localhost'),
+            smtp_timeout=float(os.getenv('SMTP_TIMEOUT', 10)),
+            smtp_pool_size=int(os.getenv('SMTP_POOL_SIZE', 4)),
+            mail_batch_size=int(os.getenv('MAIL_BATCH_SIZE', 100)),
+            mail_interval=float(os.getenv('MAIL_INTERVAL', 2)),
+            mail_lease=float(os.getenv('MAIL_LEASE', 300)),
+            mail_max_attempts=int(os.getenv('MAIL_MAX_ATTEMPTS', 5)),
+            mail_retry_base=float(os.getenv('MAIL_RETRY_BASE', 30)),
+            mail_retry_max=float(os.getenv('MAIL_RETRY_MAX', 3600)),
+            mail_retention=float(os.getenv('MAIL_RETENTION', 7 * 24 * 3600)),
+            mail_sweep_interval=float(os.getenv('MAIL_SWEEP_INTERVAL', 60)),
+            verify_code_ttl=float(os.getenv('VERIFY_CODE_TTL', 15 * 60)),
+            blob_sweep_interval=float(os.getenv('BLOB_SWEEP_INTERVAL', 300)),
+            blob_sweep_batch_size=int(os.getenv('BLOB_SWEEP_BATCH_SIZE', 1000)),
+            internal_endpoints_enabled=_bool(os.getenv('INTERNAL_ENDPOINTS_ENABLED', 'false')),
+            internal_token=os.getenv('INTERNAL_TOKEN'),
+        )
+
+
+#настройки, с которыми создано приложение; модули читают их при вызове, а не при импорте
+_settings: Settings | None = None
+
+
+def configure(settings: Settings) -> Settings:
+    global _settings
+    _settings = settings
+    return settings
+
+
+def get_settings() -> Settings:
+    """settings passed to create_app, scripts running without the app get them from the environment"""
+    global _settings
+    if _settings is None: _settings = Settings.from_env()
+    return _settings